@@ -4,14 +4,14 @@ import os
 import platform
 import subprocess
 import sys
+import time
 from typing import List
 
-from latex2mathml.converter import convert
+# 进程启动计时起点，用于记录窗口首帧显示耗时
+STARTUP_TIME = time.perf_counter()
+
 from PyQt5.QtCore import (
-    QFile,
-    QIODevice,
     Qt,
-    QTextStream,
     QThread,
     QTimer,
     QUrl,
@@ -26,7 +26,6 @@ from PyQt5.QtGui import (
     QPainter,
     QPixmap,
 )
-from PyQt5.QtWebEngineWidgets import QWebEngineView
 from PyQt5.QtWidgets import (
     QApplication,
     QFileDialog,
@@ -57,30 +56,15 @@ from qfluentwidgets import (
 )
 from tools.about_dialog import AboutDialog
 from tools.clipboard_handler import ClipboardHandler
+from tools.export import wrap_latex, wrapping_names
+from tools.folder_watch import FolderWatcher
 from tools.local_processor import LocalProcessor
+from tools.math_view import MathView
+from tools.mathml import mathml_cache
 from tools.model_config_dialog import ModelConfigDialog
 from tools.shortcut_config_dialog import ShortcutConfigDialog
 
 
-def render_latex_to_html(latex_code):
-    """
-    将 LaTeX 公式转换为 HTML 内容
-
-    Args:
-        latex_code: LaTeX 公式代码
-    """
-    try:
-        fd = QFile(":/mathview.html")
-        if fd.open(QIODevice.ReadOnly | QFile.Text):
-            html = QTextStream(fd).readAll()
-            return html.replace("{latex_code}", latex_code)
-        else:
-            raise FileNotFoundError("MathView HTML file not found")
-    except Exception as e:
-        logging.error(f"LaTeX 转换错误: {str(e)}")
-        return f"<html><body>转换错误: {str(e)}</body></html>"
-
-
 def resource_path(filename: str) -> str:
     """
     获取资源文件的绝对路径，支持中文路径
@@ -165,6 +149,10 @@ class MainWindow(QMainWindow):
     """主窗口类"""
 
     process_request = pyqtSignal(QPixmap)
+    # 后台MathML转换完成: (LaTeX, Future)
+    mathml_ready = pyqtSignal(str, object)
+    # 文件夹监控识别完成: (图像路径, 识别结果, 是否成功)
+    watch_result = pyqtSignal(str, str, bool)
 
     def __init__(self):
         """
@@ -234,9 +222,16 @@ class MainWindow(QMainWindow):
         self.local_processor.finished.connect(self.on_recognition_finished)
         # 4. 主线程请求处理图片 -> 触发处理器处理图片 (使用新信号)
         self.process_request.connect(self.local_processor.process_pixmap)
+        # 5. 后台MathML转换完成 -> 在主线程复制到剪贴板
+        self.pending_mathml_latex = None
+        self.mathml_ready.connect(self.on_mathml_ready)
+        # 6. 文件夹监控识别完成 -> 在主线程更新托盘提示
+        self.folder_watcher = None
+        self.watch_count = 0
+        self.watch_result.connect(self.on_watch_result)
 
-        # 启动处理器线程 (模型加载将在线程启动后自动触发)
-        self.processor_thread.start()
+        # 处理器线程在窗口首次显示后启动 (见showEvent)，torch等模型依赖在该线程中导入，不阻塞首帧绘制
+        self._processor_started = False
 
         # 初始化窗口
         self.initWindow()
@@ -337,12 +332,9 @@ class MainWindow(QMainWindow):
         self.renderCard.setMinimumHeight(200)
 
         # 渲染标签
-        self.renderView = QWebEngineView(self.renderCard)
+        # KaTeX页面只加载一次，之后的公式通过JavaScript更新
+        self.renderView = MathView(self.base_url, "识别结果将显示在这里", self.renderCard)
         self.renderView.setMinimumHeight(150)
-        self.renderView.setHtml(
-            "<html><body><center>识别结果将显示在这里</center></body></html>",
-            baseUrl=self.base_url,
-        )
         self.renderView.setStyleSheet("border: none;")
 
         renderLayout = QVBoxLayout(self.renderCard)
@@ -351,6 +343,7 @@ class MainWindow(QMainWindow):
 
         self.latexEdit = TextEdit(self.latexCard)
         self.latexEdit.setPlaceholderText("识别出的 LaTeX 公式将显示在这里")
+        # 显示提示信息时只读，显示识别结果后可以编辑修正，修改实时预览
         self.latexEdit.setReadOnly(True)
         self.latexEdit.setMinimumHeight(100)
         self.latexEdit.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
@@ -394,7 +387,7 @@ class MainWindow(QMainWindow):
 
         self.exportLabel = QLabel("LaTeX导出格式：")
         self.exportComboBox = ComboBox(self)
-        self.exportComboBox.addItems(["不加包裹", "$$包裹", "\\begin{equation}包裹"])
+        self.exportComboBox.addItems(wrapping_names())
         self.exportComboBox.setCurrentIndex(0)
         self.exportComboBox.setFixedWidth(200)
         self.exportComboBox.currentIndexChanged.connect(self.onExportFormatChanged)
@@ -420,6 +413,15 @@ class MainWindow(QMainWindow):
 
         self.latexEdit.textChanged.connect(self.update_copy_button_state)
 
+        # 实时预览：停止输入delay_ms毫秒后只渲染最新的内容
+        live_preview = self.config.get("live_preview", {})
+        self.live_preview_enabled = live_preview.get("enabled", True)
+        self.previewTimer = QTimer(self)
+        self.previewTimer.setSingleShot(True)
+        self.previewTimer.setInterval(int(live_preview.get("delay_ms", 200)))
+        self.previewTimer.timeout.connect(self.render_live_preview)
+        self.latexEdit.textChanged.connect(self.schedule_live_preview)
+
     def onExportFormatChanged(self, index):
         """
         当导出格式改变时调用
@@ -445,6 +447,9 @@ class MainWindow(QMainWindow):
             self.copyButton.setEnabled(True)
             tooltip_text = f"模型加载完成: {device_info}"
             tooltip_state = True
+            watch_config = self.config.get("watch", {})
+            if watch_config.get("enabled", False) and watch_config.get("folder"):
+                self.start_folder_watch(watch_config["folder"])
 
         self.update_copy_button_state()
         # 显示提示
@@ -472,7 +477,7 @@ class MainWindow(QMainWindow):
             else:
                 self.logger.error(f"无法加载图片: {fileName}")
                 self.display_result_pixmap(QPixmap())
-                self.latexEdit.setText("错误：无法加载图片")
+                self.set_status_text("错误：无法加载图片")
                 self.imageLabel.setText("错误：无法加载图片")
 
     def start_screenshot_process(self):
@@ -652,16 +657,16 @@ class MainWindow(QMainWindow):
             self.logger.debug(f"存储原始图片大小: {self.original_pixmap.size()}")
 
             self._scale_and_display_image()
-            if self.local_processor.model is not None:
-                self.latexEdit.setText("正在识别图像...")
+            if self.local_processor.is_ready():
+                self.set_status_text("正在识别图像...")
                 self.process_request.emit(pixmap)
             else:
-                self.latexEdit.setText("模型尚未加载，请稍候...")
+                self.set_status_text("模型尚未加载，请稍候...")
                 self.logger.warning("无法处理图片: 模型尚未加载完成")
 
         else:
             self.logger.warning("显示图片: 接收到无效或空图片")
-            self.latexEdit.setText("图片加载失败或取消")
+            self.set_status_text("图片加载失败或取消")
             self.imageLabel.setText("图片加载失败或取消")
             self.original_pixmap = None
             self.imageLabel.setPixmap(QPixmap())
@@ -706,6 +711,20 @@ class MainWindow(QMainWindow):
         self.imageLabel.setPixmap(canvas)
         self.imageLabel.setText("")
 
+    def showEvent(self, event):
+        """
+        窗口首次显示后再启动处理器线程，模型加载期间界面保持"模型正在加载中"状态。
+        """
+        super().showEvent(event)
+        if not self._processor_started:
+            self._processor_started = True
+            # 延迟到事件循环处理完本次显示和绘制之后
+            QTimer.singleShot(0, self._start_processor_thread)
+
+    def _start_processor_thread(self):
+        self.logger.info(f"窗口已显示，启动耗时 {time.perf_counter() - STARTUP_TIME:.2f}s，开始在后台加载模型")
+        self.processor_thread.start()
+
     def resizeEvent(self, event):
         """
         窗口大小改变事件，重新缩放图片以适应新的 QLabel 大小。
@@ -773,30 +792,30 @@ class MainWindow(QMainWindow):
                 self.display_result_pixmap(pixmap)
             else:
                 self.logger.warning("从QImage转换到QPixmap失败")
-                self.latexEdit.setText("剪切板中的图片无效")
+                self.set_status_text("剪切板中的图片无效")
                 self.imageLabel.setText("剪切板中的图片无效")
         else:
             self.logger.warning("剪切板中的图片无效")
-            self.latexEdit.setText("剪切板中的图片无效")
+            self.set_status_text("剪切板中的图片无效")
             self.imageLabel.setText("剪切板中的图片无效")
 
     def on_recognition_finished(self, result):
         """识别完成后的回调函数"""
         self.logger.info(f"接收到识别结果: {result}")
 
-        # 更新 LaTeX 文本框
-        self.latexEdit.setText(result)
+        # 更新 LaTeX 文本框，识别结果可以直接编辑修正
+        self.set_status_text(result)
+        self.latexEdit.setReadOnly(result.startswith("识别失败:"))
+        if not result.startswith("识别失败:") and result.strip():
+            # 在后台预先转换MathML，复制到Word时直接使用缓存结果
+            mathml_cache().submit(result.strip())
 
-        # 更新渲染窗口
+        # 更新渲染窗口，只更新页面中的公式节点，不重新加载页面
         try:
-            # 使用 QWebEngineView 渲染公式
-            html_content = render_latex_to_html(result)
-            self.renderView.setHtml(html_content, baseUrl=self.base_url)
+            self.renderView.render_latex(result)
         except Exception as e:
             self.logger.error(f"渲染 LaTeX 公式时出错: {e}")
-            self.renderView.setHtml(
-                "<html><body><center>无法渲染当前公式</center></body></html>"
-            )
+            self.renderView.show_message("无法渲染当前公式")
 
         # 启用复制按钮
         self.copyButton.setEnabled(True)
@@ -814,6 +833,25 @@ class MainWindow(QMainWindow):
         # 保存当前的LaTeX代码
         self.current_latex = result
 
+    def set_status_text(self, text):
+        """在LaTeX文本框中显示提示信息，提示信息只读且不参与实时预览"""
+        self.previewTimer.stop()
+        self.latexEdit.setReadOnly(True)
+        self.latexEdit.setText(text)
+
+    def schedule_live_preview(self):
+        """编辑LaTeX时重新开始计时，连续输入只在停顿后渲染一次"""
+        if self.live_preview_enabled and not self.latexEdit.isReadOnly():
+            self.previewTimer.start()
+
+    def render_live_preview(self):
+        """渲染文本框中最新的LaTeX"""
+        latex = self.latexEdit.toPlainText()
+        if latex.strip():
+            self.renderView.render_latex(latex)
+        else:
+            self.renderView.show_message("识别结果将显示在这里")
+
     def closeEvent(self, event):
         """窗口关闭事件处理"""
         if self.tray_icon.isVisible():
@@ -828,12 +866,7 @@ class MainWindow(QMainWindow):
         else:
             # 如果托盘图标不可见，则正常关闭
             self.logger.info("正在关闭主窗口，停止处理器线程...")
-            self.processor_thread.quit()
-            self.processor_thread.wait(5000)
-            if self.processor_thread.isRunning():
-                self.logger.warning("处理器线程未正常终止")
-            else:
-                self.logger.info("处理器线程已停止")
+            self.stop_processor()
 
             self.tray_icon.hide()  # 确保托盘图标被移除
             event.accept()
@@ -843,16 +876,8 @@ class MainWindow(QMainWindow):
         latex_text = self.latexEdit.toPlainText()
         if latex_text:
             clipboard = QApplication.clipboard()
-            export_format = self.exportComboBox.currentIndex()
-            # 根据选择的格式添加包裹
-            if export_format == 1:  # $$包裹
-                formatted_latex = f"${latex_text}$"
-            elif export_format == 2:  # \begin{equation}\end{equation}包裹
-                formatted_latex = (
-                    f"\\begin{{equation}}\n{latex_text}\n\\end{{equation}}"
-                )
-            else:  # 不加包裹
-                formatted_latex = latex_text
+            # 根据选择的格式添加包裹，与批量导出(tools/export.py)使用同一组包裹方式
+            formatted_latex = wrap_latex(latex_text, self.exportComboBox.currentIndex())
             clipboard.setText(formatted_latex)
             self.logger.info("LaTeX结果已复制到剪贴板")
             tooltip = StateToolTip("复制成功", "LaTeX 代码已复制到剪贴板", self)
@@ -867,7 +892,7 @@ class MainWindow(QMainWindow):
             tooltip.move(self.width() - tooltip.width() - 20, 20)
 
     def copy_mathml_result(self):
-        """将识别出的LaTeX结果转换为MathML并复制到剪贴板"""
+        """将识别出的LaTeX结果转换为MathML并复制到剪贴板，转换在后台线程中进行"""
         latex_text = self.latexEdit.toPlainText().strip()
         is_placeholder_or_empty = (not latex_text) or (
             latex_text == self.latexEdit.placeholderText().strip()
@@ -875,31 +900,41 @@ class MainWindow(QMainWindow):
         is_error_message = latex_text.startswith("识别失败:")
 
         if not is_placeholder_or_empty and not is_error_message:
-            try:
-                mathml_text = convert(latex_text)
-                self.logger.debug(f"转换LaTeX到MathML:\n{mathml_text[:200]}...")
-                clipboard = QApplication.clipboard()
-                clipboard.setText(mathml_text)
-                self.logger.info("MathML结果已复制到剪贴板")
-                tooltip = StateToolTip(
-                    "复制成功", "MathML 代码已复制到剪贴板，可粘贴到Word", self
-                )
-                tooltip.setState(True)
-                tooltip.show()
-                tooltip.move(self.width() - tooltip.width() - 20, 20)
-            except Exception as e:
-                error_msg = f"MathML转换失败: {str(e)}"
-                self.logger.error(error_msg)
-                tooltip = StateToolTip("复制失败", error_msg, self)
-                tooltip.setState(False)
-                tooltip.show()
-                tooltip.move(self.width() - tooltip.width() - 20, 20)
+            future = mathml_cache().submit(latex_text)
+            # 只复制最近一次点击对应的公式
+            self.pending_mathml_latex = latex_text
+            if future.done():
+                self.on_mathml_ready(latex_text, future)
+            else:
+                self.logger.info("MathML正在后台转换，完成后复制到剪贴板")
+                future.add_done_callback(lambda f: self.mathml_ready.emit(latex_text, f))
         else:
             self.logger.warning("没有有效的LaTeX结果可转换")
-            tooltip = StateToolTip("无结果", "没有可复制的LaTeX代码", self)
-            tooltip.setState(False)
-            tooltip.show()
-            tooltip.move(self.width() - tooltip.width() - 20, 20)
+            self.show_copy_tooltip("无结果", "没有可复制的LaTeX代码", False)
+
+    def on_mathml_ready(self, latex_text, future):
+        """MathML转换完成后复制到剪贴板，在GUI线程中执行"""
+        if latex_text != self.pending_mathml_latex:
+            return
+        self.pending_mathml_latex = None
+        try:
+            mathml_text = future.result()
+        except Exception as e:
+            error_msg = f"MathML转换失败: {str(e)}"
+            self.logger.error(error_msg)
+            self.show_copy_tooltip("复制失败", error_msg, False)
+            return
+        self.logger.debug(f"转换LaTeX到MathML:\n{mathml_text[:200]}...")
+        clipboard = QApplication.clipboard()
+        clipboard.setText(mathml_text)
+        self.logger.info("MathML结果已复制到剪贴板")
+        self.show_copy_tooltip("复制成功", "MathML 代码已复制到剪贴板，可粘贴到Word", True)
+
+    def show_copy_tooltip(self, title, content, ok):
+        tooltip = StateToolTip(title, content, self)
+        tooltip.setState(ok)
+        tooltip.show()
+        tooltip.move(self.width() - tooltip.width() - 20, 20)
 
     def update_copy_button_state(self):
         """根据latexEdit的内容启用/禁用复制按钮"""
@@ -946,6 +981,8 @@ class MainWindow(QMainWindow):
         tray_menu = QMenu()
         show_action = tray_menu.addAction("显示主窗口")
         show_action.triggered.connect(self.show_from_tray)
+        self.watch_action = tray_menu.addAction("监控文件夹...")
+        self.watch_action.triggered.connect(self.toggle_folder_watch)
         quit_action = tray_menu.addAction("退出")
         quit_action.triggered.connect(self.quit_app)
 
@@ -967,8 +1004,81 @@ class MainWindow(QMainWindow):
         if reason == QSystemTrayIcon.DoubleClick:
             self.show_from_tray()
 
+    def toggle_folder_watch(self):
+        """开始或停止文件夹监控"""
+        if self.folder_watcher is not None:
+            self.stop_folder_watch()
+            return
+        folder = QFileDialog.getExistingDirectory(
+            self, "选择监控文件夹", self.config.get("watch", {}).get("folder", "")
+        )
+        if folder:
+            self.start_folder_watch(folder)
+
+    def start_folder_watch(self, folder):
+        """监控文件夹，新放入的图像与粘贴、截图共用同一个推理调度器"""
+        scheduler = self.local_processor.scheduler
+        if scheduler is None:
+            self.tray_icon.showMessage("FreeTex", "模型尚未加载完成，无法监控文件夹", QSystemTrayIcon.Warning, 3000)
+            return
+        try:
+            self.folder_watcher = FolderWatcher.from_config(
+                folder,
+                scheduler,
+                self.config.get("watch"),
+                on_result=lambda path, result, ok: self.watch_result.emit(path, result, ok),
+            )
+        except Exception as e:
+            self.logger.error(f"启动文件夹监控失败: {str(e)}")
+            self.tray_icon.showMessage("FreeTex", f"启动文件夹监控失败: {str(e)}", QSystemTrayIcon.Warning, 3000)
+            return
+        self.folder_watcher.start()
+        self.watch_count = 0
+        self.watch_action.setText("停止监控文件夹")
+        self.tray_icon.setToolTip(f"FreeTex - 正在监控 {folder}")
+        self.tray_icon.showMessage(
+            "FreeTex",
+            f"正在监控 {folder}，结果写入 {self.folder_watcher.out_path}",
+            QSystemTrayIcon.Information,
+            3000,
+        )
+
+    def stop_folder_watch(self):
+        """停止文件夹监控，等待已提交的识别写入结果"""
+        if self.folder_watcher is None:
+            return
+        self.folder_watcher.stop(timeout=10)
+        self.folder_watcher = None
+        self.watch_action.setText("监控文件夹...")
+        self.tray_icon.setToolTip("FreeTex - 智能公式识别神器")
+
+    def on_watch_result(self, path, result, ok):
+        """文件夹监控识别完成，结果已写入文件，这里只更新托盘提示"""
+        if self.folder_watcher is None:
+            return
+        self.watch_count += 1
+        self.tray_icon.setToolTip(
+            f"FreeTex - 正在监控 {self.folder_watcher.folder}，已识别 {self.watch_count} 张"
+        )
+        if not ok:
+            self.tray_icon.showMessage(
+                "FreeTex", f"{os.path.basename(path)}: {result}", QSystemTrayIcon.Warning, 3000
+            )
+
+    def stop_processor(self):
+        """停止文件夹监控和推理调度器，再结束处理器线程"""
+        self.stop_folder_watch()
+        self.local_processor.shutdown()
+        self.processor_thread.quit()
+        self.processor_thread.wait(5000)
+        if self.processor_thread.isRunning():
+            self.logger.warning("处理器线程未正常终止")
+        else:
+            self.logger.info("处理器线程已停止")
+
     def quit_app(self):
         """完全退出应用程序"""
+        self.stop_processor()
         self.tray_icon.hide()
         QApplication.quit()
 
@@ -1208,6 +1318,12 @@ def setup_webengine():
 
 
 if __name__ == "__main__":
+    # 打包后的程序以 "FreeTex serve ..." 启动后台模型进程 (见tools/model_daemon.py)
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        from tools.cli import main as cli_main
+
+        sys.exit(cli_main(sys.argv[1:]))
+
     try:
         # 创建错误日志文件
         error_log_path = os.path.join(os.path.dirname(sys.executable) if getattr(sys, "frozen", False) else os.getcwd(), 'error.log')
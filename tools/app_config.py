@@ -0,0 +1,46 @@
+"""
+应用配置和资源路径
+
+不依赖torch，GUI主线程和后台模型进程的客户端可以直接导入。
+"""
+
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+def get_base_path():
+    """
+    获取程序资源所在的基础路径(支持打包后的环境)
+    """
+    if getattr(sys, "frozen", False):
+        # 打包环境
+        if hasattr(sys, '_MEIPASS'):
+            # PyInstaller 打包环境，使用 _MEIPASS（临时解压目录）
+            base_path = sys._MEIPASS
+            logger.info(f"检测到 PyInstaller 打包环境，使用 _MEIPASS: {base_path}")
+        else:
+            # 其他打包方式，使用可执行文件目录
+            base_path = os.path.dirname(sys.executable)
+            logger.info(f"检测到打包环境，使用可执行文件目录: {base_path}")
+    else:
+        # 开发环境:使用当前目录
+        base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        logger.info(f"开发环境，基础路径: {base_path}")
+    return base_path
+
+
+def load_app_config():
+    """
+    读取config.json，文件不存在或解析失败时返回空字典
+    """
+    config_path = os.path.join(get_base_path(), "config.json")
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"配置文件加载失败: {str(e)}")
+        return {}
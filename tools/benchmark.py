@@ -0,0 +1,646 @@
+"""
+FreeTex 性能基准测试
+
+用法:
+    python -m tools.benchmark kv-cache [--length 1024] [--window 128]
+    python -m tools.benchmark attention [--images "test_imgs/*.png"]
+    python -m tools.benchmark quantization [--images "test_imgs/*.png"]
+    python -m tools.benchmark autocast [--dtype auto] [--images "test_imgs/*.png"]
+    python -m tools.benchmark compaction [--images "test_imgs/*.png"]
+    python -m tools.benchmark scheduler [--clients 8] [--requests 4] [--max-wait-ms 20]
+    python -m tools.benchmark startup [--repeat 3]
+    python -m tools.benchmark encoder [--repeat 20]
+    python -m tools.benchmark window-attention [--repeat 10] [--images "test_imgs/*.png"]
+    python -m tools.benchmark preprocess [--repeat 20] [--images "test_imgs/*.png"]
+    python -m tools.benchmark grayscale-stem [--repeat 10] [--images "test_imgs/*.png"]
+
+每个子命令加载一次模型，对比不同推理路径的耗时并以表格形式打印结果。
+只检查结果是否一致、不关心耗时时使用 python -m tools.parity。
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import torch
+from rapidfuzz.distance import Levenshtein
+
+from tools.inference import (
+    generate_batch,
+    get_base_path,
+    get_model_paths,
+    load_image,
+    load_model,
+    peak_rss_mb,
+    select_device,
+)
+from tools.parity import (
+    count_identical,
+    decoder_logits_diff,
+    encoder_relative_diff,
+    generate_outputs,
+    load_variants,
+    sync_device,
+)
+from tools.scheduler import InferenceScheduler, request_result
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+def _device(args):
+    return torch.device(args.device) if args.device else select_device()[0]
+
+
+def _load(args):
+    device = _device(args)
+    model, vis_processor = load_model(args.cfg, device)
+    image = vis_processor(load_image(args.image)).unsqueeze(0)
+    pixel_values = image.repeat(args.batch_size, 1, 1, 1).to(device)
+    return model, pixel_values, device
+
+
+def _timed_generate(model, pixel_values, device, **kwargs):
+    sync_device(device)
+    start = time.perf_counter()
+    output = model.generate({"image": pixel_values}, **kwargs)
+    sync_device(device)
+    return output, time.perf_counter() - start
+
+
+@torch.no_grad()
+def _median_encode_time(model, pixel_values, device, repeat):
+    """编码器前向repeat次的耗时中位数(秒)，前两次作为预热不计入"""
+    times = []
+    for _ in range(repeat + 2):
+        sync_device(device)
+        start = time.perf_counter()
+        model.model.encode(pixel_values)
+        sync_device(device)
+        times.append(time.perf_counter() - start)
+    times = sorted(times[2:])
+    return times[len(times) // 2]
+
+
+def _compare_per_image(models, vis_processor, paths, device):
+    """
+    逐张图像让每个模型贪心解码，参照为第一个模型
+
+    Returns:
+        ({名称: [pred_str, ...]}, {名称: 总耗时秒数})
+    """
+    results = {name: [] for name in models}
+    elapsed = dict.fromkeys(models, 0.0)
+    for path in paths:
+        pixel_values = vis_processor(load_image(path)).unsqueeze(0).to(device)
+        outputs, seconds = generate_outputs(models, pixel_values, device)
+        for name in models:
+            results[name].append(outputs[name]["pred_str"][0])
+            elapsed[name] += seconds[name]
+    return results, elapsed
+
+
+def _edit_distances(reference, candidate):
+    return [Levenshtein.normalized_distance(a, b) for a, b in zip(reference, candidate)]
+
+
+@torch.no_grad()
+def _decode_step_times(model, encoder_outputs, length, device, static_cache):
+    """逐token执行解码器并记录每一步的耗时(秒)，忽略EOS以固定解码长度"""
+    vision_model = model.model.model
+    decoder = vision_model.decoder.model.decoder
+    batch_size = encoder_outputs.last_hidden_state.shape[0]
+    input_ids = torch.full(
+        (batch_size, 1), model.tokenizer.tokenizer.bos_token_id, dtype=torch.long, device=device
+    )
+    if static_cache:
+        decoder.setup_static_cache(length)
+
+    times = []
+    past_key_values = None
+    try:
+        for _ in range(length):
+            sync_device(device)
+            start = time.perf_counter()
+            outputs = vision_model(
+                encoder_outputs=encoder_outputs,
+                decoder_input_ids=input_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            input_ids = outputs.logits[:, -1:].argmax(dim=-1)
+            past_key_values = outputs.past_key_values
+            sync_device(device)
+            times.append(time.perf_counter() - start)
+    finally:
+        if static_cache:
+            decoder.reset_static_cache()
+    return times
+
+
+def bench_kv_cache(args):
+    """对比torch.cat增长的KV缓存与预分配静态KV缓存的逐token解码延迟"""
+    model, pixel_values, device = _load(args)
+    max_length = model.model.model.config.decoder.max_position_embeddings - 2
+    length = min(args.length, max_length)
+    encoder_outputs = model.model.encode(pixel_values)
+
+    results = {}
+    for name, static_cache in (("cat", False), ("static", True)):
+        # 预热一次，避免首次分配内存计入结果
+        _decode_step_times(model, encoder_outputs, min(length, 8), device, static_cache)
+        results[name] = _decode_step_times(model, encoder_outputs, length, device, static_cache)
+        logger.info(f"{name}: 解码 {length} 个token共耗时 {sum(results[name]):.2f}s")
+
+    print(f"设备: {device}，批大小: {args.batch_size}，解码长度: {length}")
+    print(f"{'位置':>12} {'cat ms/token':>14} {'static ms/token':>16}")
+    for start in range(0, length, args.window):
+        end = min(start + args.window, length)
+        row = [sum(results[name][start:end]) / (end - start) * 1000 for name in ("cat", "static")]
+        print(f"{start:>5}-{end:<6} {row[0]:>14.3f} {row[1]:>16.3f}")
+    total = [sum(results[name]) for name in ("cat", "static")]
+    print(f"{'合计(s)':>10} {total[0]:>14.2f} {total[1]:>16.2f}")
+    return 0
+
+
+@torch.no_grad()
+def bench_attention(args):
+    """
+    SDPA注意力与eager注意力的一致性检查和耗时对比
+
+    两个模型加载同一份权重：逐张比较贪心解码结果是否一致，
+    再用eager模型的解码结果做teacher forcing，比较两者的logits。
+    """
+    device = _device(args)
+    paths = sorted(glob.glob(args.images))
+    models, vis_processor = load_variants(
+        args.cfg, device, {name: {"attn_implementation": name} for name in ("eager", "sdpa")}
+    )
+    results, elapsed = _compare_per_image(models, vis_processor, paths, device)
+    identical = count_identical(results["eager"], results["sdpa"])
+
+    max_diff = 0.0
+    for path in paths:
+        pixel_values = vis_processor(load_image(path)).unsqueeze(0).to(device)
+        pred_ids = models["eager"].generate({"image": pixel_values})["pred_ids"]
+        max_diff = max(max_diff, decoder_logits_diff(models["eager"], models["sdpa"], pixel_values, pred_ids))
+
+    print(f"设备: {device}，图像数量: {len(paths)}")
+    print(f"teacher forcing logits 最大绝对误差: {max_diff:.3e}")
+    print(f"贪心解码结果一致: {identical}/{len(paths)}")
+    print(f"eager 总耗时: {elapsed['eager']:.2f}s，sdpa 总耗时: {elapsed['sdpa']:.2f}s")
+    return 0 if identical == len(paths) else 1
+
+
+@torch.no_grad()
+def bench_quantization(args):
+    """
+    动态int8量化的精度与速度检查
+
+    以fp32模型的识别结果为参照，报告int8模型结果的平均归一化编辑距离和加速比。
+    """
+    device = torch.device("cpu")
+    paths = sorted(glob.glob(args.images))
+    models, vis_processor = load_variants(
+        args.cfg, device, {"fp32": {"quantization": None}, "int8": {"quantization": "int8_dynamic"}}
+    )
+    results, elapsed = _compare_per_image(models, vis_processor, paths, device)
+    edit_distances = _edit_distances(results["fp32"], results["int8"])
+
+    identical = sum(distance == 0 for distance in edit_distances)
+    print(f"图像数量: {len(paths)}，线程数: {torch.get_num_threads()}")
+    print(f"int8 与 fp32 结果的平均归一化编辑距离: {sum(edit_distances) / len(paths):.4f}，完全一致: {identical}/{len(paths)}")
+    print(f"fp32 总耗时: {elapsed['fp32']:.2f}s，int8 总耗时: {elapsed['int8']:.2f}s，"
+          f"加速比: {elapsed['fp32'] / elapsed['int8']:.2f}x")
+    return 0
+
+
+@torch.no_grad()
+def bench_autocast(args):
+    """
+    CPU/MPS自动混合精度(bf16/fp16)与fp32的耗时和结果一致性对比
+    """
+    from unimernet.models.blip2_models.blip2 import resolve_autocast_dtype
+
+    device = _device(args)
+    dtype = resolve_autocast_dtype(args.dtype, device)
+    if dtype is None:
+        print(f"设备 {device} 不支持 autocast_dtype={args.dtype}，请显式指定 --dtype bfloat16 或 float16")
+        return 1
+
+    paths = sorted(glob.glob(args.images))
+    models, vis_processor = load_variants(
+        args.cfg, device, {"fp32": {"autocast_dtype": None}, str(dtype): {"autocast_dtype": args.dtype}}
+    )
+    results, elapsed = _compare_per_image(models, vis_processor, paths, device)
+    edit_distances = _edit_distances(results["fp32"], results[str(dtype)])
+
+    identical = sum(distance == 0 for distance in edit_distances)
+    print(f"设备: {device}，图像数量: {len(paths)}，autocast dtype: {dtype}")
+    print(f"与 fp32 结果的平均归一化编辑距离: {sum(edit_distances) / len(paths):.4f}，完全一致: {identical}/{len(paths)}")
+    print("，".join(f"{name} 总耗时: {seconds:.2f}s" for name, seconds in elapsed.items())
+          + f"，加速比: {elapsed['fp32'] / elapsed[str(dtype)]:.2f}x")
+    return 0
+
+
+@torch.no_grad()
+def bench_compaction(args):
+    """
+    批内提前结束(compaction)贪心解码与HF generate的结果一致性和耗时对比
+
+    所有图像组成一个批次，长短公式混合时compaction只为仍在解码的公式执行解码器。
+    若配置了length_cap_ratio，同时报告按图像宽度预测的长度上限会截断多少个结果。
+    """
+    device = _device(args)
+    paths = sorted(glob.glob(args.images))
+    model, vis_processor = load_model(args.cfg, device, {"encoder_cache_size": 0})
+    pixel_values = vis_processor([load_image(path) for path in paths]).to(device)
+    length_cap_ratio = model.length_cap_ratio
+    model.length_cap_ratio = None
+
+    outputs, elapsed = {}, {}
+    for name, compact in (("generate", False), ("compaction", True)):
+        model.compact_decoding = compact
+        # 预热一次，避免首次分配内存计入结果
+        model.generate({"image": pixel_values[:1]})
+        outputs[name], elapsed[name] = _timed_generate(model, pixel_values, device)
+
+    pad_token_id = model.tokenizer.pad_token_id
+    lengths = (outputs["generate"]["pred_ids"] != pad_token_id).sum(dim=1)
+    identical = outputs["generate"]["pred_str"] == outputs["compaction"]["pred_str"]
+    print(f"设备: {device}，批大小: {len(paths)}，各公式token数: 最短 {lengths.min().item()} / 最长 {lengths.max().item()}")
+    print(f"解码器处理的token数: generate {len(paths) * lengths.max().item()}，compaction {lengths.sum().item()}")
+    print(f"结果一致: {identical}")
+    print(f"generate 耗时: {elapsed['generate']:.2f}s，compaction 耗时: {elapsed['compaction']:.2f}s，"
+          f"加速比: {elapsed['generate'] / elapsed['compaction']:.2f}x")
+
+    if length_cap_ratio is not None:
+        model.length_cap_ratio = length_cap_ratio
+        max_lengths = model.predict_max_lengths(pixel_values)
+        truncated = (lengths > max_lengths).sum().item()
+        print(f"长度上限(length_cap_ratio={length_cap_ratio})会截断 {truncated}/{len(paths)} 个结果")
+    return 0 if identical else 1
+
+
+def _run_clients(clients, requests, images, recognize):
+    """启动clients个线程，每个线程依次提交requests张图像并等待结果，返回总耗时(秒)"""
+    def client(offset):
+        for i in range(requests):
+            recognize(images[(offset + i) % len(images)])
+
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+@torch.no_grad()
+def bench_scheduler(args):
+    """
+    多个客户端并发提交识别请求时，逐个串行推理与连续批处理调度器的吞吐量对比
+    """
+    device = _device(args)
+    paths = sorted(glob.glob(args.images))
+    model, vis_processor = load_model(args.cfg, device, {"encoder_cache_size": 0})
+    images = [load_image(path) for path in paths]
+    total = args.clients * args.requests
+
+    # 现状：处理线程一次只处理一个请求，批大小为1
+    lock = threading.Lock()
+
+    def serial(image):
+        with lock:
+            return generate_batch(model, [vis_processor(image)], device)[0]
+
+    serial(images[0])
+    serial_seconds = _run_clients(args.clients, args.requests, images, serial)
+
+    scheduler = InferenceScheduler(
+        model, vis_processor, device, max_batch_size=args.batch_size, max_wait_ms=args.max_wait_ms
+    )
+    failed = []
+
+    def scheduled(image):
+        result, ok = request_result(scheduler.submit(image))
+        if not ok:
+            failed.append(result)
+
+    scheduled_seconds = _run_clients(args.clients, args.requests, images, scheduled)
+    stats = scheduler.stats()
+    scheduler.close()
+
+    print(f"设备: {device}，客户端: {args.clients}，每个客户端请求数: {args.requests}，批大小上限: {args.batch_size}")
+    print(f"串行 批大小1: {serial_seconds:.2f}s，{total / serial_seconds:.2f} 张/秒")
+    print(f"调度器: {scheduled_seconds:.2f}s，{total / scheduled_seconds:.2f} 张/秒，"
+          f"加速比: {serial_seconds / scheduled_seconds:.2f}x，失败: {len(failed)}")
+    print(f"平均排队: {stats['mean_wait_ms']:.1f}ms")
+    print(f"{'队列深度':>8} {'次数':>6}")
+    for depth, count in stats["queue_depth_histogram"].items():
+        print(f"{depth:>12} {count:>6}")
+    print(f"{'批大小':>9} {'次数':>6}")
+    for size, count in stats["batch_size_histogram"].items():
+        print(f"{size:>12} {count:>6}")
+    return 0 if not failed else 1
+
+
+# 启动基准的加载方式及对应的model_config覆盖项
+STARTUP_MODES = {
+    "random-init": {"skip_weight_init": False},
+    "meta+pth": {"skip_weight_init": True, "mmap_checkpoint": False},
+    "meta+safetensors": {"skip_weight_init": True, "mmap_checkpoint": True},
+}
+STARTUP_STAGES = (
+    ("imports", "导入"),
+    ("config", "配置解析"),
+    ("construct", "模块构建"),
+    ("weights", "权重加载"),
+    ("to_device", "设备迁移"),
+    ("processor", "视觉处理器"),
+    ("total", "合计"),
+)
+
+
+def _startup_child(args):
+    """在独立进程中加载一次模型，以JSON输出各阶段耗时和峰值内存"""
+    model, _ = load_model(args.cfg, _device(args), STARTUP_MODES[args.child])
+    print(json.dumps({"timings": model.startup_timings, "peak_rss": peak_rss_mb()}))
+    return 0
+
+
+def bench_startup(args):
+    """
+    冷启动模型加载耗时分解：随机初始化后拷贝权重、meta设备构建后映射.pth、meta设备构建后映射safetensors
+
+    每种方式在新进程中重复加载repeat次并取平均，避免前一次加载的导入和页缓存之外的状态影响结果。
+    """
+    if args.child:
+        return _startup_child(args)
+
+    modes = ["random-init", "meta+pth"]
+    if os.path.exists(os.path.splitext(get_model_paths()[1])[0] + ".safetensors"):
+        modes.append("meta+safetensors")
+    else:
+        print("未找到safetensors权重，跳过 meta+safetensors (python -m tools.fp32tofp16 --format safetensors)")
+
+    results = {}
+    for mode in modes:
+        runs = []
+        for _ in range(args.repeat):
+            command = [sys.executable, "-m", "tools.benchmark", "--cfg", args.cfg, "startup", "--child", mode]
+            if args.device:
+                command[4:4] = ["--device", args.device]
+            output = subprocess.run(
+                command, cwd=get_base_path(), capture_output=True, text=True, check=True
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[mode] = runs
+        logger.info(f"{mode}: 平均总耗时 {sum(run['timings']['total'] for run in runs) / len(runs):.2f}s")
+
+    print(f"每种方式重复 {args.repeat} 次取平均，单位: 秒")
+    print(f"{'阶段':<10}" + "".join(f"{mode:>18}" for mode in modes))
+    for key, name in STARTUP_STAGES:
+        row = [sum(run["timings"].get(key, 0.0) for run in results[mode]) / args.repeat for mode in modes]
+        print(f"{name:<10}" + "".join(f"{value:>18.2f}" for value in row))
+    row = [max(run["peak_rss"] or 0 for run in results[mode]) for mode in modes]
+    print(f"{'峰值内存MB':<10}" + "".join(f"{value:>18.0f}" for value in row))
+    return 0
+
+
+@torch.no_grad()
+def bench_encoder(args):
+    """
+    编码器前向耗时：缓存相对位置偏置 vs 每次前向重新计算
+
+    重新计算的情况通过在每次前向前清空缓存模拟，两种方式的编码器输出应完全一致。
+    """
+    from unimernet.models.unimernet.modeling_unimernet_encoder import UnimerNetSelfAttention
+
+    model, pixel_values, device = _load(args)
+    attentions = [module for module in model.modules() if isinstance(module, UnimerNetSelfAttention)]
+
+    def clear_caches():
+        for attention in attentions:
+            attention._relative_position_bias_key = None
+
+    def run(cached):
+        times, output = [], None
+        for _ in range(args.repeat + 2):
+            if not cached:
+                clear_caches()
+            sync_device(device)
+            start = time.perf_counter()
+            output = model.model.encode(pixel_values).last_hidden_state
+            sync_device(device)
+            times.append(time.perf_counter() - start)
+        # 前两次作为预热不计入
+        return output, sorted(times[2:])[len(times[2:]) // 2]
+
+    reference, uncached = run(cached=False)
+    output, cached = run(cached=True)
+    print(f"设备: {device}，批大小: {args.batch_size}，输入: {tuple(pixel_values.shape[-2:])}，重复 {args.repeat} 次取中位数")
+    print(f"每次重新计算: {uncached * 1000:.1f}ms，使用缓存: {cached * 1000:.1f}ms，加速比: {uncached / cached:.2f}x")
+    print(f"注意力层: {len(attentions)} 个，输出最大绝对误差: {(output - reference).abs().max().item():.3e}")
+    return 0 if torch.equal(output, reference) else 1
+
+
+@torch.no_grad()
+def bench_window_attention(args):
+    """
+    编码器窗口注意力：SDPA(融合qkv投影)与eager的一致性检查和耗时对比
+
+    两个模型加载同一份权重，先比较编码器输出的最大相对误差和前向耗时，再逐张比较贪心解码结果是否一致。
+    """
+    device = _device(args)
+    paths = sorted(glob.glob(args.images))
+    models, vis_processor = load_variants(
+        args.cfg, device, {name: {"encoder_attn_implementation": name} for name in ("eager", "sdpa")}
+    )
+
+    image = vis_processor(load_image(args.image)).unsqueeze(0)
+    pixel_values = image.repeat(args.batch_size, 1, 1, 1).to(device)
+    elapsed = {name: _median_encode_time(model, pixel_values, device, args.repeat) for name, model in models.items()}
+    max_diff = encoder_relative_diff(models["eager"], models["sdpa"], pixel_values)
+    results, _ = _compare_per_image(models, vis_processor, paths, device)
+    identical = count_identical(results["eager"], results["sdpa"])
+
+    print(f"设备: {device}，批大小: {args.batch_size}，输入: {tuple(image.shape[-2:])}，重复 {args.repeat} 次取中位数")
+    print(f"编码器 eager: {elapsed['eager'] * 1000:.1f}ms，sdpa: {elapsed['sdpa'] * 1000:.1f}ms，"
+          f"加速比: {elapsed['eager'] / elapsed['sdpa']:.2f}x")
+    print(f"编码器输出最大相对误差: {max_diff:.3e} (容差 {args.rtol:.0e})")
+    print(f"贪心解码结果一致: {identical}/{len(paths)}")
+    return 0 if max_diff <= args.rtol and identical == len(paths) else 1
+
+
+def bench_preprocess(args):
+    """
+    图像预处理：单通道快速路径 vs albumentations流水线(prepare_input + ToGray/Normalize/ToTensorV2)
+
+    除测试图像外，还把第一张图像放大后贴到一张4K截图大小的画布上，模拟从整屏截图中识别公式。
+    两种方式的输出应完全一致，不需要加载模型。
+    """
+    import numpy as np
+    from omegaconf import OmegaConf
+    from PIL import Image
+
+    from unimernet.processors.formula_processor import FormulaImageEvalProcessor
+
+    cfg = OmegaConf.load(args.cfg)
+    processor = FormulaImageEvalProcessor.from_config(cfg.datasets.formula_rec_eval.vis_processor.eval)
+
+    def albumentations_pipeline(image):
+        return processor.transform(image=np.array(processor.prepare_input(image)))["image"][:1]
+
+    images = [load_image(path) for path in sorted(glob.glob(args.images))]
+    screenshot = Image.new("RGB", (3840, 2160), (255, 255, 255))
+    screenshot.paste(images[0].resize((images[0].width * 3, images[0].height * 3)), (900, 700))
+    cases = [("测试图像(逐张)", images), ("4K截图", [screenshot])]
+
+    identical = all(torch.equal(albumentations_pipeline(image), processor(image)) for image in images + [screenshot])
+    print(f"每张图像重复 {args.repeat} 次取中位数，单位: 毫秒/张")
+    print(f"{'输入':<14}{'albumentations':>16}{'快速路径':>12}{'加速比':>10}")
+    for name, batch in cases:
+        row = []
+        for preprocess in (albumentations_pipeline, processor):
+            times = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for image in batch:
+                    preprocess(image)
+                times.append((time.perf_counter() - start) / len(batch))
+            row.append(sorted(times)[len(times) // 2] * 1000)
+        print(f"{name:<14}{row[0]:>16.2f}{row[1]:>12.2f}{row[0] / row[1]:>9.2f}x")
+    print(f"输出完全一致: {identical}")
+    return 0 if identical else 1
+
+
+@torch.no_grad()
+def bench_grayscale_stem(args):
+    """
+    灰度输入直接送入折叠后的单通道stem vs 复制成三通道送入原始stem
+
+    两个模型加载同一份权重，比较所有测试图像的编码器输出、贪心解码结果，以及批量编码的耗时。
+    """
+    device = _device(args)
+    paths = sorted(glob.glob(args.images))
+    models, vis_processor = load_variants(
+        args.cfg, device, {"rgb": {"grayscale_stem": False}, "gray": {"grayscale_stem": True}}
+    )
+    pixel_values = vis_processor([load_image(path) for path in paths]).to(device)
+
+    elapsed = {name: _median_encode_time(model, pixel_values, device, args.repeat) for name, model in models.items()}
+    max_diff = encoder_relative_diff(models["rgb"], models["gray"], pixel_values)
+    outputs, _ = generate_outputs(models, pixel_values, device)
+    identical = count_identical(outputs["rgb"]["pred_str"], outputs["gray"]["pred_str"])
+
+    print(f"设备: {device}，图像数量: {len(paths)}，重复 {args.repeat} 次取中位数")
+    print(f"批量编码 三通道: {elapsed['rgb'] * 1000:.1f}ms，单通道: {elapsed['gray'] * 1000:.1f}ms，"
+          f"加速比: {elapsed['rgb'] / elapsed['gray']:.2f}x")
+    print(f"编码器输出最大相对误差: {max_diff:.3e} (容差 {args.rtol:.0e})")
+    print(f"贪心解码结果一致: {identical}/{len(paths)}")
+    return 0 if max_diff <= args.rtol and identical == len(paths) else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m tools.benchmark", description="FreeTex 性能基准测试")
+    parser.add_argument("--cfg", default=os.path.join(get_base_path(), "demo.yaml"), help="模型配置文件")
+    parser.add_argument("--device", default=None, help="推理设备，例如 cpu、cuda、mps，默认自动选择")
+    parser.add_argument(
+        "--image", default=os.path.join(get_base_path(), "test_imgs", "0000000.png"), help="测试图像"
+    )
+    parser.add_argument("--batch-size", type=int, default=1, help="批大小")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    kv_parser = subparsers.add_parser("kv-cache", help="静态KV缓存与拼接KV缓存的逐token延迟")
+    kv_parser.add_argument("--length", type=int, default=1024, help="解码长度(忽略EOS)")
+    kv_parser.add_argument("--window", type=int, default=128, help="按多少个位置汇总一次平均延迟")
+    kv_parser.set_defaults(func=bench_kv_cache)
+
+    attention_parser = subparsers.add_parser("attention", help="SDPA与eager解码器注意力的一致性和耗时")
+    attention_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像通配符"
+    )
+    attention_parser.set_defaults(func=bench_attention)
+
+    quantization_parser = subparsers.add_parser("quantization", help="动态int8量化的精度和加速比(CPU)")
+    quantization_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像通配符"
+    )
+    quantization_parser.set_defaults(func=bench_quantization)
+
+    autocast_parser = subparsers.add_parser("autocast", help="CPU/MPS自动混合精度与fp32的耗时和一致性")
+    autocast_parser.add_argument("--dtype", default="auto", help="auto、bfloat16 或 float16")
+    autocast_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像通配符"
+    )
+    autocast_parser.set_defaults(func=bench_autocast)
+
+    compaction_parser = subparsers.add_parser("compaction", help="批内提前结束的贪心解码与HF generate的一致性和耗时")
+    compaction_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像通配符"
+    )
+    compaction_parser.set_defaults(func=bench_compaction)
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="并发请求下串行推理与连续批处理调度器的吞吐量")
+    scheduler_parser.add_argument("--clients", type=int, default=8, help="并发客户端数量")
+    scheduler_parser.add_argument("--requests", type=int, default=4, help="每个客户端依次提交的请求数")
+    scheduler_parser.add_argument("--max-wait-ms", type=float, default=20, help="组批时最长等待时间(毫秒)")
+    scheduler_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像通配符"
+    )
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    startup_parser = subparsers.add_parser("startup", help="冷启动模型加载各阶段耗时和峰值内存")
+    startup_parser.add_argument("--repeat", type=int, default=3, help="每种加载方式重复的次数")
+    startup_parser.add_argument("--child", choices=list(STARTUP_MODES), default=None, help=argparse.SUPPRESS)
+    startup_parser.set_defaults(func=bench_startup)
+
+    encoder_parser = subparsers.add_parser("encoder", help="编码器相对位置偏置缓存的前向加速")
+    encoder_parser.add_argument("--repeat", type=int, default=20, help="计时的前向次数")
+    encoder_parser.set_defaults(func=bench_encoder)
+
+    window_parser = subparsers.add_parser("window-attention", help="SDPA与eager编码器窗口注意力的一致性和耗时")
+    window_parser.add_argument("--repeat", type=int, default=10, help="计时的编码器前向次数")
+    window_parser.add_argument("--rtol", type=float, default=1e-3, help="编码器输出允许的最大相对误差")
+    window_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像的glob模式"
+    )
+    window_parser.set_defaults(func=bench_window_attention)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="单通道快速预处理与albumentations流水线的耗时和一致性")
+    preprocess_parser.add_argument("--repeat", type=int, default=20, help="每张图像重复的次数")
+    preprocess_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像的glob模式"
+    )
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    stem_parser = subparsers.add_parser("grayscale-stem", help="折叠为单通道的stem与三通道输入的一致性和耗时")
+    stem_parser.add_argument("--repeat", type=int, default=10, help="计时的编码器前向次数")
+    stem_parser.add_argument("--rtol", type=float, default=1e-4, help="编码器输出允许的最大相对误差")
+    stem_parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像的glob模式"
+    )
+    stem_parser.set_defaults(func=bench_grayscale_stem)
+
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+FreeTex 命令行工具
+
+用法:
+    python -m tools.cli recognize <目录|通配符|列表.txt> [...] --out results.jsonl [--resume]
+    python -m tools.cli serve [--host 127.0.0.1] [--port 8000] [--idle-timeout 秒数]
+    python -m tools.cli export results.jsonl [...] --out results.md [--out results.tex ...] [--wrap equation]
+    python -m tools.cli watch <目录> [--out results.jsonl] [--no-sidecar] [--recursive] [--poll]
+
+recognize: 模型只加载一次，图像按批次流式送入模型，每识别完一批就向输出文件追加对应的JSON记录。
+serve: 启动本地识别服务，提供OpenAI兼容的 /v1/chat/completions 接口和 /recognize 上传接口。
+export: 将recognize输出的JSONL逐行转换为Markdown、.tex、JSONL、CSV、MathML或HTML，格式由--out的扩展名决定。
+watch: 持续监控目录，新图像写入完成后自动识别，结果追加到JSONL，并在图像旁写入同名.tex文件，Ctrl+C停止。
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+# torch等模型依赖在需要加载模型的子命令中才导入，export等子命令不需要
+from tools.app_config import get_base_path, load_app_config
+from tools.export import LATEX_WRAPPINGS
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+def collect_images(inputs):
+    """
+    将命令行输入展开为图像路径列表，保持输入顺序并去重
+
+    支持三种输入：目录(递归查找图像)、通配符、每行一个路径的.txt列表文件，其余视为单个图像路径。
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(
+                    os.path.join(root, name) for name in sorted(files)
+                    if name.lower().endswith(IMAGE_EXTENSIONS)
+                )
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        elif item.lower().endswith(".txt"):
+            with open(item, "r", encoding="utf-8") as f:
+                paths.extend(line.strip() for line in f if line.strip())
+        else:
+            paths.append(item)
+    return list(dict.fromkeys(paths))
+
+
+def load_done_ids(out_path):
+    """读取已有输出文件中识别成功的图像ID，用于断点续跑，识别失败的图像会重新识别"""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                if "latex" in record:
+                    done.add(record["id"])
+            except (ValueError, KeyError, TypeError):
+                # 跳过中断时写了一半的行
+                continue
+    return done
+
+
+def _select_device(args):
+    if args.device:
+        import torch
+        return torch.device(args.device)
+    from tools.inference import select_device
+    return select_device()[0]
+
+
+def _open_cache(args):
+    if args.no_cache:
+        return None
+    from tools.inference import get_model_paths
+    from tools.result_cache import RecognitionCache
+    return RecognitionCache.from_config(load_app_config().get("cache"), get_model_paths()[1])
+
+
+def _port_in_use(host, port):
+    """检查端口是否已被其他进程监听，在加载模型之前调用，避免重复启动的服务白白加载一次模型"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(0.5)
+        return sock.connect_ex((host, port)) == 0
+
+
+def recognize(args):
+    """批量识别图像并以JSONL格式追加写入结果"""
+    from tools.inference import load_image, load_model, recognize_batch
+
+    paths = collect_images(args.inputs)
+    if args.resume:
+        done = load_done_ids(args.out)
+        skipped = sum(1 for path in paths if path in done)
+        paths = [path for path in paths if path not in done]
+        logger.info(f"断点续跑: 跳过 {skipped} 张已识别的图像")
+
+    total = len(paths)
+    if total == 0:
+        logger.info("没有需要识别的图像")
+        return 0
+
+    device = _select_device(args)
+    logger.info(f"共 {total} 张图像待识别，设备: {device}")
+    model, vis_processor = load_model(args.cfg, device)
+    cache = _open_cache(args)
+
+    start_time = time.time()
+    finished = 0
+    failed = 0
+    # 每次只读取一批图像，保证内存占用与图像总数无关
+    chunk_size = args.batch_size
+    with open(args.out, "a", encoding="utf-8") as out:
+        for start in range(0, total, chunk_size):
+            chunk = paths[start:start + chunk_size]
+            images, valid_paths = [], []
+            for path in chunk:
+                try:
+                    images.append(load_image(path))
+                    valid_paths.append(path)
+                except Exception as e:
+                    logger.error(f"图像读取失败 ({path}): {str(e)}")
+                    out.write(json.dumps({"id": path, "error": str(e)}, ensure_ascii=False) + "\n")
+                    failed += 1
+
+            for index, result, ok in recognize_batch(
+                model, vis_processor, images, device, args.batch_size, cache=cache
+            ):
+                record = {"id": valid_paths[index]}
+                if ok:
+                    record["latex"] = result
+                else:
+                    record["error"] = result
+                    failed += 1
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            finished += len(chunk)
+            elapsed = time.time() - start_time
+            logger.info(f"进度: {finished}/{total}，耗时 {elapsed:.1f}s，{finished / elapsed:.2f} 张/秒")
+
+    if cache is not None:
+        cache.close()
+    logger.info(f"识别完成: 成功 {total - failed} 张，失败 {failed} 张，结果已写入 {args.out}")
+    return 0 if failed == 0 else 1
+
+
+def serve(args):
+    """加载模型并启动本地识别服务，所有请求共用一个模型和推理调度器"""
+    from tools.inference import load_model
+    from tools.scheduler import InferenceScheduler
+    from tools.server import serve as run_server
+
+    if _port_in_use(args.host, args.port):
+        logger.error(f"端口 {args.host}:{args.port} 已被占用，本地识别服务未启动")
+        return 1
+
+    device = _select_device(args)
+    logger.info(f"本地识别服务加载模型，设备: {device}")
+    model, vis_processor = load_model(args.cfg, device)
+    scheduler = InferenceScheduler.from_config(
+        model, vis_processor, device, load_app_config().get("scheduler"), cache=_open_cache(args)
+    )
+    try:
+        run_server(scheduler, args.host, args.port, args.model_name, args.api_key, args.idle_timeout)
+    finally:
+        scheduler.close()
+        if scheduler.cache is not None:
+            scheduler.cache.close()
+    return 0
+
+
+def export(args):
+    """逐行读取识别结果并同时写入所有导出文件，内存占用与结果数量无关"""
+    from tools.export import open_exporters
+
+    total = 0
+    with open_exporters(args.out, wrapping=args.wrap) as exporters:
+        for path in args.inputs:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 跳过中断时写了一半的行
+                        continue
+                    if not isinstance(record, dict) or "id" not in record:
+                        continue
+                    exporters.write(record)
+                    total += 1
+        for exporter in exporters.exporters:
+            logger.info(f"{exporter.f.name}: 写入 {exporter.count} 条")
+    logger.info(f"导出完成: 共读取 {total} 条识别结果")
+    return 0
+
+
+def watch(args):
+    """监控目录并持续识别新放入的图像，Ctrl+C停止时等待已提交的识别完成"""
+    from tools.folder_watch import FolderWatcher
+    from tools.inference import load_model
+    from tools.scheduler import InferenceScheduler
+
+    app_config = load_app_config()
+    device = _select_device(args)
+    logger.info(f"文件夹监控加载模型，设备: {device}")
+    model, vis_processor = load_model(args.cfg, device)
+    scheduler = InferenceScheduler.from_config(
+        model, vis_processor, device, app_config.get("scheduler"), cache=_open_cache(args)
+    )
+    watcher = FolderWatcher.from_config(
+        args.folder,
+        scheduler,
+        app_config.get("watch"),
+        out_path=args.out,
+        sidecar_tex=False if args.no_sidecar else None,
+        wrapping=args.wrap,
+        recursive=True if args.recursive else None,
+        settle_ms=args.settle_ms,
+        use_inotify=False if args.poll else None,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        # run在退出前已等待已提交的识别完成并写入结果
+        pass
+    finally:
+        scheduler.close()
+        if scheduler.cache is not None:
+            scheduler.cache.close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m tools.cli", description="FreeTex 命令行工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    recognize_parser = subparsers.add_parser("recognize", help="批量识别图像中的公式")
+    recognize_parser.add_argument("inputs", nargs="+", help="图像目录、通配符或每行一个路径的.txt文件")
+    recognize_parser.add_argument("--out", required=True, help="JSONL结果文件，结果以追加方式写入")
+    recognize_parser.add_argument("--resume", action="store_true", help="跳过输出文件中已存在的图像ID")
+    recognize_parser.add_argument("--batch-size", type=int, default=8, help="每批送入模型的图像数量")
+    recognize_parser.add_argument("--cfg", default=os.path.join(get_base_path(), "demo.yaml"), help="模型配置文件")
+    recognize_parser.add_argument("--device", default=None, help="推理设备，例如 cpu、cuda、mps，默认自动选择")
+    recognize_parser.add_argument("--no-cache", action="store_true", help="不读写识别结果缓存")
+    recognize_parser.set_defaults(func=recognize)
+
+    serve_parser = subparsers.add_parser("serve", help="启动本地识别服务(OpenAI兼容接口)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    serve_parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    serve_parser.add_argument("--model-name", default="unimernet", help="接口中报告的模型名称")
+    serve_parser.add_argument("--api-key", default=None, help="设置后客户端须携带 Authorization: Bearer <api-key>")
+    serve_parser.add_argument("--cfg", default=os.path.join(get_base_path(), "demo.yaml"), help="模型配置文件")
+    serve_parser.add_argument("--device", default=None, help="推理设备，例如 cpu、cuda、mps，默认自动选择")
+    serve_parser.add_argument("--no-cache", action="store_true", help="不读写识别结果缓存")
+    serve_parser.add_argument(
+        "--idle-timeout", type=float, default=None, help="连续空闲超过该秒数后退出并释放模型，默认一直运行"
+    )
+    serve_parser.set_defaults(func=serve)
+
+    export_parser = subparsers.add_parser("export", help="将识别结果导出为Markdown、.tex、CSV、MathML、HTML等格式")
+    export_parser.add_argument("inputs", nargs="+", help="recognize输出的JSONL文件")
+    export_parser.add_argument(
+        "--out", action="append", required=True,
+        help="导出文件，可重复指定；格式由扩展名决定: .md .tex .jsonl .csv .mml/.xml .html",
+    )
+    export_parser.add_argument(
+        "--wrap", choices=[key for key, _, _ in LATEX_WRAPPINGS], default=None,
+        help="Markdown和.tex中公式的包裹方式，与GUI的LaTeX导出格式相同；默认Markdown为dollar，.tex为equation",
+    )
+    export_parser.set_defaults(func=export)
+
+    watch_parser = subparsers.add_parser("watch", help="监控目录并自动识别新放入的图像")
+    watch_parser.add_argument("folder", help="监控的目录")
+    watch_parser.add_argument("--out", default=None, help="JSONL结果文件，默认为监控目录下的freetex_results.jsonl")
+    watch_parser.add_argument("--no-sidecar", action="store_true", help="不在图像旁写入同名.tex文件")
+    watch_parser.add_argument(
+        "--wrap", choices=[key for key, _, _ in LATEX_WRAPPINGS], default=None, help="同名.tex文件中公式的包裹方式"
+    )
+    watch_parser.add_argument("--recursive", action="store_true", help="同时监控子目录")
+    watch_parser.add_argument(
+        "--settle-ms", type=int, default=None, help="文件大小和修改时间保持不变多少毫秒后视为写入完成"
+    )
+    watch_parser.add_argument("--poll", action="store_true", help="不使用inotify，定期扫描目录(网络共享目录需要)")
+    watch_parser.add_argument("--cfg", default=os.path.join(get_base_path(), "demo.yaml"), help="模型配置文件")
+    watch_parser.add_argument("--device", default=None, help="推理设备，例如 cpu、cuda、mps，默认自动选择")
+    watch_parser.add_argument("--no-cache", action="store_true", help="不读写识别结果缓存")
+    watch_parser.set_defaults(func=watch)
+
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
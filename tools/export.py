@@ -0,0 +1,283 @@
+"""
+识别结果导出
+
+LATEX_WRAPPINGS是GUI"LaTeX导出格式"下拉框和批量导出共用的公式包裹方式，两处导出的LaTeX完全一致。
+导出器逐条写入记录，不在内存中保留已写出的结果，导出任意数量的公式内存占用都保持不变。
+
+用法:
+    with open_exporters(["results.md", "results.tex"], wrapping="equation") as exporters:
+        for record in records:
+            exporters.write(record)
+
+记录为字典: {"id": 图像路径, "latex": 识别结果} 或 {"id": 图像路径, "error": 错误信息}，可选"confidence"。
+"""
+
+import base64
+import csv
+import html
+import json
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+
+from tools.app_config import get_base_path
+from tools.mathml import latex_to_mathml
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+# (键, GUI下拉框中的名称, 包裹模板)，顺序与下拉框中的选项一致
+LATEX_WRAPPINGS = [
+    ("none", "不加包裹", "{latex}"),
+    ("dollar", "$$包裹", "${latex}$"),
+    ("equation", "\\begin{equation}包裹", "\\begin{{equation}}\n{latex}\n\\end{{equation}}"),
+]
+
+
+def wrapping_names():
+    """GUI下拉框中显示的包裹方式名称"""
+    return [name for _, name, _ in LATEX_WRAPPINGS]
+
+
+def wrap_latex(latex, wrapping="none"):
+    """
+    按包裹方式包裹LaTeX公式
+
+    Args:
+        latex: LaTeX公式
+        wrapping: LATEX_WRAPPINGS中的键或序号(GUI下拉框的currentIndex)
+    """
+    if isinstance(wrapping, int):
+        template = LATEX_WRAPPINGS[wrapping][2]
+    else:
+        template = next((t for key, _, t in LATEX_WRAPPINGS if key == wrapping), None)
+        if template is None:
+            raise ValueError(f"未知的包裹方式: {wrapping}")
+    return template.format(latex=latex)
+
+
+class Exporter(ABC):
+    """导出器基类，子类实现record，按需实现header/footer，只处理识别成功的记录"""
+
+    extensions = ()
+    # 是否同时输出识别失败的记录
+    include_errors = False
+
+    def __init__(self, f, wrapping=None):
+        self.f = f
+        self.wrapping = wrapping
+        self.count = 0
+
+    def header(self):
+        pass
+
+    @abstractmethod
+    def record(self, record):
+        """写出一条记录，返回False表示该记录没有成功导出，不计入count"""
+
+    def footer(self):
+        pass
+
+    def write(self, record):
+        if "latex" not in record and not self.include_errors:
+            return
+        if self.record(record) is not False:
+            self.count += 1
+
+
+class JSONLExporter(Exporter):
+    extensions = (".jsonl",)
+    include_errors = True
+
+    def record(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class CSVExporter(Exporter):
+    extensions = (".csv",)
+    include_errors = True
+    columns = ("id", "latex", "confidence", "error")
+
+    def __init__(self, f, wrapping=None):
+        super().__init__(f, wrapping)
+        self.writer = csv.writer(f)
+
+    def header(self):
+        self.writer.writerow(self.columns)
+
+    def record(self, record):
+        self.writer.writerow([record.get(column, "") for column in self.columns])
+
+
+class MarkdownExporter(Exporter):
+    extensions = (".md", ".markdown")
+    default_wrapping = "dollar"
+
+    def record(self, record):
+        path = record["id"]
+        # 尖括号使含空格的路径也能作为链接目标
+        self.f.write(f"## {os.path.basename(path)}\n\n![](<{path}>)\n\n")
+        self.f.write(wrap_latex(record["latex"], self.wrapping or self.default_wrapping) + "\n\n")
+
+
+class TeXExporter(Exporter):
+    """可直接用pdflatex/xelatex编译的完整文档"""
+
+    extensions = (".tex",)
+    default_wrapping = "equation"
+
+    def header(self):
+        self.f.write("\\documentclass{article}\n\\usepackage{amsmath,amssymb}\n\\begin{document}\n\n")
+
+    def record(self, record):
+        # 注释中的换行会让后续内容逃出注释
+        path = record["id"].replace("\n", " ")
+        self.f.write(f"% {path}\n")
+        self.f.write(wrap_latex(record["latex"], self.wrapping or self.default_wrapping) + "\n\n")
+
+    def footer(self):
+        self.f.write("\\end{document}\n")
+
+
+class MathMLExporter(Exporter):
+    """每条公式一个<formula>元素，MathML来自与GUI共用的转换缓存"""
+
+    extensions = (".mml", ".xml")
+
+    def header(self):
+        self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n<formulas>\n')
+
+    def record(self, record):
+        try:
+            mathml = latex_to_mathml(record["latex"])
+        except Exception as e:
+            logger.warning(f"MathML转换失败 ({record['id']}): {str(e)}")
+            self.f.write(f"  <formula id={quoteattr(record['id'])} error={quoteattr(str(e))}/>\n")
+            return False
+        self.f.write(f"  <formula id={quoteattr(record['id'])}>{mathml}</formula>\n")
+
+    def footer(self):
+        self.f.write("</formulas>\n")
+
+
+@lru_cache(maxsize=1)
+def bundled_katex():
+    """
+    读取程序自带的KaTeX(libs/katex)，字体以data URI嵌入样式表，导出的HTML不依赖网络和其他文件
+
+    Returns:
+        (样式表, 脚本)
+    """
+    katex_dir = os.path.join(get_base_path(), "libs", "katex")
+    with open(os.path.join(katex_dir, "katex.min.css"), encoding="utf-8") as f:
+        css = f.read()
+    with open(os.path.join(katex_dir, "katex.min.js"), encoding="utf-8") as f:
+        js = f.read()
+
+    def embed_font(match):
+        with open(os.path.join(katex_dir, "fonts", match.group(1)), "rb") as font:
+            data = base64.b64encode(font.read()).decode("ascii")
+        return f"url(data:font/woff2;base64,{data})"
+
+    # 现代浏览器都支持woff2，去掉woff/ttf备选字体以减小页面体积
+    css = re.sub(r',url\(fonts/[^)]+\.(?:woff|ttf)\) format\("[^"]+"\)', "", css)
+    css = re.sub(r"url\(fonts/([^)]+\.woff2)\)", embed_font, css)
+    return css, js
+
+
+class HTMLExporter(Exporter):
+    """用KaTeX在浏览器中渲染的HTML页面，公式逐条写出，页面加载完成后统一渲染"""
+
+    extensions = (".html", ".htm")
+
+    def header(self):
+        css, js = bundled_katex()
+        self.f.write(
+            "<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"UTF-8\">\n"
+            f"<style>{css}</style>\n"
+            f"<script>{js}</script>\n"
+            "<style>figure { margin: 1em 0; padding: 1em; border-bottom: 1px solid #ddd; }"
+            " figcaption { color: #666; font-size: 12px; } img { max-width: 100%; }</style>\n"
+            "</head>\n<body>\n"
+        )
+
+    def record(self, record):
+        path = html.escape(record["id"])
+        # 图像路径转为绝对file URI，Windows路径和含#、?、%的文件名都能正确引用，与HTML文件所在目录无关
+        src = html.escape(Path(record["id"]).resolve().as_uri())
+        self.f.write(
+            f"<figure><img src=\"{src}\" loading=\"lazy\">"
+            f"<div class=\"math\">{html.escape(record['latex'])}</div>"
+            f"<figcaption>{path}</figcaption></figure>\n"
+        )
+
+    def footer(self):
+        self.f.write(
+            "<script>\ndocument.querySelectorAll(\".math\").forEach(function (el) {\n"
+            "    katex.render(el.textContent, el, { displayMode: true, throwOnError: false });\n"
+            "});\n</script>\n</body>\n</html>\n"
+        )
+
+
+EXPORTERS = {
+    "jsonl": JSONLExporter,
+    "csv": CSVExporter,
+    "markdown": MarkdownExporter,
+    "tex": TeXExporter,
+    "mathml": MathMLExporter,
+    "html": HTMLExporter,
+}
+
+
+def exporter_for_path(path):
+    """根据文件扩展名选择导出格式"""
+    extension = os.path.splitext(path)[1].lower()
+    for name, exporter_class in EXPORTERS.items():
+        if extension in exporter_class.extensions:
+            return name
+    raise ValueError(f"无法根据扩展名确定导出格式: {path}")
+
+
+class ExporterGroup:
+    """同时写入多个导出文件，每条记录只读取一次"""
+
+    def __init__(self, exporters):
+        self.exporters = exporters
+
+    def write(self, record):
+        for exporter in self.exporters:
+            exporter.write(record)
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.f.flush()
+
+
+@contextmanager
+def open_exporters(paths, wrapping=None):
+    """
+    打开一个或多个导出文件，退出时写入文件结尾并关闭
+
+    Args:
+        paths: 输出文件路径，格式由扩展名决定，也可以传入(路径, 格式)
+        wrapping: Markdown和.tex中公式的包裹方式，默认分别为dollar和equation
+
+    Yields:
+        ExporterGroup
+    """
+    with ExitStack() as stack:
+        exporters = []
+        for item in paths:
+            path, name = item if isinstance(item, tuple) else (item, exporter_for_path(item))
+            # csv模块要求newline=""，由writer自行处理换行
+            f = stack.enter_context(open(path, "w", encoding="utf-8", newline=""))
+            exporter = EXPORTERS[name](f, wrapping)
+            exporter.header()
+            # 先于文件关闭执行
+            stack.callback(exporter.footer)
+            exporters.append(exporter)
+        yield ExporterGroup(exporters)
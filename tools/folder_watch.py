@@ -0,0 +1,459 @@
+"""
+文件夹监控
+
+持续监控一个目录，新放入的图像写入完成后自动送入推理调度器识别，结果追加到JSONL文件，
+并可在图像旁写入同名的.tex文件。GUI托盘菜单和命令行watch子命令共用本模块，不依赖Qt。
+
+- 变化通知：Linux上使用inotify(通过ctypes调用libc，无需额外依赖)，不可用时或指定poll时定期扫描目录。
+  挂载的网络共享上其他主机写入的文件不会产生inotify事件，此时应使用轮询。
+- 写入未完成的文件：文件大小和修改时间连续settle_ms毫秒不变才视为写入完成，
+  之后仍无法解码的图像记录错误，文件再次变化时重新识别。
+- 去重：按文件内容的SHA-256去重，内容相同的图像(包括正在识别中的)直接复用识别结果，不再送入模型。
+  只保留最近dedup_entries个内容的结果，长时间运行时内存占用不会一直增长。
+  JSONL中已成功识别的记录在启动时读入，重启后不会重复识别。
+- 批量推理：同一次扫描中写入完成的图像不等待结果依次提交给调度器，由调度器合并成批次。
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from tools.export import wrap_latex
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+class Inotify:
+    """libc inotify的最小封装，只用于获知哪些文件发生了变化"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify仅在Linux上可用")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._dirs = {}
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self._dirs[wd] = path
+
+    def read(self, timeout):
+        """
+        等待最多timeout秒，返回[(所在目录, 文件名, mask), ...]
+
+        队列溢出时返回的事件中包含IN_Q_OVERFLOW，调用方应重新扫描整个目录。
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            events.append((self._dirs.get(wd), name, mask))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def sidecar_path(image_path):
+    """图像旁的.tex结果文件路径"""
+    return os.path.splitext(image_path)[0] + ".tex"
+
+
+def _write_text_atomic(path, text):
+    # 先写临时文件再替换，读取方不会看到写了一半的内容
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class FolderWatcher:
+    """
+    监控目录并把写入完成的新图像交给调度器识别
+
+    scheduler可以是InferenceScheduler或ModelDaemonClient，只使用submit(image, request_id, callback)。
+    结果回调on_result(path, result, ok)在结果就绪的线程中调用。
+    """
+
+    def __init__(self, folder, scheduler, out_path=None, sidecar_tex=True, wrapping="none", recursive=False,
+                 settle_ms=1000, poll_interval_ms=1000, use_inotify=True, drain_timeout_ms=60000, dedup_entries=10000,
+                 on_result=None):
+        self.folder = os.path.abspath(folder)
+        if not os.path.isdir(self.folder):
+            raise NotADirectoryError(f"监控目录不存在: {folder}")
+        self.scheduler = scheduler
+        self.out_path = out_path or os.path.join(self.folder, "freetex_results.jsonl")
+        self.sidecar_tex = sidecar_tex
+        self.wrapping = wrapping or "none"
+        # 检查传入的包裹方式，避免运行后每次写入.tex时才报错
+        wrap_latex("", self.wrapping)
+        self.recursive = recursive
+        self.settle = max(0.0, float(settle_ms)) / 1000
+        self.poll_interval = max(0.05, float(poll_interval_ms) / 1000)
+        self.use_inotify = use_inotify
+        # 停止时最多等待已提交的识别这么久，调度器工作线程异常退出时不会一直等待
+        self.drain_timeout = max(0.0, float(drain_timeout_ms)) / 1000
+        self.dedup_entries = max(1, int(dedup_entries))
+        self.on_result = on_result
+
+        # 等待写入完成的文件: 路径 -> (大小, 修改时间, 开始保持不变的时间)
+        self._pending = {}
+        # 已处理文件的(大小, 修改时间)，文件再次变化时重新识别；文件删除或移走后不再保留
+        self._processed = {}
+        # 内容哈希 -> Future，内容相同的图像共用一次识别；按最近使用排序，已完成的超过dedup_entries个时淘汰最旧的
+        self._results = OrderedDict()
+        # 尚未执行完的结果回调数，重复的图像共用Future但各有一个回调
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._out_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        self._out = None
+
+        self.submitted = 0
+        self.duplicates = 0
+        self.completed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_config(cls, folder, scheduler, watch_config=None, on_result=None, **overrides):
+        """根据config.json中的watch配置创建监控器，overrides中非None的参数优先"""
+        watch_config = watch_config or {}
+        kwargs = dict(
+            out_path=watch_config.get("out") or None,
+            sidecar_tex=watch_config.get("sidecar_tex", True),
+            wrapping=watch_config.get("wrapping", "none"),
+            recursive=watch_config.get("recursive", False),
+            settle_ms=watch_config.get("settle_ms", 1000),
+            poll_interval_ms=watch_config.get("poll_interval_ms", 1000),
+            use_inotify=watch_config.get("use_inotify", True),
+            drain_timeout_ms=watch_config.get("drain_timeout_ms", 60000),
+            dedup_entries=watch_config.get("dedup_entries", 10000),
+        )
+        kwargs.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(folder, scheduler, on_result=on_result, **kwargs)
+
+    def _load_previous_results(self):
+        """读入JSONL中已有的识别结果，返回其中的图像路径"""
+        done = set()
+        if not os.path.exists(self.out_path):
+            return done
+        with open(self.out_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    path = record["id"]
+                except (ValueError, KeyError, TypeError):
+                    # 跳过中断时写了一半的行
+                    continue
+                if "latex" not in record:
+                    # 识别失败的图像在重启后重新识别
+                    continue
+                done.add(path)
+                digest = record.get("sha256")
+                if digest:
+                    future = Future()
+                    future.set_result(record["latex"])
+                    self._remember(digest, future)
+        return done
+
+    def _remember(self, digest, future):
+        """记录内容哈希的识别结果，调用方持有self._lock或尚未启动监控"""
+        self._results[digest] = future
+        self._results.move_to_end(digest)
+        while len(self._results) > self.dedup_entries:
+            # 正在识别的内容不淘汰，重复的图像仍要等待它的结果
+            oldest = next((key for key, result in self._results.items() if result.done()), None)
+            if oldest is None:
+                break
+            del self._results[oldest]
+
+    def _forget(self, path):
+        """文件被删除或移走，之后同一路径出现的文件作为新文件处理"""
+        self._pending.pop(path, None)
+        self._processed.pop(path, None)
+
+    def _is_image(self, name):
+        return not name.startswith((".", "~")) and name.lower().endswith(IMAGE_EXTENSIONS)
+
+    def _scan(self):
+        """扫描目录，把新出现或发生变化的图像加入等待列表，并忘记已经不存在的文件"""
+        seen = set()
+        for root, dirs, files in os.walk(self.folder):
+            if not self.recursive:
+                dirs[:] = []
+            for name in files:
+                if self._is_image(name):
+                    path = os.path.join(root, name)
+                    seen.add(path)
+                    self._track(path)
+        for path in list(self._processed):
+            if path not in seen:
+                self._processed.pop(path, None)
+
+    def _track(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._forget(path)
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if self._processed.get(path) == signature:
+            return
+        previous = self._pending.get(path)
+        if previous is None or previous[:2] != signature:
+            self._pending[path] = (*signature, time.monotonic())
+
+    def _ready_files(self):
+        """返回大小和修改时间已保持settle秒不变的文件"""
+        now = time.monotonic()
+        ready = []
+        for path, (size, mtime_ns, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif size > 0 and now - since >= self.settle:
+                del self._pending[path]
+                ready.append((path, (size, mtime_ns)))
+        return sorted(ready)
+
+    def _handle_events(self, events):
+        for directory, name, mask in events:
+            if mask & Inotify.IN_Q_OVERFLOW:
+                logger.warning("inotify事件队列溢出，重新扫描监控目录")
+                self._scan()
+                continue
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            if mask & Inotify.IN_ISDIR:
+                if self.recursive and mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                    self._watch_tree(path)
+            elif self._is_image(name):
+                if mask & (Inotify.IN_DELETE | Inotify.IN_MOVED_FROM):
+                    self._forget(path)
+                else:
+                    self._track(path)
+
+    def _watch_tree(self, top):
+        """为目录(递归监控时包括其子目录)添加inotify监控，并扫描其中已有的文件"""
+        for root, dirs, files in os.walk(top):
+            try:
+                self._inotify.add_watch(root)
+            except OSError as e:
+                logger.warning(f"无法监控目录 {root}: {str(e)}")
+            if not self.recursive:
+                dirs[:] = []
+            for name in files:
+                if self._is_image(name):
+                    self._track(os.path.join(root, name))
+
+    def _ingest(self, path, signature):
+        """读取写入完成的图像，按内容去重后提交给调度器"""
+        from PIL import Image
+
+        self._processed[path] = signature
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+        except OSError as e:
+            logger.error(f"图像读取失败 ({path}): {str(e)}")
+            self._finish(path, None, f"识别失败: {str(e)}", False)
+            return
+
+        with self._lock:
+            future = self._results.get(digest)
+            if future is not None:
+                self._results.move_to_end(digest)
+        if future is not None:
+            self.duplicates += 1
+            logger.info(f"内容与已识别的图像相同，复用识别结果: {path}")
+        else:
+            try:
+                image = Image.open(io.BytesIO(data))
+                image.load()
+                image = image.convert("RGB")
+            except Exception as e:
+                logger.error(f"图像解码失败 ({path}): {str(e)}")
+                self._finish(path, digest, f"识别失败: {str(e)}", False)
+                return
+            future = self.scheduler.submit(image, path)
+            with self._lock:
+                self._remember(digest, future)
+            self.submitted += 1
+
+        with self._lock:
+            self._in_flight += 1
+        future.add_done_callback(lambda f: self._on_done(path, signature, digest, f))
+
+    def _on_done(self, path, signature, digest, future):
+        from tools.scheduler import request_result
+
+        try:
+            result, ok = request_result(future)
+            if not ok:
+                with self._lock:
+                    # 识别失败的内容下次出现时重新识别
+                    if self._results.get(digest) is future:
+                        del self._results[digest]
+                    # 识别出错（如模型服务未启动）时允许重试，解码失败的图像仍等文件变化后再识别
+                    if self._processed.get(path) == signature:
+                        self._processed.pop(path, None)
+            self._finish(path, digest, result, ok)
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def _finish(self, path, digest, result, ok):
+        record = {"id": path}
+        if ok:
+            record["latex"] = result
+        else:
+            record["error"] = result
+        if digest is not None:
+            record["sha256"] = digest
+        with self._out_lock:
+            if self._out is None:
+                # 停止监控时等待超时，输出文件已关闭
+                logger.warning(f"文件夹监控已停止，识别结果未写入 {self.out_path}: {path}")
+                return
+            self._out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._out.flush()
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if ok and self.sidecar_tex:
+            try:
+                _write_text_atomic(sidecar_path(path), wrap_latex(result, self.wrapping) + "\n")
+            except OSError as e:
+                logger.error(f"写入.tex结果失败 ({path}): {str(e)}")
+        logger.info(f"文件夹监控识别{'完成' if ok else '失败'}: {path}")
+        if self.on_result is not None:
+            try:
+                self.on_result(path, result, ok)
+            except Exception as e:
+                logger.error(f"文件夹监控结果回调出错: {str(e)}")
+
+    def run(self):
+        """在当前线程中监控目录，直到stop被调用"""
+        done = self._load_previous_results()
+        self._out = open(self.out_path, "a", encoding="utf-8")
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                logger.info(f"inotify不可用，改为每{self.poll_interval:g}秒扫描一次目录: {str(e)}")
+        mode = "inotify" if self._inotify is not None else "轮询"
+        logger.info(f"开始监控文件夹 ({mode}): {self.folder}，结果写入 {self.out_path}")
+
+        if self._inotify is not None:
+            self._watch_tree(self.folder)
+        else:
+            self._scan()
+        # 启动前已记录在JSONL中的图像视为已处理，文件之后发生变化时仍会重新识别
+        for path in done & self._pending.keys():
+            size, mtime_ns, _ = self._pending.pop(path)
+            self._processed[path] = (size, mtime_ns)
+
+        try:
+            while not self._stop.is_set():
+                for path, signature in self._ready_files():
+                    self._ingest(path, signature)
+                # 有文件等待写入完成时按settle的一半检查，否则等待下一次事件或扫描
+                timeout = self.poll_interval
+                if self._pending:
+                    timeout = min(timeout, max(0.05, self.settle / 2))
+                if self._inotify is not None:
+                    self._handle_events(self._inotify.read(timeout))
+                elif not self._stop.wait(timeout):
+                    self._scan()
+        finally:
+            self._drain()
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            with self._out_lock:
+                self._out.close()
+                self._out = None
+            logger.info(
+                f"停止监控文件夹: {self.folder}，送入模型 {self.submitted} 张，内容重复 {self.duplicates} 张，"
+                f"成功 {self.completed} 张，失败 {self.failed} 张"
+            )
+
+    def _drain(self):
+        """等待已提交的识别完成、结果回调写完后再关闭输出文件，最多等待drain_timeout秒"""
+        with self._idle:
+            if not self._idle.wait_for(lambda: self._in_flight == 0, self.drain_timeout):
+                logger.warning(
+                    f"等待识别完成超时 ({self.drain_timeout:g}秒)，{self._in_flight} 张图像的结果将不会写入"
+                )
+
+    def start(self):
+        """在后台线程中开始监控"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="FolderWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止监控，等待已提交的识别完成"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -1,6 +1,20 @@
-import torch
+"""
+模型权重格式转换
+
+用法:
+    python -m tools.fp32tofp16 [权重文件] [--format pth|safetensors] [--dtype fp16|fp32] [-o 输出文件]
+
+默认将 models/unimernet_small/unimernet_small.pth 转换为 fp16 的 .fp16.pth。
+--format safetensors 导出可被内存映射加载的 .safetensors 文件(默认 fp32)，
+放在原权重旁边且比原权重新时，推理会自动优先使用它。
+"""
+
+import argparse
+import json
 import os
 
+import torch
+
 
 def convert_to_fp16(state_dict: dict) -> dict:
     """将 state_dict 中所有 float32 张量转换为 float16"""
@@ -29,5 +43,58 @@ def convert_pth_to_fp16_keep_structure(input_path, output_path=None):
     print(f"已保存 fp16 模型: {output_path}")
 
 
+def convert_pth_to_safetensors(input_path, output_path=None, fp16=False):
+    """
+    将 .pth 权重导出为 safetensors
+
+    safetensors 不允许多个名称共享同一块存储(例如绑定的输入/输出词嵌入)，
+    共享的张量只保存一份，其余名称记录在元数据 "aliases" 中，加载时再恢复。
+    """
+    from safetensors.torch import save_file
+
+    print(f"加载模型文件: {input_path}")
+    data = torch.load(input_path, map_location="cpu")
+    state_dict = data.get("model", data.get("state_dict", data))
+    if fp16:
+        state_dict = convert_to_fp16(state_dict)
+
+    tensors, aliases, seen = {}, {}, {}
+    for key, tensor in state_dict.items():
+        if not isinstance(tensor, torch.Tensor):
+            continue
+        storage = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tuple(tensor.shape), tensor.dtype)
+        if storage in seen:
+            aliases[key] = seen[storage]
+            continue
+        seen[storage] = key
+        tensors[key] = tensor.contiguous()
+
+    if output_path is None:
+        base, _ = os.path.splitext(input_path)
+        output_path = base + (".fp16" if fp16 else "") + ".safetensors"
+
+    save_file(tensors, output_path, metadata={"aliases": json.dumps(aliases)})
+    print(f"已保存 safetensors 模型: {output_path} ({len(tensors)} 个张量，{len(aliases)} 个共享名称)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tools.fp32tofp16", description="模型权重格式转换")
+    parser.add_argument("input", nargs="?", default="models/unimernet_small/unimernet_small.pth", help="输入的.pth权重")
+    parser.add_argument("-o", "--output", default=None, help="输出文件，默认放在输入文件旁边")
+    parser.add_argument("--format", choices=("pth", "safetensors"), default="pth", help="输出格式")
+    parser.add_argument("--dtype", choices=("fp16", "fp32"), default=None,
+                        help="输出精度，默认 .pth 为 fp16、safetensors 为 fp32(与模型精度一致才能零拷贝加载)")
+    args = parser.parse_args(argv)
+    if args.dtype is None:
+        args.dtype = "fp32" if args.format == "safetensors" else "fp16"
+
+    if args.format == "safetensors":
+        convert_pth_to_safetensors(args.input, args.output, fp16=args.dtype == "fp16")
+    elif args.dtype == "fp16":
+        convert_pth_to_fp16_keep_structure(args.input, args.output)
+    else:
+        parser.error("fp32 的 .pth 无需转换")
+
+
 if __name__ == "__main__":
-    convert_pth_to_fp16_keep_structure("models/unimernet_small/unimernet_small.pth")
+    main()
@@ -0,0 +1,293 @@
+import logging
+import os
+import platform
+import time
+
+import torch
+from PIL import Image
+
+from tools.app_config import get_base_path, load_app_config  # noqa: F401
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+# recognize_batch调用model.generate时使用的生成参数，同时参与结果缓存键的计算
+GENERATION_PARAMS = {"temperature": 0.2, "do_sample": False, "top_p": 0.95}
+
+
+def select_device():
+    """
+    智能设备选择：优先级 CUDA > MPS > CPU
+
+    Returns:
+        (device, device_name): torch设备及其显示名称
+    """
+    if torch.cuda.is_available():
+        return torch.device("cuda"), "CUDA"
+    if platform.system() == "Darwin" and hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+        # macOS 上优先使用 MPS (Apple Silicon GPU)
+        return torch.device("mps"), "MPS (Apple Silicon)"
+    return torch.device("cpu"), "CPU"
+
+
+def get_model_paths():
+    """
+    Returns:
+        (model_path, pretrained_path): 模型目录和预训练权重文件路径
+    """
+    model_path = os.path.join(get_base_path(), "models", "unimernet_small")
+    pretrained_path = os.path.join(model_path, "unimernet_small.pth")
+    converted_path = os.path.join(model_path, "unimernet_small.safetensors")
+    # 只分发了safetensors权重时直接使用它
+    if not os.path.exists(pretrained_path) and os.path.exists(converted_path):
+        pretrained_path = converted_path
+    return model_path, pretrained_path
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存(MB)，无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux以KB为单位，macOS以字节为单位
+        return peak / 1024 / 1024 if platform.system() == "Darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize / 1024 / 1024
+    except Exception:
+        pass
+    return None
+
+
+def load_model(cfg_path, device, model_config=None):
+    """
+    读取配置文件，构建UniMERModel并加载视觉处理器
+
+    Args:
+        cfg_path: demo.yaml配置文件路径
+        device: 模型所在设备
+        model_config: 可选，覆盖配置文件中model.model_config的字段，例如{"attn_implementation": "sdpa"}
+
+    Returns:
+        (model, vis_processor): 处于评估模式的模型和FormulaImageEvalProcessor
+    """
+    start_time = time.perf_counter()
+    # 只导入推理需要的模型和视觉处理器，不经过注册表、Config和训练任务，
+    # 避免加载数据集构建器、训练增强和评测依赖
+    from omegaconf import OmegaConf
+    from unimernet.models.unimernet.unimernet import UniMERModel
+    from unimernet.processors.formula_processor import FormulaImageEvalProcessor
+    import yaml
+
+    # 各启动阶段的耗时(秒)
+    timings = {"imports": time.perf_counter() - start_time}
+    stage_start = time.perf_counter()
+    # 读取配置文件并修正路径
+    with open(cfg_path, 'r', encoding='utf-8') as f:
+        cfg_dict = yaml.safe_load(f)
+
+    base_path = get_base_path()
+
+    # 修正配置中的路径
+    model_path, pretrained_path = get_model_paths()
+
+    # 验证模型文件是否存在
+    if not os.path.exists(model_path):
+        logger.error(f"模型目录不存在: {model_path}")
+        # 列出 base_path 下的内容以便调试
+        if os.path.exists(base_path):
+            logger.info(f"base_path 内容: {os.listdir(base_path)}")
+            models_dir = os.path.join(base_path, "models")
+            if os.path.exists(models_dir):
+                logger.info(f"models 目录内容: {os.listdir(models_dir)}")
+        raise FileNotFoundError(f"模型目录不存在: {model_path}")
+
+    if not os.path.exists(pretrained_path):
+        logger.error(f"预训练权重文件不存在: {pretrained_path}")
+        # 列出模型目录内容以便调试
+        if os.path.exists(model_path):
+            logger.info(f"模型目录内容: {os.listdir(model_path)}")
+        raise FileNotFoundError(f"预训练权重文件不存在: {pretrained_path}")
+
+    # 更新所有与路径相关的配置
+    cfg_dict['model']['model_name'] = model_path
+    cfg_dict['model']['pretrained'] = pretrained_path
+    cfg_dict['model']['model_config']['model_name'] = model_path
+    cfg_dict['model']['model_config']['path'] = model_path
+    cfg_dict['model']['model_config'].update(model_config or {})
+
+    # 动态int8量化的模块只能在CPU上运行
+    if cfg_dict['model']['model_config'].get('quantization') and device.type != "cpu":
+        logger.warning(f"量化仅支持CPU，当前设备为 {device}，已忽略 quantization 配置")
+        cfg_dict['model']['model_config']['quantization'] = None
+
+    # 更新 tokenizer_config 路径
+    if 'tokenizer_config' in cfg_dict['model']:
+        cfg_dict['model']['tokenizer_config']['path'] = model_path
+
+    logger.info(f"模型路径: {model_path}")
+    logger.info(f"预训练权重: {pretrained_path}")
+
+    # 与Config.build_model_config相同：模型默认配置 < demo.yaml中的model配置
+    model_cfg = OmegaConf.merge(
+        OmegaConf.load(UniMERModel.default_config_path(cfg_dict['model'].get('model_type', 'unimernet'))),
+        {"model": cfg_dict['model']},
+    ).model
+    processor_cfg = OmegaConf.create(cfg_dict['datasets']['formula_rec_eval']['vis_processor']['eval'])
+    timings["config"] = time.perf_counter() - stage_start
+
+    # Load model and move to device
+    model = UniMERModel.from_config(model_cfg)
+    timings.update(getattr(model, "load_timings", {}))
+    stage_start = time.perf_counter()
+    model = model.to(device)
+    model.eval()
+    timings["to_device"] = time.perf_counter() - stage_start
+    logger.info("模型已构建并移动到设备")
+    # Load processor
+    stage_start = time.perf_counter()
+    vis_processor = FormulaImageEvalProcessor.from_config(processor_cfg)
+    timings["processor"] = time.perf_counter() - stage_start
+    logger.info("视觉处理器已加载")
+    timings["total"] = time.perf_counter() - start_time
+    model.startup_timings = timings
+    peak_rss = peak_rss_mb()
+    logger.info(
+        f"模型加载耗时 {timings['total']:.2f}s (导入 {timings['imports']:.2f}s，配置解析 {timings['config']:.2f}s，"
+        f"模块构建 {timings.get('construct', 0.0):.2f}s，权重加载 {timings.get('weights', 0.0):.2f}s，"
+        f"设备迁移 {timings['to_device']:.2f}s，视觉处理器 {timings['processor']:.2f}s)，"
+        f"进程峰值内存 {f'{peak_rss:.0f}MB' if peak_rss is not None else '未知'}"
+    )
+
+    return model, vis_processor
+
+
+def load_image(item):
+    """
+    将图像路径或PIL Image统一转换为RGB格式的PIL Image
+
+    Args:
+        item: 图像路径或PIL Image对象
+
+    Returns:
+        RGB格式的PIL Image
+    """
+    if isinstance(item, Image.Image):
+        return item.convert("RGB")
+    return Image.open(item).convert("RGB")
+
+
+def cache_params(model):
+    """识别结果缓存键中的生成参数，任何会改变识别结果的模型设置都要包含在内"""
+    return dict(
+        GENERATION_PARAMS,
+        max_seq_len=getattr(model, "max_seq_len", None),
+        quantization=getattr(model, "quantization", None),
+        autocast_dtype=getattr(model, "autocast_dtype", None),
+        attn_implementation=getattr(model, "attn_implementation", None),
+        encoder_attn_implementation=getattr(model, "encoder_attn_implementation", None),
+        # 折叠为单通道的stem与三通道输入的编码器输出有微小差异
+        grayscale_stem=getattr(getattr(model, "model", None), "grayscale_stem", False),
+        length_cap=(getattr(model, "length_cap_ratio", None), getattr(model, "length_cap_min", None)),
+    )
+
+
+def prepare_image(vis_processor, image, cache=None, params=None):
+    """
+    预处理单张图像并查询结果缓存
+
+    Returns:
+        (tensor, key, cached): 预处理后的张量、缓存键(未启用缓存时为None)、命中的识别结果(未命中为None)
+    """
+    tensor = vis_processor(image)
+    if cache is None:
+        return tensor, None, None
+    key = cache.make_key(tensor, params)
+    return tensor, key, cache.get(key)
+
+
+def generate_batch(model, tensors, device):
+    """将预处理后的张量堆叠为一个批次送入模型，返回与输入顺序一致的LaTeX列表"""
+    image_tensor = torch.stack(tensors).to(device)
+    with torch.no_grad():
+        output = model.generate({"image": image_tensor}, **GENERATION_PARAMS)
+    return output["pred_str"]
+
+
+def recognize_batch(model, vis_processor, images, device, batch_size=8, cache=None):
+    """
+    批量识别图像中的公式，逐条产出结果
+
+    预处理后的张量按batch_size堆叠成一个批次，整批送入模型的generate，
+    避免逐张调用时重复执行编码器。预处理失败的图像单独返回错误信息，不影响同批其他图像。
+
+    Args:
+        model: 已加载的UniMERModel
+        vis_processor: FormulaImageEvalProcessor实例
+        images: PIL Image列表
+        device: 推理设备
+        batch_size: 每批最多包含的图像数量
+        cache: 可选的RecognitionCache，命中的图像不再送入模型
+
+    Yields:
+        (index, result, ok): 图像在输入中的序号、识别结果或错误信息、是否识别成功
+    """
+    batch_size = max(1, int(batch_size))
+    params = cache_params(model)
+    for start in range(0, len(images), batch_size):
+        indices, tensors, keys = [], [], []
+        for index in range(start, min(start + batch_size, len(images))):
+            try:
+                tensor, key, cached = prepare_image(vis_processor, images[index], cache, params)
+            except Exception as e:
+                logger.error(f"图像预处理失败 (#{index}): {str(e)}")
+                yield index, f"识别失败: 图像预处理失败: {str(e)}", False
+                continue
+
+            if cached is not None:
+                yield index, cached, True
+                continue
+            keys.append(key)
+            tensors.append(tensor)
+            indices.append(index)
+
+        if not tensors:
+            continue
+
+        try:
+            results = generate_batch(model, tensors, device)
+        except Exception as e:
+            logger.error(f"批量推理失败: {str(e)}")
+            for index in indices:
+                yield index, f"识别失败: {str(e)}", False
+            continue
+
+        for position, (index, result) in enumerate(zip(indices, results)):
+            if cache is not None:
+                try:
+                    cache.put(keys[position], result)
+                except Exception as e:
+                    # 缓存写入失败(例如数据库被锁定)不影响已经得到的识别结果
+                    logger.error(f"识别结果缓存写入失败 (#{index}): {str(e)}")
+            yield index, result, True
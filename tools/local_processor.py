@@ -1,20 +1,49 @@
-import torch
+import importlib
 import warnings
-import argparse
 import logging
-import platform
 import sys
 import os
+import time
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtCore import QObject, pyqtSignal, QBuffer, QByteArray, QIODevice
 from PIL import Image
-from io import BytesIO
-import cv2
-import numpy as np
 import json
 
+# torch、cv2、numpy和模型代码在start_loading中由处理器线程导入，
+# 主线程导入本模块时只加载Qt和PIL，窗口可以先显示出来
 warnings.filterwarnings("ignore")
 
+# 模型推理依赖，按顺序导入以便分别统计耗时
+MODEL_STACK_MODULES = (
+    "numpy",
+    "cv2",
+    "torch",
+    "transformers",
+    "unimernet.models.unimernet.unimernet",
+    "unimernet.processors.formula_processor",
+    "tools.inference",
+    "tools.result_cache",
+    "tools.scheduler",
+)
+
+
+def import_model_stack(modules=MODEL_STACK_MODULES):
+    """
+    依次导入模型推理依赖，返回每个模块的累计导入耗时和新加载的模块数
+
+    与python -X importtime的cumulative列类似，已被前面模块导入的子模块不会重复计时。
+
+    Returns:
+        [(模块名, 耗时秒数, 新加载模块数), ...]
+    """
+    report = []
+    for name in modules:
+        loaded = len(sys.modules)
+        start = time.perf_counter()
+        importlib.import_module(name)
+        report.append((name, time.perf_counter() - start, len(sys.modules) - loaded))
+    return report
+
 
 class LocalProcessor(QObject):
     """
@@ -26,6 +55,9 @@ class LocalProcessor(QObject):
 
     finished = pyqtSignal(str)  # 识别完成信号
     model_loaded = pyqtSignal(str)  # 模型加载完成信号，附带设备信息
+    batch_item_finished = pyqtSignal(int, str, str)  # 批量识别单项完成信号：序号、ID、识别结果
+    batch_finished = pyqtSignal(int)  # 批量识别全部完成信号，附带图像总数
+    request_finished = pyqtSignal(str, str)  # 调度器请求完成信号：请求ID、识别结果
 
     def __init__(self, cfg_path):
         """
@@ -36,28 +68,43 @@ class LocalProcessor(QObject):
         self.cfg_path = cfg_path
         self.model = None
         self.vis_processor = None
-
-        # 智能设备选择：优先级 CUDA > MPS > CPU
-        if torch.cuda.is_available():
-            self.device = torch.device("cuda")
-            device_name = "CUDA"
-        elif platform.system() == "Darwin" and hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-            # macOS 上优先使用 MPS (Apple Silicon GPU)
-            self.device = torch.device("mps")
-            device_name = "MPS (Apple Silicon)"
-        else:
-            self.device = torch.device("cpu")
-            device_name = "CPU"
+        self.cache = None
+        self.scheduler = None
+        # 设备在处理器线程导入torch后选择
+        self.device = None
+        self.import_report = []
 
         self.logger = logging.getLogger("logs/FreeTex.log")
-        self.logger.info(f"LocalProcessor 初始化完成. 选择设备: {device_name} ({self.device})")
+        self.logger.info("LocalProcessor 初始化完成")
 
     def start_loading(self):
         """
-        在线程启动后调用此方法来加载模型。
+        在线程启动后调用此方法来导入模型依赖并加载模型。
         """
         self.logger.info("开始加载模型...")
+        from tools.app_config import load_app_config
+
+        app_config = load_app_config()
+        daemon_config = app_config.get("daemon") or {}
+        if daemon_config.get("enabled", False):
+            try:
+                self.init_daemon(daemon_config, app_config.get("scheduler"))
+                self.model_loaded.emit(f"{self.device} (后台模型进程)")
+                return
+            except Exception as e:
+                self.logger.error(f"后台模型进程不可用，改为在本进程中加载模型: {str(e)}")
+
         try:
+            self.import_report = import_model_stack()
+            total = sum(seconds for _, seconds, _ in self.import_report)
+            self.logger.info(
+                f"模型依赖导入耗时 {total:.2f}s: "
+                + "，".join(f"{name} {seconds:.2f}s (+{count}个模块)" for name, seconds, count in self.import_report)
+            )
+
+            from tools.inference import select_device
+            self.device, device_name = select_device()
+            self.logger.info(f"选择设备: {device_name} ({self.device})")
             self.init_model()
             if self.model:
                 self.model.eval()
@@ -71,97 +118,94 @@ class LocalProcessor(QObject):
             self.logger.error(error_msg)
             self.model_loaded.emit(f"加载失败 ({str(self.device)}): {str(e)}")
 
+    def init_daemon(self, daemon_config, scheduler_config=None):
+        """
+        连接后台模型进程，必要时启动它
+
+        客户端与InferenceScheduler接口相同，作为self.scheduler使用，本进程不导入torch也不加载模型。
+        """
+        from tools.model_daemon import ModelDaemonClient
+
+        max_workers = (scheduler_config or {}).get("max_batch_size", 8)
+        client = ModelDaemonClient.from_config(daemon_config, max_workers)
+        client.ensure_running()
+        self.device = client.device
+        self.scheduler = client
+
+    def is_ready(self):
+        """本地模型或后台模型进程是否可以接受识别请求"""
+        return self.scheduler is not None or (self.model is not None and self.vis_processor is not None)
+
     def init_model(self):
         """初始化模型"""
-        self.logger.debug("执行init_model...")
-        import unimernet.tasks as tasks
-        from unimernet.common.config import Config
-        from unimernet.processors import load_processor
-        import yaml
+        from tools.inference import get_model_paths, load_app_config, load_model
+        from tools.result_cache import RecognitionCache
+        from tools.scheduler import InferenceScheduler
 
+        self.logger.debug("执行init_model...")
         self.logger.info(f"在设备上初始化模型: {self.device}")
+        self.model, self.vis_processor = load_model(self.cfg_path, self.device)
+        app_config = load_app_config()
+        self.cache = RecognitionCache.from_config(app_config.get("cache"), get_model_paths()[1])
+        # 所有本地识别都经过调度器，由调度器线程独占模型
+        self.scheduler = InferenceScheduler.from_config(
+            self.model, self.vis_processor, self.device, app_config.get("scheduler"), cache=self.cache
+        )
 
-        # 读取配置文件并修正路径
-        with open(self.cfg_path, 'r', encoding='utf-8') as f:
-            cfg_dict = yaml.safe_load(f)
-
-        # 修正模型路径(支持打包后的环境)
-        if getattr(sys, "frozen", False):
-            # 打包环境
-            if hasattr(sys, '_MEIPASS'):
-                # PyInstaller 打包环境，使用 _MEIPASS（临时解压目录）
-                base_path = sys._MEIPASS
-                self.logger.info(f"检测到 PyInstaller 打包环境，使用 _MEIPASS: {base_path}")
-            else:
-                # 其他打包方式，使用可执行文件目录
-                base_path = os.path.dirname(sys.executable)
-                self.logger.info(f"检测到打包环境，使用可执行文件目录: {base_path}")
-        else:
-            # 开发环境:使用当前目录
-            base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            self.logger.info(f"开发环境，基础路径: {base_path}")
-
-        # 修正配置中的路径
-        model_path = os.path.join(base_path, "models", "unimernet_small")
-        pretrained_path = os.path.join(model_path, "unimernet_small.pth")
-
-        # 验证模型文件是否存在
-        if not os.path.exists(model_path):
-            self.logger.error(f"模型目录不存在: {model_path}")
-            # 列出 base_path 下的内容以便调试
-            if os.path.exists(base_path):
-                self.logger.info(f"base_path 内容: {os.listdir(base_path)}")
-                models_dir = os.path.join(base_path, "models")
-                if os.path.exists(models_dir):
-                    self.logger.info(f"models 目录内容: {os.listdir(models_dir)}")
-            raise FileNotFoundError(f"模型目录不存在: {model_path}")
-
-        if not os.path.exists(pretrained_path):
-            self.logger.error(f"预训练权重文件不存在: {pretrained_path}")
-            # 列出模型目录内容以便调试
-            if os.path.exists(model_path):
-                self.logger.info(f"模型目录内容: {os.listdir(model_path)}")
-            raise FileNotFoundError(f"预训练权重文件不存在: {pretrained_path}")
-
-        # 更新所有与路径相关的配置
-        cfg_dict['model']['model_name'] = model_path
-        cfg_dict['model']['pretrained'] = pretrained_path
-        cfg_dict['model']['model_config']['model_name'] = model_path
-        cfg_dict['model']['model_config']['path'] = model_path
-
-        # 更新 tokenizer_config 路径
-        if 'tokenizer_config' in cfg_dict['model']:
-            cfg_dict['model']['tokenizer_config']['path'] = model_path
-
-        self.logger.info(f"模型路径: {model_path}")
-        self.logger.info(f"预训练权重: {pretrained_path}")
-
-        # 创建临时配置文件
-        import tempfile
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False, encoding='utf-8') as tmp_cfg:
-            yaml.dump(cfg_dict, tmp_cfg, allow_unicode=True)
-            tmp_cfg_path = tmp_cfg.name
-
+    def shutdown(self):
+        """停止推理调度器并关闭结果缓存，在程序退出时由主线程调用"""
+        scheduler, self.scheduler = self.scheduler, None
+        if scheduler is not None:
+            # 正在识别的一批会完成，仍在排队的请求被取消；close时记录调度统计
+            scheduler.close(timeout=5)
+        cache, self.cache = self.cache, None
+        if cache is not None:
+            cache.close()
+
+    def _recognize_local(self, pil_image):
+        """使用本地模型识别单张图像，优先查询结果缓存"""
+        from tools.scheduler import request_result
+
+        if self.scheduler is not None:
+            return request_result(self.scheduler.submit(pil_image))[0]
+        from tools.inference import recognize_batch
+
+        _, result, _ = next(recognize_batch(
+            self.model, self.vis_processor, [pil_image], self.device, cache=self.cache
+        ))
+        return result
+
+    def submit_request(self, request_id, item):
+        """
+        向推理调度器提交一张图像，不等待结果，识别完成后通过request_finished信号返回
+        多个来源同时提交的请求会被调度器合并成批次
+        参数:
+            request_id: 请求ID，原样通过request_finished信号返回
+            item: 图像路径、QPixmap或PIL Image
+        """
+        if self.scheduler is None:
+            self.request_finished.emit(request_id, "识别失败: 模型尚未加载完成")
+            return
         try:
-            args = argparse.Namespace(cfg_path=tmp_cfg_path, options=None)
-            cfg = Config(args)
-
-            task = tasks.setup_task(cfg)
-            # Load model and move to device
-            self.model = task.build_model(cfg).to(self.device)
-            self.logger.info("模型已构建并移动到设备")
-            # Load processor
-            self.vis_processor = load_processor(
-                "formula_image_eval",
-                cfg.config.datasets.formula_rec_eval.vis_processor.eval,
-            )
-            self.logger.info("视觉处理器已加载")
-        finally:
-            # 清理临时配置文件
-            try:
-                os.unlink(tmp_cfg_path)
-            except:
-                pass
+            image = self._to_pil(item)
+        except Exception as e:
+            self.logger.error(f"图像读取失败 ({request_id}): {str(e)}")
+            self.request_finished.emit(request_id, f"识别失败: {str(e)}")
+            return
+        self.scheduler.submit(
+            image, request_id, callback=lambda rid, result, ok: self.request_finished.emit(rid, result)
+        )
+
+    def _to_pil(self, item):
+        """将图像路径、QPixmap或PIL Image转换为模型输入用的PIL Image"""
+        if isinstance(item, QPixmap):
+            image = self._pixmap_to_pil(self.preprocess_image(item))
+            if image is None:
+                raise ValueError("图像转换失败")
+            return image
+        if isinstance(item, Image.Image):
+            return item.convert("RGB")
+        return Image.open(item).convert("RGB")
 
     def process_image(self, image_path):
         """
@@ -170,23 +214,16 @@ class LocalProcessor(QObject):
             image_path: 图像路径
         """
         try:
-            if self.model is None or self.vis_processor is None:
+            if not self.is_ready():
                 self.logger.warning("模型尚未加载完成，无法处理图像")
                 self.finished.emit("识别失败: 模型尚未加载完成")
                 return
 
             self.logger.info(f"正在处理图像路径: {image_path}")
             raw_image = Image.open(image_path).convert("RGB")  # Ensure RGB
-            image_tensor = self.vis_processor(raw_image).unsqueeze(0).to(self.device)
-            self.logger.debug("图像已通过视觉处理器处理")
-
-            with (
-                torch.no_grad()
-            ):  # Inference should be done without gradient calculation
-                output = self.model.generate({"image": image_tensor})
+            result = self._recognize_local(raw_image)
             self.logger.debug("模型推理完成")
 
-            result = output["pred_str"][0]
             self.logger.info(f"路径识别结果:\n{result}")
             self.finished.emit(result)
         except Exception as e:
@@ -194,6 +231,54 @@ class LocalProcessor(QObject):
             self.logger.error(error_msg)
             self.finished.emit(error_msg)
 
+    def process_batch(self, items, batch_size=8, ids=None):
+        """
+        批量处理图像，每识别完一张通过batch_item_finished信号返回结果
+        参数:
+            items: 图像路径、QPixmap或PIL Image组成的列表
+            batch_size: 调度器不可用时每批送入模型的图像数量，否则由调度器组批
+            ids: 与items一一对应的ID列表，默认图像路径用路径本身、其余用序号
+        """
+        from tools.scheduler import request_result
+
+        items = list(items)
+        if ids is None:
+            ids = [item if isinstance(item, str) else str(index) for index, item in enumerate(items)]
+
+        if not self.is_ready():
+            self.logger.warning("模型尚未加载完成，无法批量处理图像")
+            for index, item_id in enumerate(ids):
+                self.batch_item_finished.emit(index, item_id, "识别失败: 模型尚未加载完成")
+            self.batch_finished.emit(len(items))
+            return
+
+        self.logger.info(f"开始批量识别 {len(items)} 张图像，批大小: {batch_size}")
+        images, valid_indices = [], []
+        for index, item in enumerate(items):
+            try:
+                images.append(self._to_pil(item))
+                valid_indices.append(index)
+            except Exception as e:
+                self.logger.error(f"图像读取失败 ({ids[index]}): {str(e)}")
+                self.batch_item_finished.emit(index, ids[index], f"识别失败: {str(e)}")
+
+        if self.scheduler is not None:
+            futures = [self.scheduler.submit(image, ids[index]) for image, index in zip(images, valid_indices)]
+            results = ((position, *request_result(future)) for position, future in enumerate(futures))
+        else:
+            from tools.inference import recognize_batch
+
+            results = recognize_batch(
+                self.model, self.vis_processor, images, self.device, batch_size, cache=self.cache
+            )
+        for position, result, _ in results:
+            index = valid_indices[position]
+            self.logger.debug(f"批量识别结果 #{index} ({ids[index]}): {result}")
+            self.batch_item_finished.emit(index, ids[index], result)
+
+        self.logger.info("批量识别完成")
+        self.batch_finished.emit(len(items))
+
     def preprocess_image(self, pixmap):
         """
         预处理图像，检测背景色并在必要时进行颜色反转
@@ -204,6 +289,9 @@ class LocalProcessor(QObject):
         Returns:
             处理后的QPixmap对象
         """
+        import cv2
+        import numpy as np
+
         # 将QPixmap转换为numpy数组
         image = self._pixmap_to_cv2(pixmap)
         if image is None:
@@ -228,6 +316,9 @@ class LocalProcessor(QObject):
         """
         将QPixmap转换为OpenCV格式
         """
+        import cv2
+        import numpy as np
+
         try:
             # 转换QPixmap为QImage
             image = pixmap.toImage()
@@ -248,6 +339,8 @@ class LocalProcessor(QObject):
         """
         将OpenCV图像转换为QPixmap
         """
+        import cv2
+
         try:
             # 转换为RGB格式
             rgb_image = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
@@ -264,7 +357,7 @@ class LocalProcessor(QObject):
     def process_pixmap(self, pixmap):
         """处理QPixmap图像"""
         try:
-            if self.model is None or self.vis_processor is None:
+            if not self.is_ready():
                 self.finished.emit("模型未加载，无法处理图像")
                 return
 
@@ -296,17 +389,11 @@ class LocalProcessor(QObject):
                         result = self._process_with_multimodal(pil_image, model_config)
                     else:
                         # 使用本地模型识别
-                        image_tensor = self.vis_processor(pil_image).unsqueeze(0).to(self.device)
-                        with torch.no_grad():
-                            output = self.model.generate({"image": image_tensor})
-                        result = output["pred_str"][0]
+                        result = self._recognize_local(pil_image)
             except Exception as e:
                 self.logger.error(f"配置读取失败，使用本地模型: {str(e)}")
                 # 使用本地模型识别
-                image_tensor = self.vis_processor(pil_image).unsqueeze(0).to(self.device)
-                with torch.no_grad():
-                    output = self.model.generate({"image": image_tensor})
-                result = output["pred_str"][0]
+                result = self._recognize_local(pil_image)
 
             self.logger.info(f"识别结果: {result}")
             self.finished.emit(result)
@@ -369,6 +456,9 @@ class LocalProcessor(QObject):
         """
         将QPixmap转换为PIL Image
         """
+        import cv2
+        import numpy as np
+
         try:
             # 转换QPixmap为QImage
             image = pixmap.toImage()
@@ -0,0 +1,81 @@
+"""
+公式渲染视图
+
+KaTeX页面只加载一次，之后的公式通过runJavaScript交给页面中的katex.render，只更新公式所在的DOM节点，
+不再为每个识别结果重新加载页面、重新解析katex.min.js和样式表。
+渲染在QtWebEngine的渲染进程中异步执行，不阻塞Qt事件循环，页面把连续的渲染请求合并到下一帧。
+"""
+
+import functools
+import json
+import logging
+
+from PyQt5.QtCore import QFile, QIODevice, QTextStream
+from PyQt5.QtWebEngineWidgets import QWebEngineView
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+@functools.lru_cache(maxsize=None)
+def load_mathview_template():
+    """从Qt资源中读取公式渲染页面，只读取一次"""
+    fd = QFile(":/mathview.html")
+    if not fd.open(QIODevice.ReadOnly | QFile.Text):
+        raise FileNotFoundError("MathView HTML file not found")
+    try:
+        return QTextStream(fd).readAll()
+    finally:
+        fd.close()
+
+
+class MathView(QWebEngineView):
+    """
+    常驻的KaTeX公式渲染视图
+
+    render_latex和show_message只执行一段JavaScript。页面加载完成前的调用不会丢失，
+    加载完成后渲染其中最新的一次。
+    """
+
+    def __init__(self, base_url, placeholder="", parent=None):
+        super().__init__(parent)
+        self._loaded = False
+        self._pending_script = None
+        # 最近一次交给页面渲染的公式，内容未变化时跳过
+        self._latex = None
+        self.loadFinished.connect(self._on_load_finished)
+        try:
+            self.setHtml(load_mathview_template(), baseUrl=base_url)
+        except Exception as e:
+            logger.error(f"加载公式渲染页面失败: {str(e)}")
+            self.setHtml(f"<html><body>加载公式渲染页面失败: {str(e)}</body></html>")
+            return
+        if placeholder:
+            self.show_message(placeholder)
+
+    def _run(self, script):
+        if self._loaded:
+            self.page().runJavaScript(script)
+        else:
+            self._pending_script = script
+
+    def _on_load_finished(self, ok):
+        if not ok:
+            logger.error("公式渲染页面加载失败")
+            return
+        self._loaded = True
+        if self._pending_script is not None:
+            script, self._pending_script = self._pending_script, None
+            self.page().runJavaScript(script)
+
+    def render_latex(self, latex_code):
+        """渲染LaTeX公式，语法错误的部分以红色源码显示，错误信息显示在公式下方"""
+        if latex_code == self._latex:
+            return
+        self._latex = latex_code
+        # json.dumps生成合法的JavaScript字符串字面量，非ASCII字符会被转义
+        self._run(f"renderLatex({json.dumps(latex_code)});")
+
+    def show_message(self, text):
+        """在渲染区域显示一段提示文字"""
+        self._latex = None
+        self._run(f"showMessage({json.dumps(text)});")
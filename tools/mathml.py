@@ -0,0 +1,73 @@
+"""
+LaTeX到MathML的转换缓存
+
+latex2mathml是纯Python实现，长公式转换需要较长时间。转换在后台线程中执行，
+结果按LaTeX字符串保存在LRU缓存中：识别完成后立即预先转换，复制到Word时直接取缓存结果，
+重复复制同一公式也不再重复转换。GUI和命令行导出共用同一个缓存。
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MathMLCache:
+    """
+    以LaTeX字符串为键的MathML转换结果LRU缓存
+
+    缓存中保存的是Future，正在转换的公式再次请求时等待同一个转换，不会重复计算。
+    转换失败的异常同样缓存在Future中。
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max(1, int(max_entries))
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, latex):
+        """
+        在后台线程中转换LaTeX，已缓存或正在转换时直接返回对应的Future
+
+        Returns:
+            Future，结果为MathML字符串
+        """
+        with self._lock:
+            future = self._futures.get(latex)
+            if future is not None:
+                self._futures.move_to_end(latex)
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MathML")
+            future = self._executor.submit(_convert, latex)
+            self._futures[latex] = future
+            while len(self._futures) > self.max_entries:
+                self._futures.popitem(last=False)
+            return future
+
+    def convert(self, latex, timeout=None):
+        """返回LaTeX对应的MathML，未缓存时等待后台转换完成"""
+        return self.submit(latex).result(timeout)
+
+    def clear(self):
+        with self._lock:
+            self._futures.clear()
+
+
+def _convert(latex):
+    from latex2mathml.converter import convert
+
+    return convert(latex)
+
+
+_default_cache = MathMLCache()
+
+
+def mathml_cache():
+    """进程内共享的MathML缓存"""
+    return _default_cache
+
+
+def latex_to_mathml(latex):
+    """将LaTeX转换为MathML，结果来自共享缓存"""
+    return _default_cache.convert(latex)
@@ -0,0 +1,202 @@
+"""
+后台模型进程
+
+开启config.json中的daemon后，GUI不在自己的进程里加载模型，而是连接本机上常驻的本地识别服务
+(python -m tools.cli serve，见tools/server.py)，服务不存在时自动在后台启动。
+重复启动FreeTex或同时打开多个窗口都共用这一份已加载的模型；
+服务连续空闲超过idle_timeout秒后自动退出并释放权重，之后的识别请求会重新启动它。
+"""
+
+import base64
+import io
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.app_config import get_base_path
+from tools.scheduler import request_result
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+def daemon_log_path():
+    """后台模型进程的日志文件，与GUI日志放在同一目录"""
+    log_dir = os.path.join(os.path.dirname(sys.executable) if getattr(sys, "frozen", False) else os.getcwd(), "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    return os.path.join(log_dir, "FreeTex-daemon.log")
+
+
+class ModelDaemonClient:
+    """
+    后台模型进程的客户端
+
+    提供与InferenceScheduler相同的submit/stats/close接口，LocalProcessor可以直接替换使用。
+    请求通过OpenAI兼容的/v1/chat/completions接口发送，并发提交的图像由服务端的调度器合并成批次。
+    只依赖标准库，GUI进程不需要导入torch。
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, idle_timeout=1800, startup_timeout=300, request_timeout=300,
+                 max_workers=8):
+        self.host = host
+        self.port = int(port)
+        self.idle_timeout = idle_timeout
+        self.startup_timeout = startup_timeout
+        self.request_timeout = request_timeout
+        self.base_url = f"http://{host}:{self.port}"
+        self.device = None
+
+        self._executor = ThreadPoolExecutor(max(1, int(max_workers)), thread_name_prefix="ModelDaemonClient")
+        self._start_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    @classmethod
+    def from_config(cls, daemon_config=None, max_workers=8):
+        """根据config.json中的daemon配置创建客户端"""
+        daemon_config = daemon_config or {}
+        return cls(
+            host=daemon_config.get("host", "127.0.0.1"),
+            port=daemon_config.get("port", 8765),
+            idle_timeout=daemon_config.get("idle_timeout", 1800),
+            startup_timeout=daemon_config.get("startup_timeout", 300),
+            max_workers=max_workers,
+        )
+
+    def _request(self, path, payload=None, timeout=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            # 服务以OpenAI格式返回错误信息
+            try:
+                message = json.load(e)["error"]["message"]
+            except Exception:
+                message = str(e)
+            raise RuntimeError(message)
+
+    def health(self):
+        """返回服务的/health信息，服务未运行或端口上不是识别服务时返回None"""
+        try:
+            health = self._request("/health", timeout=2)
+        except (OSError, ValueError, RuntimeError):
+            return None
+        if not isinstance(health, dict) or health.get("status") != "ok" or "scheduler" not in health:
+            return None
+        return health
+
+    def spawn_command(self):
+        args = ["serve", "--host", self.host, "--port", str(self.port)]
+        if self.idle_timeout:
+            args += ["--idle-timeout", str(self.idle_timeout)]
+        if getattr(sys, "frozen", False):
+            # 打包后的程序由main.py把serve参数转交给tools.cli
+            return [sys.executable] + args
+        return [sys.executable, "-m", "tools.cli"] + args
+
+    def _spawn(self):
+        """在后台启动服务进程，进程独立于当前GUI，GUI退出后继续运行"""
+        kwargs = {}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        log_path = daemon_log_path()
+        with open(log_path, "a", encoding="utf-8") as log_file:
+            process = subprocess.Popen(
+                self.spawn_command(),
+                cwd=get_base_path(),
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                **kwargs,
+            )
+        logger.info(f"已启动后台模型进程 (pid {process.pid})，日志: {log_path}")
+        return process
+
+    def ensure_running(self):
+        """
+        确认后台模型进程可用，不存在时启动它并等待模型加载完成
+
+        Returns:
+            服务的/health信息
+        """
+        with self._start_lock:
+            health = self.health()
+            if health is None:
+                logger.info(f"未找到后台模型进程 ({self.base_url})，正在启动")
+                process = self._spawn()
+                deadline = time.monotonic() + self.startup_timeout
+                while health is None:
+                    if process.poll() is not None:
+                        # 端口被占用时进程会直接退出，此时可能是另一个实例刚刚启动了服务
+                        health = self.health()
+                        if health is None:
+                            raise RuntimeError(
+                                f"后台模型进程启动失败 (退出码 {process.returncode})，详见 {daemon_log_path()}"
+                            )
+                        break
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"等待后台模型进程超时 ({self.startup_timeout}s)")
+                    time.sleep(0.5)
+                    health = self.health()
+            self.device = health.get("device")
+            logger.info(f"已连接后台模型进程 {self.base_url} (pid {health.get('pid')}，设备 {self.device})")
+            return health
+
+    def _recognize(self, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        payload = {
+            "messages": [{
+                "role": "user",
+                "content": [{
+                    "type": "image_url",
+                    "image_url": {"url": "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")},
+                }],
+            }],
+        }
+        try:
+            response = self._request("/v1/chat/completions", payload, timeout=self.request_timeout)
+        except urllib.error.URLError as e:
+            if not isinstance(e.reason, ConnectionRefusedError):
+                raise
+            # 服务空闲超时退出后重新启动
+            logger.info("后台模型进程已退出，重新启动")
+            self.ensure_running()
+            response = self._request("/v1/chat/completions", payload, timeout=self.request_timeout)
+        return response["choices"][0]["message"]["content"]
+
+    def submit(self, image, request_id=None, callback=None):
+        """
+        提交一张图像，立即返回Future，识别完成后Future的结果为LaTeX字符串
+
+        Args:
+            image: PIL Image
+            request_id: 请求ID，默认自动编号，用于回调
+            callback: 可选的回调函数callback(request_id, result, ok)，在结果就绪的线程中调用
+        """
+        if request_id is None:
+            request_id = str(next(self._ids))
+        future = self._executor.submit(self._recognize, image)
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(request_id, *request_result(f)))
+        return future
+
+    def stats(self):
+        """返回服务端调度器的统计信息，服务不可用时返回空字典"""
+        health = self.health()
+        return health["scheduler"] if health else {}
+
+    def close(self, timeout=None):
+        """取消尚未发出的请求，后台模型进程继续运行，供其他实例使用"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,179 @@
+"""
+推理路径一致性检查
+
+用法:
+    python -m tools.parity [attention window-attention ...] [--images "test_imgs/*.png"]
+
+每项检查用同一份权重加载参照模型和待查模型(只有一个model_config选项不同)，把所有测试图像组成一个批次，
+要求贪心解码结果逐条一致；改变编码器数值的选项还要求编码器输出的最大相对误差不超过容差。
+全部通过时退出码为0，任一检查失败时为1，可以直接用作提交前或CI中的检查。
+
+benchmark中的各项对比也使用这里的加载和比较函数，只是另外统计耗时。
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+
+import torch
+
+from tools.inference import get_base_path, load_image, load_model, select_device
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+# reference/candidate: 两个模型的model_config覆盖项；rtol: 编码器输出允许的最大相对误差，None表示不比较编码器
+ParityCheck = namedtuple("ParityCheck", ["description", "reference", "candidate", "rtol"])
+
+PARITY_CHECKS = {
+    "attention": ParityCheck(
+        "解码器注意力 sdpa vs eager", {"attn_implementation": "eager"}, {"attn_implementation": "sdpa"}, None
+    ),
+    "window-attention": ParityCheck(
+        "编码器窗口注意力 sdpa vs eager",
+        {"encoder_attn_implementation": "eager"},
+        {"encoder_attn_implementation": "sdpa"},
+        1e-3,
+    ),
+    "grayscale-stem": ParityCheck(
+        "单通道stem vs 三通道输入", {"grayscale_stem": False}, {"grayscale_stem": True}, 1e-4
+    ),
+    "compaction": ParityCheck(
+        "批内提前结束的贪心解码 vs HF generate",
+        {"compact_decoding": False, "length_cap_ratio": None},
+        {"compact_decoding": True, "length_cap_ratio": None},
+        None,
+    ),
+    "static-kv-cache": ParityCheck(
+        "静态KV缓存 vs 拼接KV缓存", {"static_kv_cache": False}, {"static_kv_cache": True}, None
+    ),
+}
+
+
+def sync_device(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elif device.type == "mps":
+        torch.mps.synchronize()
+
+
+def load_variants(cfg, device, variants):
+    """
+    用同一份权重加载多个模型，关闭编码器缓存以免不同模型之间复用编码结果
+
+    Args:
+        variants: {名称: model_config覆盖项}，第一个作为参照
+
+    Returns:
+        ({名称: 模型}, vis_processor)
+    """
+    models, vis_processor = {}, None
+    for name, overrides in variants.items():
+        models[name], vis_processor = load_model(cfg, device, dict(overrides, encoder_cache_size=0))
+    return models, vis_processor
+
+
+@torch.no_grad()
+def generate_outputs(models, pixel_values, device):
+    """
+    每个模型对同一批输入贪心解码
+
+    Returns:
+        ({名称: generate的输出}, {名称: 耗时秒数})
+    """
+    outputs, elapsed = {}, {}
+    for name, model in models.items():
+        sync_device(device)
+        start = time.perf_counter()
+        outputs[name] = model.generate({"image": pixel_values})
+        sync_device(device)
+        elapsed[name] = time.perf_counter() - start
+    return outputs, elapsed
+
+
+def count_identical(reference, candidate):
+    """两组pred_str中逐条一致的数量"""
+    return sum(a == b for a, b in zip(reference, candidate))
+
+
+@torch.no_grad()
+def encoder_relative_diff(reference, candidate, pixel_values):
+    """两个模型编码器输出的最大绝对误差，以参照输出的最大绝对值归一化"""
+    expected = reference.model.encode(pixel_values).last_hidden_state
+    actual = candidate.model.encode(pixel_values).last_hidden_state
+    return ((expected - actual).abs().max() / expected.abs().max()).item()
+
+
+@torch.no_grad()
+def decoder_logits_diff(reference, candidate, pixel_values, pred_ids):
+    """以参照模型的解码结果做teacher forcing，返回两个模型解码器logits的最大绝对误差"""
+    bos = reference.tokenizer.tokenizer.bos_token_id
+    decoder_input_ids = torch.cat(
+        [torch.full((pred_ids.shape[0], 1), bos, dtype=torch.long, device=pred_ids.device), pred_ids], dim=1
+    )
+    encoder_outputs = reference.model.encode(pixel_values)
+    logits = [
+        model.model.model(encoder_outputs=encoder_outputs, decoder_input_ids=decoder_input_ids).logits
+        for model in (reference, candidate)
+    ]
+    return (logits[0] - logits[1]).abs().max().item()
+
+
+def run_check(name, cfg, device, paths):
+    """执行一项一致性检查，返回是否通过"""
+    check = PARITY_CHECKS[name]
+    models, vis_processor = load_variants(cfg, device, {"reference": check.reference, "candidate": check.candidate})
+    pixel_values = vis_processor([load_image(path) for path in paths]).to(device)
+
+    passed = True
+    details = []
+    if check.rtol is not None:
+        max_diff = encoder_relative_diff(models["reference"], models["candidate"], pixel_values)
+        passed = max_diff <= check.rtol
+        details.append(f"编码器最大相对误差 {max_diff:.3e} (容差 {check.rtol:.0e})")
+    outputs, _ = generate_outputs(models, pixel_values, device)
+    identical = count_identical(outputs["reference"]["pred_str"], outputs["candidate"]["pred_str"])
+    passed = passed and identical == len(paths)
+    details.append(f"贪心解码一致 {identical}/{len(paths)}")
+
+    print(f"[{'通过' if passed else '失败'}] {name}: {check.description}，" + "，".join(details))
+    return passed
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m tools.parity", description="FreeTex 推理路径一致性检查")
+    parser.add_argument("checks", nargs="*", help=f"要执行的检查，默认全部执行: {' '.join(PARITY_CHECKS)}")
+    parser.add_argument("--cfg", default=os.path.join(get_base_path(), "demo.yaml"), help="模型配置文件")
+    parser.add_argument("--device", default=None, help="推理设备，例如 cpu、cuda、mps，默认自动选择")
+    parser.add_argument(
+        "--images", default=os.path.join(get_base_path(), "test_imgs", "*.png"), help="测试图像通配符"
+    )
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.checks if name not in PARITY_CHECKS]
+    if unknown:
+        parser.error(f"未知的检查: {' '.join(unknown)}")
+    device = torch.device(args.device) if args.device else select_device()[0]
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        print(f"没有找到测试图像: {args.images}")
+        return 1
+    results = [run_check(name, args.cfg, device, paths) for name in args.checks or PARITY_CHECKS]
+    print(f"通过 {sum(results)}/{len(results)} 项检查")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+
+def get_cache_dir():
+    """
+    获取缓存目录，与日志目录放在同一位置(打包环境为可执行文件目录，开发环境为当前目录)
+    """
+    root = os.path.dirname(sys.executable) if getattr(sys, "frozen", False) else os.getcwd()
+    return os.path.join(root, "cache")
+
+
+def checkpoint_fingerprint(checkpoint_path):
+    """
+    计算模型权重的指纹，权重文件被替换后旧的缓存结果自动失效
+
+    为避免每次启动都读取数百MB的权重文件，只对路径、文件大小和修改时间做哈希。
+    """
+    stat = os.stat(checkpoint_path)
+    raw = f"{os.path.abspath(checkpoint_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RecognitionCache:
+    """
+    基于SQLite的识别结果缓存
+
+    键由预处理后图像张量的内容哈希、模型指纹和生成参数共同决定，
+    超过max_entries条记录时按最近访问时间淘汰(LRU)。
+    每次查询只记录DEBUG日志，命中/未命中计数每log_interval次查询和关闭时以INFO记录。
+    """
+
+    def __init__(self, db_path, model_fingerprint, max_entries=5000, log_interval=100):
+        self.db_path = db_path
+        self.model_fingerprint = model_fingerprint
+        self.max_entries = max(1, int(max_entries))
+        self.log_interval = max(0, int(log_interval or 0))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 缓存在主线程创建、在模型线程中使用，由self._lock保证串行访问
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, latex TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON results (last_access)")
+        self._conn.commit()
+        logger.info(f"识别结果缓存已打开: {db_path} (上限 {self.max_entries} 条)")
+
+    @classmethod
+    def from_config(cls, cache_config, checkpoint_path):
+        """
+        根据config.json中的cache配置创建缓存，未启用或创建失败时返回None
+        """
+        cache_config = cache_config or {}
+        if not cache_config.get("enabled", True):
+            logger.info("识别结果缓存未启用")
+            return None
+        try:
+            db_path = cache_config.get("path") or os.path.join(get_cache_dir(), "results.sqlite3")
+            return cls(
+                db_path,
+                checkpoint_fingerprint(checkpoint_path),
+                cache_config.get("max_entries", 5000),
+                cache_config.get("log_interval", 100),
+            )
+        except Exception as e:
+            logger.error(f"识别结果缓存创建失败，将不使用缓存: {str(e)}")
+            return None
+
+    def make_key(self, image_tensor, params):
+        """
+        计算缓存键
+
+        Args:
+            image_tensor: FormulaImageEvalProcessor输出的图像张量
+            params: 生成参数字典
+        """
+        tensor = image_tensor.detach().cpu().contiguous()
+        digest = hashlib.sha256()
+        digest.update(self.model_fingerprint.encode("utf-8"))
+        digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+        digest.update(str(tuple(tensor.shape)).encode("utf-8"))
+        digest.update(str(tensor.dtype).encode("utf-8"))
+        digest.update(tensor.numpy().tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """查询缓存，命中时刷新访问时间并返回LaTeX，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT latex FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                logger.debug(f"识别结果缓存未命中 (命中 {self.hits} / 未命中 {self.misses})")
+                latex = None
+            else:
+                self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+                self.hits += 1
+                logger.debug(f"识别结果缓存命中 (命中 {self.hits} / 未命中 {self.misses})")
+                latex = row[0]
+            if self.log_interval and (self.hits + self.misses) % self.log_interval == 0:
+                self._log_stats()
+            return latex
+
+    def _log_stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        logger.info(f"识别结果缓存统计: 查询 {lookups} 次，命中 {self.hits}，未命中 {self.misses} (命中率 {rate:.1f}%)")
+
+    def put(self, key, latex):
+        """写入识别结果，超过容量时淘汰最久未访问的记录"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, latex, last_access) VALUES (?, ?, ?)",
+                (key, latex, time.time()),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                logger.debug(f"识别结果缓存淘汰 {count - self.max_entries} 条记录")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._log_stats()
+            self._conn.close()
@@ -0,0 +1,264 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+_STOP = object()
+
+
+def request_result(future):
+    """等待submit返回的Future并转换为(result, ok)，失败时result为错误信息"""
+    if future.cancelled():
+        return "识别失败: 请求已取消", False
+    error = future.exception()
+    if error is not None:
+        return f"识别失败: {str(error)}", False
+    return future.result(), True
+
+
+class _Request:
+    __slots__ = ("request_id", "tensor", "key", "tokens", "future", "enqueued_at")
+
+    def __init__(self, request_id, tensor, key, tokens, future):
+        self.request_id = request_id
+        self.tensor = tensor
+        self.key = key
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    连续批处理推理调度器
+
+    多个来源(粘贴、上传、文件夹监控、HTTP客户端)提交的识别请求进入同一个队列，
+    工作线程把排队的请求动态组成批次：批大小达到max_batch_size、预计解码token数达到max_batch_tokens，
+    或最早的请求已等待max_wait_ms时立即送入模型。每个请求通过自己的Future单独返回结果。
+
+    不依赖Qt，可在命令行或服务进程中直接使用；GUI中由LocalProcessor在模型加载完成后创建。
+    tools.inference在用到时才导入，只需要request_result的模块(例如后台模型进程的客户端)不会加载torch。
+    """
+
+    def __init__(self, model, vis_processor, device, cache=None, max_batch_size=8, max_batch_tokens=None,
+                 max_wait_ms=20, stats_interval=100):
+        from tools.inference import cache_params
+
+        self.model = model
+        self.vis_processor = vis_processor
+        self.device = device
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        # 每处理这么多批记录一次统计，长时间运行的GUI和服务进程不必等到关闭；0表示只在close时记录
+        self.stats_interval = max(0, int(stats_interval or 0))
+        self.params = cache_params(model)
+
+        self._queue = queue.Queue()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # 队列深度按每次组批时的排队请求数统计，批大小按实际送入模型的图像数统计
+        self.queue_depth_histogram = Counter()
+        self.batch_size_histogram = Counter()
+        self.batches = 0
+        self.completed = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.total_wait = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="InferenceScheduler", daemon=True)
+        self._worker.start()
+        logger.info(
+            f"推理调度器已启动: 批大小上限 {self.max_batch_size}，token预算 {self.max_batch_tokens}，"
+            f"最长等待 {max_wait_ms}ms"
+        )
+
+    @classmethod
+    def from_config(cls, model, vis_processor, device, scheduler_config=None, cache=None):
+        """根据config.json中的scheduler配置创建调度器"""
+        scheduler_config = scheduler_config or {}
+        return cls(
+            model,
+            vis_processor,
+            device,
+            cache=cache,
+            max_batch_size=scheduler_config.get("max_batch_size", 8),
+            max_batch_tokens=scheduler_config.get("max_batch_tokens", None),
+            max_wait_ms=scheduler_config.get("max_wait_ms", 20),
+            stats_interval=scheduler_config.get("stats_interval", 100),
+        )
+
+    def _estimate_tokens(self, tensor):
+        """预计解码长度：配置了长度上限时按公式宽度估计，否则按max_seq_len计"""
+        max_lengths = self.model.predict_max_lengths(tensor.unsqueeze(0))
+        if max_lengths is None:
+            return self.model.max_seq_len
+        return int(max_lengths[0])
+
+    def submit(self, image, request_id=None, callback=None):
+        """
+        提交一张图像，立即返回Future，识别完成后Future的结果为LaTeX字符串
+
+        预处理和缓存查询在调用方线程中完成，命中缓存的请求不进入队列。
+
+        Args:
+            image: PIL Image
+            request_id: 请求ID，默认自动编号，用于日志和回调
+            callback: 可选的回调函数callback(request_id, result, ok)，在结果就绪的线程中调用
+        """
+        from tools.inference import prepare_image
+
+        if request_id is None:
+            request_id = str(next(self._ids))
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(lambda f: callback(request_id, *request_result(f)))
+
+        try:
+            tensor, key, cached = prepare_image(self.vis_processor, image, self.cache, self.params)
+        except Exception as e:
+            logger.error(f"图像预处理失败 ({request_id}): {str(e)}")
+            future.set_exception(ValueError(f"图像预处理失败: {str(e)}"))
+            return future
+
+        if cached is not None:
+            with self._lock:
+                self.cache_hits += 1
+                self.completed += 1
+            future.set_result(cached)
+            return future
+
+        self._queue.put(_Request(request_id, tensor, key, self._estimate_tokens(tensor), future))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _claim(self, request):
+        """请求出队时把Future标记为运行中，之后不能再被取消；已被取消(例如客户端断开)的请求返回False并跳过"""
+        if request.future.set_running_or_notify_cancel():
+            return True
+        logger.debug(f"跳过已取消的请求 ({request.request_id})")
+        return False
+
+    def _next_batch(self, first):
+        """以first为首个请求组批，直到达到批大小或token预算，或等待超过截止时间"""
+        batch, tokens = [first], first.tokens
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # 让工作线程处理完这一批后退出
+                self._queue.put(_STOP)
+                break
+            if not self._claim(request):
+                continue
+            if self.max_batch_tokens is not None and tokens + request.tokens > self.max_batch_tokens:
+                # 超出预算的请求作为下一批的首个请求
+                return batch, request
+            batch.append(request)
+            tokens += request.tokens
+        return batch, None
+
+    def _run(self):
+        carry = None
+        while True:
+            if carry is not None:
+                # 超出token预算留到这一批的请求，出队时已经标记为运行中
+                first, carry = carry, None
+            else:
+                first = self._queue.get()
+                if first is _STOP:
+                    break
+                if not self._claim(first):
+                    continue
+            depth = self._queue.qsize() + 1
+            batch, carry = self._next_batch(first)
+            self._run_batch(batch, depth)
+
+        # 关闭后仍在排队的请求直接取消
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not _STOP:
+                request.future.cancel()
+
+    def _run_batch(self, batch, depth):
+        from tools.inference import generate_batch
+
+        start = time.perf_counter()
+        try:
+            results = generate_batch(self.model, [request.tensor for request in batch], self.device)
+        except Exception as e:
+            logger.error(f"批量推理失败 (批大小 {len(batch)}): {str(e)}")
+            results, error = None, e
+
+        with self._lock:
+            self.queue_depth_histogram[depth] += 1
+            self.batch_size_histogram[len(batch)] += 1
+            self.total_wait += sum(start - request.enqueued_at for request in batch)
+            self.batches += 1
+            self.completed += len(batch)
+            if results is None:
+                self.failed += len(batch)
+            report = self.stats_interval and self.batches % self.stats_interval == 0
+
+        logger.debug(f"调度器完成一批: 批大小 {len(batch)}，队列深度 {depth}，耗时 {time.perf_counter() - start:.2f}s")
+        if report:
+            self.log_stats()
+        # 单个请求返回结果失败不能让工作线程退出，否则之后提交的请求永远等不到结果
+        for position, request in enumerate(batch):
+            try:
+                if results is None:
+                    request.future.set_exception(error)
+                    continue
+                if self.cache is not None:
+                    try:
+                        self.cache.put(request.key, results[position])
+                    except Exception as e:
+                        # 例如共享缓存的数据库被锁定，识别结果照常返回
+                        logger.error(f"识别结果缓存写入失败 ({request.request_id}): {str(e)}")
+                request.future.set_result(results[position])
+            except Exception as e:
+                logger.error(f"返回识别结果失败 ({request.request_id}): {str(e)}")
+
+    def stats(self):
+        """返回调度统计：完成/失败/缓存命中数、平均排队时间、队列深度和批大小直方图"""
+        with self._lock:
+            batched = self.completed - self.cache_hits
+            return {
+                "batches": self.batches,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cache_hits": self.cache_hits,
+                "queue_depth": self._queue.qsize(),
+                "mean_wait_ms": self.total_wait / batched * 1000 if batched else 0.0,
+                "queue_depth_histogram": dict(sorted(self.queue_depth_histogram.items())),
+                "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"调度统计: 批次 {stats['batches']}，完成 {stats['completed']}，失败 {stats['failed']}，缓存命中 {stats['cache_hits']}，"
+            f"平均排队 {stats['mean_wait_ms']:.1f}ms，"
+            f"队列深度分布 {stats['queue_depth_histogram']}，批大小分布 {stats['batch_size_histogram']}"
+        )
+
+    def close(self, timeout=None):
+        """停止工作线程：已经组成批次的请求会完成，仍在排队的请求被取消"""
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+        self.log_stats()
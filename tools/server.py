@@ -0,0 +1,270 @@
+"""
+FreeTex 本地识别服务
+
+用法:
+    python -m tools.cli serve [--host 127.0.0.1] [--port 8000]
+
+接口:
+    POST /v1/chat/completions  OpenAI兼容接口，消息中的base64图像(data URL)逐张识别，结果作为assistant回复返回
+    POST /recognize            multipart表单上传一张或多张图像(字段名任意)，返回JSON结果列表
+    GET  /v1/models            模型列表
+    GET  /health               服务状态和调度统计
+
+所有请求共用同一个模型和推理调度器，并发请求会被合并成批次。
+作为GUI的后台模型进程运行时(--idle-timeout)，连续空闲超过指定秒数后进程退出并释放模型权重。
+"""
+
+import asyncio
+import base64
+import binascii
+import functools
+import io
+import json
+import logging
+import os
+import time
+import uuid
+
+from PIL import Image
+
+from tools.scheduler import request_result
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+logger = logging.getLogger("logs/FreeTex.log")
+
+MAX_REQUEST_SIZE = 20 * 1024 * 1024
+
+# 识别结果和错误信息包含中文，不转义为\uXXXX
+json_dumps = functools.partial(json.dumps, ensure_ascii=False)
+
+
+class RequestError(Exception):
+    """客户端请求格式错误，以HTTP 400返回"""
+
+
+def decode_image(data):
+    """将图像字节解码为RGB格式的PIL Image"""
+    try:
+        return Image.open(io.BytesIO(data)).convert("RGB")
+    except Exception as e:
+        raise RequestError(f"无法解析图像: {str(e)}")
+
+
+def decode_data_url(url):
+    """解析data:image/...;base64,... 形式的图像地址，暂不支持下载远程图像"""
+    if not url.startswith("data:"):
+        raise RequestError("仅支持data URL形式的base64图像")
+    header, _, payload = url.partition(",")
+    if not header.endswith(";base64"):
+        raise RequestError("图像data URL必须使用base64编码")
+    try:
+        return decode_image(base64.b64decode(payload, validate=True))
+    except binascii.Error as e:
+        raise RequestError(f"base64解码失败: {str(e)}")
+
+
+def extract_images(messages):
+    """按顺序提取chat消息中所有image_url内容，文本提示词被忽略"""
+    if not isinstance(messages, list):
+        raise RequestError("messages必须是列表")
+    urls = []
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                image_url = part.get("image_url")
+                urls.append(image_url.get("url", "") if isinstance(image_url, dict) else str(image_url))
+    if not urls:
+        raise RequestError("消息中没有图像")
+    return urls
+
+
+class RecognitionServer:
+    """
+    基于aiohttp的asyncio前端
+
+    图像解码和预处理在线程池中执行，模型推理由InferenceScheduler的工作线程独占，
+    事件循环只负责收发请求和等待Future，不会被推理阻塞。
+    """
+
+    def __init__(self, scheduler, model_name="unimernet", api_key=None, idle_timeout=None):
+        self.scheduler = scheduler
+        self.model_name = model_name
+        self.api_key = api_key
+        self.idle_timeout = idle_timeout
+        # /health以外的请求才算活动，客户端探测服务状态不会让进程一直驻留
+        self.active_requests = 0
+        self.last_activity = time.monotonic()
+
+    async def recognize_images(self, images):
+        """并发提交多张图像并等待全部完成，返回(result, ok)列表"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for image in images:
+            future = await loop.run_in_executor(None, self.scheduler.submit, image)
+            futures.append(asyncio.wrap_future(future))
+        await asyncio.gather(*futures, return_exceptions=True)
+        return [request_result(future) for future in futures]
+
+    def create_app(self):
+        @web.middleware
+        async def handle_errors(request, handler):
+            if self.api_key and request.path != "/health":
+                if request.headers.get("Authorization", "") != f"Bearer {self.api_key}":
+                    return self._error(401, "API Key无效", "authentication_error")
+            active = request.path != "/health"
+            if active:
+                self.active_requests += 1
+            try:
+                return await handler(request)
+            except RequestError as e:
+                return self._error(400, str(e), "invalid_request_error")
+            except web.HTTPException:
+                raise
+            except Exception as e:
+                logger.error(f"请求处理失败 ({request.path}): {str(e)}")
+                return self._error(500, str(e), "server_error")
+            finally:
+                if active:
+                    self.active_requests -= 1
+                    self.last_activity = time.monotonic()
+
+        app = web.Application(client_max_size=MAX_REQUEST_SIZE, middlewares=[handle_errors])
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/recognize", self.recognize)
+        app.router.add_get("/v1/models", self.models)
+        app.router.add_get("/health", self.health)
+        if self.idle_timeout:
+            app.cleanup_ctx.append(self._idle_watcher)
+        return app
+
+    async def _idle_watcher(self, app):
+        task = asyncio.create_task(self._exit_when_idle())
+        yield
+        task.cancel()
+
+    async def _exit_when_idle(self):
+        """没有进行中的请求且空闲超过idle_timeout秒时退出run_app"""
+        while True:
+            remaining = self.idle_timeout - (time.monotonic() - self.last_activity)
+            if remaining <= 0 and self.active_requests == 0 and self.scheduler.queue_depth() == 0:
+                logger.info(f"已空闲 {self.idle_timeout}s，本地识别服务退出并释放模型")
+                # 与Ctrl+C相同的退出方式，run_app会关闭连接并执行清理
+                raise web.GracefulExit()
+            await asyncio.sleep(min(max(remaining, 1.0), 60.0))
+
+    @staticmethod
+    def _error(status, message, error_type):
+        return web.json_response(
+            {"error": {"message": message, "type": error_type}}, status=status, dumps=json_dumps
+        )
+
+    async def chat_completions(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise RequestError("请求体不是合法的JSON")
+        if not isinstance(body, dict):
+            raise RequestError("请求体必须是JSON对象")
+
+        loop = asyncio.get_running_loop()
+        images = []
+        for url in extract_images(body.get("messages")):
+            images.append(await loop.run_in_executor(None, decode_data_url, url))
+        results = await self.recognize_images(images)
+        failed = [result for result, ok in results if not ok]
+        if failed:
+            return self._error(500, failed[0], "server_error")
+
+        # 多张图像的识别结果按顺序以换行分隔
+        content = "\n".join(result for result, _ in results)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model") or self.model_name
+        if body.get("stream"):
+            return await self._stream_completion(request, completion_id, created, model, content)
+
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }, dumps=json_dumps)
+
+    async def _stream_completion(self, request, completion_id, created, model, content):
+        """stream=true时以SSE格式返回：整段结果作为一个增量，随后是结束块和[DONE]"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        for delta, finish_reason in (({"role": "assistant", "content": content}, None), ({}, "stop")):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            await response.write(f"data: {json_dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def recognize(self, request):
+        if not request.content_type.startswith("multipart/"):
+            raise RequestError("请使用multipart/form-data上传图像")
+
+        loop = asyncio.get_running_loop()
+        records, images, positions = [], [], []
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename is None:
+                continue
+            records.append({"filename": part.filename})
+            try:
+                images.append(await loop.run_in_executor(None, decode_image, await part.read()))
+                positions.append(len(records) - 1)
+            except RequestError as e:
+                records[-1]["error"] = str(e)
+        if not records:
+            raise RequestError("表单中没有图像文件")
+
+        for position, (result, ok) in zip(positions, await self.recognize_images(images)):
+            records[position]["latex" if ok else "error"] = result
+        return web.json_response({"results": records}, dumps=json_dumps)
+
+    async def models(self, request):
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": self.model_name, "object": "model", "created": 0, "owned_by": "freetex"}],
+        }, dumps=json_dumps)
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok",
+            "model": self.model_name,
+            "device": str(self.scheduler.device),
+            "pid": os.getpid(),
+            "idle_timeout": self.idle_timeout,
+            "scheduler": self.scheduler.stats(),
+        }, dumps=json_dumps)
+
+
+def serve(scheduler, host="127.0.0.1", port=8000, model_name="unimernet", api_key=None, idle_timeout=None):
+    """启动服务并阻塞直到收到中断信号，设置idle_timeout时空闲超时后也会返回"""
+    if web is None:
+        raise RuntimeError("本地识别服务需要aiohttp，请先执行 pip install aiohttp")
+
+    app = RecognitionServer(scheduler, model_name, api_key, idle_timeout).create_app()
+    logger.info(f"本地识别服务已启动: http://{host}:{port} (OpenAI兼容接口: http://{host}:{port}/v1)")
+    web.run_app(app, host=host, port=port, print=None)
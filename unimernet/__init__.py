@@ -12,10 +12,15 @@ from omegaconf import OmegaConf
 
 from unimernet.common.registry import registry
 
-from unimernet.datasets.builders import *
-from unimernet.models import *
-from unimernet.processors import *
-from unimernet.tasks import *
+# Dataset builders, augmentations and training tasks are only needed once something is
+# looked up in the registry; importing them here would make every `import unimernet.xxx`
+# (including inference) pay for datasets, evaluate, albumentations, etc.
+registry.register_lazy_modules(
+    "unimernet.datasets.builders",
+    "unimernet.models",
+    "unimernet.processors",
+    "unimernet.tasks",
+)
 
 
 root_dir = os.path.dirname(os.path.abspath(__file__))
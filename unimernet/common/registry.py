@@ -5,6 +5,8 @@
  For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 """
 
+import importlib
+
 
 class Registry:
     mapping = {
@@ -16,8 +18,42 @@ class Registry:
         "runner_name_mapping": {},
         "state": {},
         "paths": {},
+        "lazy_modules": [],
     }
 
+    @classmethod
+    def register_lazy_modules(cls, *module_names):
+        r"""Register modules whose import registers builders, models, processors, tasks, etc.
+
+        They are imported on the first lookup that misses, so code that only needs
+        a few classes (e.g. inference) does not pay for importing every dataset
+        builder, augmentation and training task up front.
+
+        Usage:
+
+            from unimernet.common.registry import registry
+
+            registry.register_lazy_modules("unimernet.tasks")
+        """
+        cls.mapping["lazy_modules"].extend(module_names)
+
+    @classmethod
+    def import_lazy_modules(cls):
+        lazy_modules = cls.mapping["lazy_modules"]
+        while lazy_modules:
+            importlib.import_module(lazy_modules.pop(0))
+
+    @classmethod
+    def _lookup(cls, mapping_name, name):
+        if name not in cls.mapping[mapping_name]:
+            cls.import_lazy_modules()
+        return cls.mapping[mapping_name].get(name, None)
+
+    @classmethod
+    def _names(cls, mapping_name):
+        cls.import_lazy_modules()
+        return sorted(cls.mapping[mapping_name].keys())
+
     @classmethod
     def register_builder(cls, name):
         r"""Register a dataset builder to registry with key 'name'
@@ -230,51 +266,51 @@ class Registry:
 
     @classmethod
     def get_builder_class(cls, name):
-        return cls.mapping["builder_name_mapping"].get(name, None)
+        return cls._lookup("builder_name_mapping", name)
 
     @classmethod
     def get_model_class(cls, name):
-        return cls.mapping["model_name_mapping"].get(name, None)
+        return cls._lookup("model_name_mapping", name)
 
     @classmethod
     def get_task_class(cls, name):
-        return cls.mapping["task_name_mapping"].get(name, None)
+        return cls._lookup("task_name_mapping", name)
 
     @classmethod
     def get_processor_class(cls, name):
-        return cls.mapping["processor_name_mapping"].get(name, None)
+        return cls._lookup("processor_name_mapping", name)
 
     @classmethod
     def get_lr_scheduler_class(cls, name):
-        return cls.mapping["lr_scheduler_name_mapping"].get(name, None)
+        return cls._lookup("lr_scheduler_name_mapping", name)
 
     @classmethod
     def get_runner_class(cls, name):
-        return cls.mapping["runner_name_mapping"].get(name, None)
+        return cls._lookup("runner_name_mapping", name)
 
     @classmethod
     def list_runners(cls):
-        return sorted(cls.mapping["runner_name_mapping"].keys())
+        return cls._names("runner_name_mapping")
 
     @classmethod
     def list_models(cls):
-        return sorted(cls.mapping["model_name_mapping"].keys())
+        return cls._names("model_name_mapping")
 
     @classmethod
     def list_tasks(cls):
-        return sorted(cls.mapping["task_name_mapping"].keys())
+        return cls._names("task_name_mapping")
 
     @classmethod
     def list_processors(cls):
-        return sorted(cls.mapping["processor_name_mapping"].keys())
+        return cls._names("processor_name_mapping")
 
     @classmethod
     def list_lr_schedulers(cls):
-        return sorted(cls.mapping["lr_scheduler_name_mapping"].keys())
+        return cls._names("lr_scheduler_name_mapping")
 
     @classmethod
     def list_datasets(cls):
-        return sorted(cls.mapping["builder_name_mapping"].keys())
+        return cls._names("builder_name_mapping")
 
     @classmethod
     def get_path(cls, name):
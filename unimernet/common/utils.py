@@ -19,17 +19,14 @@ from typing import Optional
 from urllib.parse import urlparse
 
 import numpy as np
-import pandas as pd
 import yaml
-from iopath.common.download import download
 from iopath.common.file_io import file_lock, g_pathmgr
 from unimernet.common.registry import registry
 from torch.utils.model_zoo import tqdm
-from torchvision.datasets.utils import (
-    check_integrity,
-    download_file_from_google_drive,
-    extract_archive,
-)
+
+# pandas, iopath's downloader and torchvision's dataset utilities are only needed for
+# dataset preparation and are imported inside the functions that use them, so that
+# `from unimernet.common.utils import is_url` stays cheap at inference time.
 
 
 def now():
@@ -182,6 +179,7 @@ def download_url(
     if not filename:
         filename = os.path.basename(url)
     fpath = os.path.join(root, filename)
+    from torchvision.datasets.utils import check_integrity, download_file_from_google_drive
 
     makedir(root)
 
@@ -235,6 +233,8 @@ def download_and_extract_archive(
     download_url(url, download_root, filename, md5)
 
     archive = os.path.join(download_root, filename)
+    from torchvision.datasets.utils import extract_archive
+
     print("Extracting {} to {}".format(archive, extract_root))
     extract_archive(archive, extract_root, remove_finished)
 
@@ -249,6 +249,8 @@ def cache_url(url: str, cache_dir: str) -> str:
     makedir(dirname)
     filename = url.split("/")[-1]
     cached = os.path.join(dirname, filename)
+    from iopath.common.download import download
+
     with file_lock(cached):
         if not os.path.isfile(cached):
             logging.info(f"Downloading {url} to {cached} ...")
@@ -364,6 +366,8 @@ def load_file(filename, mmap_mode=None, verbose=True, allow_pickle=False):
         with g_pathmgr.open(filename, "r") as fopen:
             data = yaml.load(fopen, Loader=yaml.FullLoader)
     elif file_ext == ".csv":
+        import pandas as pd
+
         with g_pathmgr.open(filename, "r") as fopen:
             data = pd.read_csv(fopen)
     else:
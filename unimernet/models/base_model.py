@@ -5,6 +5,7 @@
  For full license text, see the LICENSE file in the repo root or https://opensource.org/licenses/BSD-3-Clause
 """
 
+import json
 import logging
 import os
 
@@ -56,6 +57,44 @@ class BaseModel(nn.Module):
 
         return msg
 
+    def load_checkpoint_mmap(self, filename):
+        """
+        Load a checkpoint by memory-mapping it and assigning the mapped tensors to the model
+        (`load_state_dict(assign=True)`), instead of copying them into the existing parameters.
+        This is how a model built on the meta device gets its weights.
+
+        safetensors files are always mapped. Tensors that share storage in the original checkpoint (tied weights)
+        are written once by `tools/fp32tofp16.py`, with the dropped names recorded in the "aliases" metadata entry.
+        Pickled checkpoints are mapped with `torch.load(mmap=True)` when saved in the zip format, and read into memory
+        otherwise. Tensors whose dtype differs from the model's are converted, which copies them.
+        """
+        if filename.endswith(".safetensors"):
+            from safetensors import safe_open
+
+            state_dict = {}
+            with safe_open(filename, framework="pt", device="cpu") as f:
+                for key in f.keys():
+                    state_dict[key] = f.get_tensor(key)
+                aliases = json.loads((f.metadata() or {}).get("aliases", "{}"))
+            for alias, key in aliases.items():
+                state_dict[alias] = state_dict[key]
+        else:
+            try:
+                checkpoint = torch.load(filename, map_location="cpu", mmap=True)
+            except RuntimeError:
+                # legacy (non-zip) serialization cannot be memory-mapped
+                checkpoint = torch.load(filename, map_location="cpu")
+            state_dict = checkpoint["model"] if "model" in checkpoint.keys() else checkpoint
+
+        own_state = self.state_dict(keep_vars=True)
+        for key, tensor in state_dict.items():
+            if key in own_state and tensor.is_floating_point() and tensor.dtype != own_state[key].dtype:
+                state_dict[key] = tensor.to(own_state[key].dtype)
+
+        msg = self.load_state_dict(state_dict, strict=False, assign=True)
+        logging.info("load memory-mapped checkpoint from %s" % filename)
+        return msg
+
     @classmethod
     def from_pretrained(cls, model_type):
         """
@@ -8,6 +8,7 @@
 import contextlib
 import logging
 import os
+import threading
 import time
 import datetime
 
@@ -19,36 +20,100 @@ import torch.nn.functional as F
 import unimernet.common.dist_utils as dist_utils
 from unimernet.common.dist_utils import download_cached_file
 from unimernet.common.utils import is_url
-from unimernet.common.logger import MetricLogger
 from unimernet.models.base_model import BaseModel
-from unimernet.models.blip2_models.Qformer import BertConfig, BertLMHeadModel
-from unimernet.models.eva_vit import create_eva_vit_g
-from unimernet.models.clip_vit import create_clip_vit_L
-from transformers import BertTokenizer
 from transformers.utils import logging as tf_logging
 
 tf_logging.set_verbosity_error()
 
 
+AUTOCAST_DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16}
+
+
+def resolve_autocast_dtype(name, device):
+    """
+    Map an `autocast_dtype` setting to a torch dtype for `device`.
+
+    None disables autocast, "bfloat16"/"float16" are used as given, and "auto" picks bfloat16 on CPUs with native
+    bf16 support (AVX512-BF16 or AMX) and float16 on MPS, and disables autocast everywhere else.
+    """
+    if name is None:
+        return None
+    if name != "auto":
+        if name not in AUTOCAST_DTYPES:
+            raise ValueError(f"Unsupported autocast dtype: {name}")
+        return AUTOCAST_DTYPES[name]
+    if device.type == "cpu":
+        return torch.bfloat16 if _cpu_has_native_bf16() else None
+    if device.type == "mps":
+        return torch.float16
+    return None
+
+
+def _cpu_has_native_bf16():
+    # torch only exposes these checks as private helpers; treat a missing one as "not supported"
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, name, lambda: False)() for name in checks)
+
+
+# autocast-disabling contexts entered by `_fp32_pre_hook`, per thread since autocast state is thread-local
+_fp32_contexts = threading.local()
+
+
+def _fp32_pre_hook(module, args):
+    device_type = next((arg.device.type for arg in args if torch.is_tensor(arg)), "cpu")
+    context = torch.autocast(device_type, enabled=False)
+    context.__enter__()
+    if not hasattr(_fp32_contexts, "stack"):
+        _fp32_contexts.stack = []
+    _fp32_contexts.stack.append(context)
+    return tuple(arg.float() if torch.is_tensor(arg) and arg.is_floating_point() else arg for arg in args)
+
+
+def _fp32_post_hook(module, args, output):
+    # registered with always_call, so autocast is restored even when the forward raises
+    stack = getattr(_fp32_contexts, "stack", None)
+    if stack:
+        stack.pop().__exit__(None, None, None)
+
+
 class Blip2Base(BaseModel):
     @classmethod
     def init_tokenizer(cls, truncation_side="right"):
+        from transformers import BertTokenizer
+
         tokenizer = BertTokenizer.from_pretrained("/mnt/lustre/hanxiao/work/bert-base-uncased", truncation_side=truncation_side)
         tokenizer.add_special_tokens({"bos_token": "[DEC]"})
         return tokenizer
 
-    def maybe_autocast(self, dtype=torch.float16):
-        # if on cpu, don't use autocast
+    def maybe_autocast(self, dtype=None):
         # if on gpu, use autocast with dtype if provided, otherwise use torch.float16
-        enable_autocast = self.device != torch.device("cpu")
+        # if on cpu/mps, only use autocast when a dtype is provided or configured through `autocast_dtype`
+        device = self.device
+        if device.type == "cuda":
+            return torch.autocast("cuda", dtype=dtype or torch.float16)
 
-        if enable_autocast:
-            return torch.cuda.amp.autocast(dtype=dtype)
-        else:
+        dtype = dtype or resolve_autocast_dtype(getattr(self, "autocast_dtype", None), device)
+        if dtype is None:
             return contextlib.nullcontext()
+        return torch.autocast(device.type, dtype=dtype)
+
+    def keep_modules_fp32(self, class_names):
+        """
+        Run every submodule whose class name is in `class_names` (e.g. LayerNorm) outside autocast with fp32
+        inputs, so numerically sensitive layers keep full precision while the rest runs in reduced precision.
+        Implemented with forward hooks, so the modules and their state dict keys stay unchanged.
+        """
+        for module in self.modules():
+            if type(module).__name__ in class_names:
+                module.register_forward_pre_hook(_fp32_pre_hook)
+                module.register_forward_hook(_fp32_post_hook, always_call=True)
 
     @classmethod
     def init_Qformer(cls, num_query_token, vision_width, cross_attention_freq=2):
+        # Q-Former, EVA and CLIP backbones are not used by UniMERNet; import them on demand
+        # so that building the inference model does not load timm, fairscale, etc.
+        from unimernet.models.blip2_models.Qformer import BertConfig, BertLMHeadModel
+
         encoder_config = BertConfig.from_pretrained("/mnt/lustre/hanxiao/work/bert-base-uncased")
         encoder_config.encoder_width = vision_width
         # insert cross-attention layer every other block
@@ -72,6 +137,9 @@ class Blip2Base(BaseModel):
             "eva2_clip_L",
             "clip_L",
         ], "vit model must be eva_clip_g, eva2_clip_L or clip_L"
+        from unimernet.models.clip_vit import create_clip_vit_L
+        from unimernet.models.eva_vit import create_eva_vit_g
+
         if model_name == "eva_clip_g":
             visual_encoder = create_eva_vit_g(
                 img_size, drop_path_rate, use_grad_checkpoint, precision
@@ -207,6 +275,8 @@ class LayerNorm(nn.LayerNorm):
 
 
 def compute_sim_matrix(model, data_loader, **kwargs):
+    from unimernet.common.logger import MetricLogger
+
     k_test = kwargs.pop("k_test")
 
     metric_logger = MetricLogger(delimiter="  ")
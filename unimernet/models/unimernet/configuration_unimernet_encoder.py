@@ -65,6 +65,9 @@ class UnimerNetConfig(PretrainedConfig):
             The standard deviation of the truncated_normal_initializer for initializing all weight matrices.
         layer_norm_eps (`float`, *optional*, defaults to 1e-05):
             The epsilon used by the layer normalization layers.
+        window_attn_implementation (`str`, *optional*, defaults to `"eager"`):
+            The window attention implementation: `"eager"` or `"sdpa"` (fused query/key/value projection and
+            `torch.nn.functional.scaled_dot_product_attention`).
 
     Example:
 
@@ -106,6 +109,7 @@ class UnimerNetConfig(PretrainedConfig):
         use_absolute_embeddings=False,
         initializer_range=0.02,
         layer_norm_eps=1e-5,
+        window_attn_implementation="eager",
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -127,6 +131,7 @@ class UnimerNetConfig(PretrainedConfig):
         self.use_absolute_embeddings = use_absolute_embeddings
         self.layer_norm_eps = layer_norm_eps
         self.initializer_range = initializer_range
+        self.window_attn_implementation = window_attn_implementation
         # we set the hidden_size attribute in order to make Swin work with VisionEncoderDecoderModel
         # this indicates the channel dimension after the last stage of the model
         self.hidden_size = int(embed_dim * 2 ** (len(depths) - 1))
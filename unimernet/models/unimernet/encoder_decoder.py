@@ -14,7 +14,12 @@ from transformers import AutoModel, VisionEncoderDecoderModel, AutoImageProcesso
 from unimernet.models.unimernet.processor import VariableDonutProcessor, VariableDonutImageProcessor
 # from transformers.models.mbart.modeling_mbart import MBartDecoder
 from transformers.models.vision_encoder_decoder.modeling_vision_encoder_decoder import shift_tokens_right
-from transformers.modeling_attn_mask_utils import _prepare_4d_attention_mask, _prepare_4d_causal_attention_mask
+from transformers.modeling_attn_mask_utils import (
+    _prepare_4d_attention_mask,
+    _prepare_4d_attention_mask_for_sdpa,
+    _prepare_4d_causal_attention_mask,
+    _prepare_4d_causal_attention_mask_for_sdpa,
+)
 from transformers.modeling_outputs import BaseModelOutput, Seq2SeqLMOutput, CausalLMOutputWithCrossAttentions, BaseModelOutputWithPastAndCrossAttentions
 # from transformers.models.donut.modeling_donut_swin import DonutSwinPatchEmbeddings, DonutSwinEmbeddings, DonutSwinModel, DonutSwinEncoder
 from transformers.utils import logging, ModelOutput
@@ -72,6 +77,29 @@ class StemLayer(nn.Module):
                                padding=1)
 
 
+    def fold_input_channels(self):
+        """
+        Replace `conv1` with a single-channel convolution for inputs whose channels are identical (grayscale repeated
+        to RGB). The convolution is linear in its input, so summing the kernels over the input channels gives the same
+        output from the one channel, up to float summation order.
+        """
+        conv = self.conv1
+        folded = nn.Conv2d(
+            1,
+            conv.out_channels,
+            kernel_size=conv.kernel_size,
+            stride=conv.stride,
+            padding=conv.padding,
+            bias=conv.bias is not None,
+            device=conv.weight.device,
+            dtype=conv.weight.dtype,
+        )
+        with torch.no_grad():
+            folded.weight.copy_(conv.weight.sum(dim=1, keepdim=True))
+            if conv.bias is not None:
+                folded.bias.copy_(conv.bias)
+        self.conv1 = folded
+
     def forward(self, x):
         x = self.conv1(x)
         x = self.norm1(x)
@@ -307,6 +335,12 @@ class CustomMBartDecoder(MBartDecoder):
         if self._use_flash_attention_2:
             # 2d mask is passed through the layers
             attention_mask = attention_mask if (attention_mask is not None and 0 in attention_mask) else None
+        elif self._use_sdpa and not output_attentions and cross_attn_head_mask is None:
+            # output_attentions=True & cross_attn_head_mask can not be supported when using SDPA, and we fall back on
+            # the manual implementation that requires a 4D causal mask in all cases.
+            attention_mask = _prepare_4d_causal_attention_mask_for_sdpa(
+                attention_mask, input_shape, inputs_embeds, past_key_values_length
+            )
         else:
             # 4d mask is passed through the layers
             attention_mask = _prepare_4d_causal_attention_mask(
@@ -317,6 +351,11 @@ class CustomMBartDecoder(MBartDecoder):
         if encoder_hidden_states is not None and encoder_attention_mask is not None:
             if self._use_flash_attention_2:
                 encoder_attention_mask = encoder_attention_mask if 0 in encoder_attention_mask else None
+            elif self._use_sdpa and cross_attn_head_mask is None and not output_attentions:
+                # [bsz, seq_len] -> [bsz, 1, tgt_seq_len, src_seq_len]
+                encoder_attention_mask = _prepare_4d_attention_mask_for_sdpa(
+                    encoder_attention_mask, inputs_embeds.dtype, tgt_len=input_shape[-1]
+                )
             else:
                 # [bsz, seq_len] -> [bsz, 1, tgt_seq_len, src_seq_len]
                 encoder_attention_mask = _prepare_4d_attention_mask(
@@ -428,9 +467,18 @@ class CustomMBartDecoder(MBartDecoder):
 
 
 class CustomMBartForCausalLM(MBartForCausalLM):
+    _supports_sdpa = True
+
     def __init__(self, config):
         print("CustomMBartForCausalLM init")
+        # the stock transformers MBart decoder built by super().__init__ (and replaced right below) has no SDPA
+        # attention, so it is always built with eager attention
+        attn_implementation = config._attn_implementation
+        if attn_implementation == "sdpa":
+            config._attn_implementation = "eager"
         super().__init__(config)
+        config._attn_implementation = attn_implementation
+        self.config._attn_implementation = attn_implementation
         # Modify the decoder within MBartDecoderWrapper
         self.model.decoder = CustomMBartDecoder(config)
 
@@ -740,12 +788,17 @@ class SelfAttentionBlock(nn.Module):
 
 class DonutEncoderDecoder(nn.Module):
 
-    def __init__(self, model_name, num_tokens, pad_token_id, bos_token_id, eos_token_id):
+    def __init__(self, model_name, num_tokens, pad_token_id, bos_token_id, eos_token_id, attn_implementation="eager",
+                 encoder_attn_implementation="eager"):
         super().__init__()
         config = VisionEncoderDecoderConfig.from_pretrained(model_name)
         encoder_config = vars(config.encoder)
         encoder = VariableUnimerNetConfig(**encoder_config)
+        # "eager" or "sdpa" for the encoder window attention
+        encoder.window_attn_implementation = encoder_attn_implementation
         config.encoder = encoder
+        # "eager", "sdpa" or "flash_attention_2" for the MBart decoder attention
+        config.decoder._attn_implementation = attn_implementation
         self.config = config
 
         AutoModel.register(VariableUnimerNetConfig, VariableUnimerNetModel)
@@ -757,10 +810,23 @@ class DonutEncoderDecoder(nn.Module):
         self.model.config.eos_token_id = eos_token_id
         self.model.decoder.resize_token_embeddings(num_tokens)
         self.pad_token_id = pad_token_id
+        # set by fold_grayscale_stem: the patch embedding takes the 1-channel images directly
+        self.grayscale_stem = False
+
+    def fold_grayscale_stem(self):
+        """
+        Fold the RGB kernels of the patch-embedding stem into a single input channel, so grayscale images no longer
+        have to be repeated to three channels before the encoder. Meant for inference: the folded weights do not load
+        back into an RGB model.
+        """
+        patch_embeddings = self.model.encoder.embeddings.patch_embeddings
+        patch_embeddings.projection.fold_input_channels()
+        patch_embeddings.num_channels = 1
+        self.grayscale_stem = True
 
     def forward(self, pixel_values, decoder_input_ids, decoder_attention_mask, **kwargs):
         num_channels = pixel_values.shape[1]
-        if num_channels == 1:
+        if num_channels == 1 and not self.grayscale_stem:
             pixel_values = pixel_values.repeat(1, 3, 1, 1)
 
         labels = decoder_input_ids * 1
@@ -776,22 +842,112 @@ class DonutEncoderDecoder(nn.Module):
         return loss
 
     @torch.no_grad()
-    def generate(self, pixel_values, temperature, max_new_tokens, decoder_start_token_id, do_sample, top_p,
-                 **kwargs):
-
+    def encode(self, pixel_values):
+        """Run only the vision encoder and return its `BaseModelOutput`."""
         num_channels = pixel_values.shape[1]
-        if num_channels == 1:
+        if num_channels == 1 and not self.grayscale_stem:
             pixel_values = pixel_values.repeat(1, 3, 1, 1)
-        outputs = self.model.generate(
-            pixel_values=pixel_values,
-            max_new_tokens=max_new_tokens,
-            decoder_start_token_id=decoder_start_token_id,
-            temperature=temperature,
-            do_sample=do_sample,
-            top_p=top_p,
-        )
+        return self.model.encoder(pixel_values, return_dict=True)
+
+    @torch.no_grad()
+    def generate(self, pixel_values, temperature, max_new_tokens, decoder_start_token_id, do_sample, top_p,
+                 encoder_outputs=None, static_cache=False, compact=False, max_lengths=None, **kwargs):
+        # precomputed encoder outputs let re-decodes of the same image skip the encoder entirely
+        if encoder_outputs is None:
+            encoder_outputs = self.encode(pixel_values)
+        decoder = self.model.decoder.model.decoder
+        greedy = not do_sample and (compact or max_lengths is not None)
+        if static_cache:
+            # the start token plus every generated token but the last one pass through the decoder; with a
+            # per-image length cap no row decodes past the longest cap, so size the buffers for that
+            cache_length = max_new_tokens
+            if greedy and max_lengths is not None:
+                cache_length = min(max_new_tokens, max(1, int(torch.as_tensor(max_lengths).max())))
+            decoder.setup_static_cache(cache_length + 1)
+        try:
+            if greedy:
+                outputs = self.greedy_generate(
+                    encoder_outputs, max_new_tokens, decoder_start_token_id, max_lengths, static_cache
+                )
+                return outputs[:, 1:]
+            outputs = self.model.generate(
+                encoder_outputs=encoder_outputs,
+                max_new_tokens=max_new_tokens,
+                decoder_start_token_id=decoder_start_token_id,
+                temperature=temperature,
+                do_sample=do_sample,
+                top_p=top_p,
+            )
+        finally:
+            if static_cache:
+                decoder.reset_static_cache()
         return outputs[:, 1:]
 
+    @torch.no_grad()
+    def greedy_generate(self, encoder_outputs, max_new_tokens, decoder_start_token_id, max_lengths=None,
+                        static_cache=False):
+        """
+        Greedy decoding that drops every sequence from the batch as soon as it emits EOS or reaches its length cap,
+        together with its encoder states and KV cache rows, so short formulas stop costing decoder time while the
+        longest one in the batch is still running. The output matches `generate` with `do_sample=False`: each row
+        starts with `decoder_start_token_id` and is right-padded with the pad token. A row that runs out of tokens ends
+        the way `generate` ends it: with `forced_eos_token_id` when the generation config sets one (as the MBart
+        config shipped with UniMERNet does), otherwise with its last generated token and no EOS.
+
+        `max_lengths` optionally caps the number of new tokens per image (at most `max_new_tokens`); a row that hits
+        its cap ends like one that reaches `max_new_tokens`.
+        """
+        hidden_states = encoder_outputs.last_hidden_state
+        batch_size, device = hidden_states.shape[0], hidden_states.device
+        eos_token_id = self.model.config.eos_token_id
+        # mirrors ForcedEOSTokenLogitsProcessor: with several ids, every other logit is -inf and argmax picks the lowest
+        forced_eos_token_id = self.model.generation_config.forced_eos_token_id
+        if isinstance(forced_eos_token_id, (list, tuple)):
+            forced_eos_token_id = min(forced_eos_token_id)
+        if max_lengths is None:
+            max_lengths = torch.full((batch_size,), max_new_tokens, dtype=torch.long, device=device)
+        max_lengths = torch.as_tensor(max_lengths, device=device).clamp(1, max_new_tokens)
+        decoder = self.model.decoder.model.decoder
+
+        sequences = torch.full((batch_size, max_new_tokens + 1), self.pad_token_id, dtype=torch.long, device=device)
+        sequences[:, 0] = decoder_start_token_id
+        # rows of the original batch that are still being decoded
+        active = torch.arange(batch_size, device=device)
+        input_ids = sequences[:, :1]
+        past_key_values = None
+        for step in range(1, max_new_tokens + 1):
+            outputs = self.model(
+                encoder_outputs=BaseModelOutput(last_hidden_state=hidden_states),
+                decoder_input_ids=input_ids,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            next_tokens = outputs.logits[:, -1].argmax(dim=-1)
+            at_cap = max_lengths[active] == step
+            if forced_eos_token_id is not None:
+                next_tokens = next_tokens.masked_fill(at_cap, forced_eos_token_id)
+            sequences[active, step] = next_tokens
+
+            finished = (next_tokens == eos_token_id) | at_cap
+            if finished.any():
+                keep = (~finished).nonzero().squeeze(1)
+                if keep.numel() == 0:
+                    break
+                active = active[keep]
+                next_tokens = next_tokens[keep]
+                hidden_states = hidden_states[keep]
+                self_past = decoder.compact_static_cache(keep, step) if static_cache else None
+                past_key_values = tuple(
+                    (*self_past[i], layer_past[2][keep], layer_past[3][keep]) if static_cache
+                    else tuple(past[keep] for past in layer_past)
+                    for i, layer_past in enumerate(outputs.past_key_values)
+                )
+            else:
+                past_key_values = outputs.past_key_values
+            input_ids = next_tokens.unsqueeze(1)
+        # every row is finished by now, the last one at `step`
+        return sequences[:, :step + 1]
+
 
 
 class DonutTokenizer:
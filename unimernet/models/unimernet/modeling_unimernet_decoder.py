@@ -172,58 +172,131 @@ class MBartSqueezeAttention(nn.Module):
         self.q_proj = nn.Linear(embed_dim, self.squeeze_dim, bias=bias)
         self.out_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
 
+        # preallocated self-attention cache, see `setup_static_cache`
+        self.static_cache_length = 0
+        self.static_key_cache = None
+        self.static_value_cache = None
+
     def _shape_qk(self, tensor: torch.Tensor, seq_len: int, bsz: int):
         return tensor.view(bsz, seq_len, self.num_heads, self.squeeze_head_dim).transpose(1, 2).contiguous()
 
     def _shape_v(self, tensor: torch.Tensor, seq_len: int, bsz: int):
         return tensor.view(bsz, seq_len, self.num_heads, self.head_dim).transpose(1, 2).contiguous()
 
-    def forward(
-        self,
-        hidden_states: torch.Tensor,
-        key_value_states: Optional[torch.Tensor] = None,
-        past_key_value: Optional[Tuple[torch.Tensor]] = None,
-        attention_mask: Optional[torch.Tensor] = None,
-        layer_head_mask: Optional[torch.Tensor] = None,
-        output_attentions: bool = False,
-    ) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[Tuple[torch.Tensor]]]:
-        """Input shape: Batch x Time x Channel"""
+    def _project_kv(self, states: torch.Tensor, bsz: int):
+        """Project `states` to squeezed keys and full-width values, both shaped (bsz, num_heads, seq_len, dim)."""
+        key_states = self._shape_qk(self.k_proj(states), -1, bsz)
+        value_states = self._shape_v(self.v_proj(states), -1, bsz)
+        return key_states, value_states
 
-        # if key_value_states are provided this layer is used as a cross-attention layer
-        # for the decoder
-        is_cross_attention = key_value_states is not None
+    def setup_static_cache(self, max_length: int):
+        """
+        Decode with a preallocated self-attention cache of `max_length` positions instead of growing it with
+        `torch.cat` at every step. Buffers are allocated lazily on the first forward so they pick up the batch size,
+        device and (autocast) dtype of the projected states. Only valid for greedy decoding and sampling, where the
+        batch is never reordered.
+        """
+        self.static_cache_length = max_length
+        self.static_key_cache = None
+        self.static_value_cache = None
+
+    def reset_static_cache(self):
+        """Free the static cache buffers and go back to the concatenating cache."""
+        self.setup_static_cache(0)
+
+    def _update_static_cache(self, key_states: torch.Tensor, value_states: torch.Tensor, past_length: int):
+        bsz, _, seq_len, _ = key_states.shape
+        end = past_length + seq_len
+        if end > self.static_cache_length:
+            raise ValueError(
+                f"Static cache holds {self.static_cache_length} positions, but {end} are needed"
+            )
+        if (
+            self.static_key_cache is None
+            or self.static_key_cache.shape[0] < bsz
+            or self.static_key_cache.dtype != key_states.dtype
+            or self.static_key_cache.device != key_states.device
+        ):
+            self.static_key_cache = key_states.new_empty(
+                (bsz, self.num_heads, self.static_cache_length, self.squeeze_head_dim)
+            )
+            self.static_value_cache = value_states.new_empty(
+                (bsz, self.num_heads, self.static_cache_length, self.head_dim)
+            )
 
-        bsz, tgt_len, _ = hidden_states.size()
+        # write the new positions in place and hand out views of the filled prefix, so
+        # `past_key_value[0].shape[2]` still reports the number of cached positions
+        self.static_key_cache[:bsz, :, past_length:end] = key_states
+        self.static_value_cache[:bsz, :, past_length:end] = value_states
+        return self.static_key_cache[:bsz, :, :end], self.static_value_cache[:bsz, :, :end]
 
-        # get query proj
-        query_states = self.q_proj(hidden_states) * self.scaling
+    def compact_static_cache(self, keep: torch.Tensor, length: int):
+        """
+        Move the rows `keep` of the static cache to the front, dropping the rest, and return views of their first
+        `length` positions as the new self-attention `past_key_value`.
+        """
+        bsz = keep.shape[0]
+        # advanced indexing copies the kept rows before they are written back, so overlapping rows are safe
+        self.static_key_cache[:bsz, :, :length] = self.static_key_cache[keep, :, :length]
+        self.static_value_cache[:bsz, :, :length] = self.static_value_cache[keep, :, :length]
+        return self.static_key_cache[:bsz, :, :length], self.static_value_cache[:bsz, :, :length]
+
+    def _get_key_value_states(
+        self,
+        hidden_states: torch.Tensor,
+        key_value_states: Optional[torch.Tensor],
+        past_key_value: Optional[Tuple[torch.Tensor]],
+        bsz: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Return keys and values shaped (bsz, num_heads, src_len, dim), reusing or extending `past_key_value`."""
         # get key, value proj
         # `past_key_value[0].shape[2] == key_value_states.shape[1]`
         # is checking that the `sequence_length` of the `past_key_value` is the same as
         # the provided `key_value_states` to support prefix tuning
         if (
-            is_cross_attention
+            key_value_states is not None
             and past_key_value is not None
             and past_key_value[0].shape[2] == key_value_states.shape[1]
         ):
             # reuse k,v, cross_attentions
             key_states = past_key_value[0]
             value_states = past_key_value[1]
-        elif is_cross_attention:
+        elif key_value_states is not None:
             # cross_attentions
-            key_states = self._shape_qk(self.k_proj(key_value_states), -1, bsz)
-            value_states = self._shape_v(self.v_proj(key_value_states), -1, bsz)
+            key_states, value_states = self._project_kv(key_value_states, bsz)
+        elif self.static_cache_length:
+            # self_attention, written in place into the static cache
+            key_states, value_states = self._project_kv(hidden_states, bsz)
+            past_length = past_key_value[0].shape[2] if past_key_value is not None else 0
+            key_states, value_states = self._update_static_cache(key_states, value_states, past_length)
         elif past_key_value is not None:
             # reuse k, v, self_attention
-            key_states = self._shape_qk(self.k_proj(hidden_states), -1, bsz)
-            value_states = self._shape_v(self.v_proj(hidden_states), -1, bsz)
+            key_states, value_states = self._project_kv(hidden_states, bsz)
             key_states = torch.cat([past_key_value[0], key_states], dim=2)
             value_states = torch.cat([past_key_value[1], value_states], dim=2)
         else:
             # self_attention
-            key_states = self._shape_qk(self.k_proj(hidden_states), -1, bsz)
-            value_states = self._shape_v(self.v_proj(hidden_states), -1, bsz)
+            key_states, value_states = self._project_kv(hidden_states, bsz)
+        return key_states, value_states
+
+    def forward(
+        self,
+        hidden_states: torch.Tensor,
+        key_value_states: Optional[torch.Tensor] = None,
+        past_key_value: Optional[Tuple[torch.Tensor]] = None,
+        attention_mask: Optional[torch.Tensor] = None,
+        layer_head_mask: Optional[torch.Tensor] = None,
+        output_attentions: bool = False,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[Tuple[torch.Tensor]]]:
+        """Input shape: Batch x Time x Channel"""
 
+        # if key_value_states are provided this layer is used as a cross-attention layer
+        # for the decoder
+        bsz, tgt_len, _ = hidden_states.size()
+
+        # get query proj
+        query_states = self.q_proj(hidden_states) * self.scaling
+        key_states, value_states = self._get_key_value_states(hidden_states, key_value_states, past_key_value, bsz)
         if self.is_decoder:
             # if cross_attention save Tuple(torch.Tensor, torch.Tensor) of all cross attention key/value_states.
             # Further calls to cross_attention layer can then reuse all cross-attention
@@ -257,7 +330,8 @@ class MBartSqueezeAttention(nn.Module):
             attn_weights = attn_weights.view(bsz, self.num_heads, tgt_len, src_len) + attention_mask
             attn_weights = attn_weights.view(bsz * self.num_heads, tgt_len, src_len)
 
-        attn_weights = nn.functional.softmax(attn_weights, dim=-1)
+        # softmax in fp32 even under (CPU) autocast, which would otherwise keep it in reduced precision
+        attn_weights = nn.functional.softmax(attn_weights, dim=-1, dtype=torch.float32).to(attn_weights.dtype)
 
         if layer_head_mask is not None:
             if layer_head_mask.size() != (self.num_heads,):
@@ -317,9 +391,6 @@ class MBartFlashAttention2(MBartSqueezeAttention):
         # Beware that with flash_attn<2.1, using q_seqlen != k_seqlen (except for the case q_seqlen == 1) produces a wrong mask (top-left).
         self._flash_attn_uses_top_left_mask = not is_flash_attn_greater_or_equal_2_10()
 
-    def _reshape(self, tensor: torch.Tensor, seq_len: int, bsz: int):
-        return tensor.view(bsz, seq_len, self.num_heads, self.head_dim)
-
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -333,40 +404,12 @@ class MBartFlashAttention2(MBartSqueezeAttention):
         if output_attentions:
             raise ValueError("MBartFlashAttention2 attention does not support output_attentions")
 
-        # if key_value_states are provided this layer is used as a cross-attention layer
-        # for the decoder
-        is_cross_attention = key_value_states is not None
-
         bsz, q_len, _ = hidden_states.size()
 
         # get query proj
-        query_states = self._reshape(self.q_proj(hidden_states), -1, bsz)
-        # get key, value proj
-        # `past_key_value[0].shape[2] == key_value_states.shape[1]`
-        # is checking that the `sequence_length` of the `past_key_value` is the same as
-        # the provided `key_value_states` to support prefix tuning
-        if (
-            is_cross_attention
-            and past_key_value is not None
-            and past_key_value[0].shape[2] == key_value_states.shape[1]
-        ):
-            # reuse k,v, cross_attentions
-            key_states = past_key_value[0].transpose(1, 2)
-            value_states = past_key_value[1].transpose(1, 2)
-        elif is_cross_attention:
-            # cross_attentions
-            key_states = self._reshape(self.k_proj(key_value_states), -1, bsz)
-            value_states = self._reshape(self.v_proj(key_value_states), -1, bsz)
-        elif past_key_value is not None:
-            # reuse k, v, self_attention
-            key_states = self._reshape(self.k_proj(hidden_states), -1, bsz)
-            value_states = self._reshape(self.v_proj(hidden_states), -1, bsz)
-            key_states = torch.cat([past_key_value[0].transpose(1, 2), key_states], dim=1)
-            value_states = torch.cat([past_key_value[1].transpose(1, 2), value_states], dim=1)
-        else:
-            # self_attention
-            key_states = self._reshape(self.k_proj(hidden_states), -1, bsz)
-            value_states = self._reshape(self.v_proj(hidden_states), -1, bsz)
+        query_states = self._shape_qk(self.q_proj(hidden_states), q_len, bsz)
+        # shared with the eager path so the static KV cache is filled and compacted the same way
+        key_states, value_states = self._get_key_value_states(hidden_states, key_value_states, past_key_value, bsz)
 
         if self.is_decoder:
             # if cross_attention save Tuple(torch.Tensor, torch.Tensor) of all cross attention key/value_states.
@@ -376,7 +419,12 @@ class MBartFlashAttention2(MBartSqueezeAttention):
             # all previous decoder key/value_states. Further calls to uni-directional self-attention
             # can concat previous decoder key/value_states to current projected key/value_states (third "elif" case)
             # if encoder bi-directional self-attention `past_key_value` is always `None`
-            past_key_value = (key_states.transpose(1, 2), value_states.transpose(1, 2))
+            past_key_value = (key_states, value_states)
+
+        # flash attention takes (bsz, seq_len, num_heads, head_dim)
+        query_states = query_states.transpose(1, 2)
+        key_states = key_states.transpose(1, 2)
+        value_states = value_states.transpose(1, 2)
 
         kv_seq_len = key_states.shape[-2]
         if past_key_value is not None:
@@ -520,8 +568,88 @@ class MBartFlashAttention2(MBartSqueezeAttention):
         )
 
 
+# Adapted from transformers.models.bart.modeling_bart.BartSdpaAttention with Bart->MBart, with qk_squeeze
+class MBartSdpaAttention(MBartSqueezeAttention):
+    """
+    MBart squeeze attention using `torch.nn.functional.scaled_dot_product_attention`. Queries and keys use the
+    squeezed head dim while values keep the full head dim, so weights and the (static) KV cache are shared with the
+    eager implementation.
+
+    PyTorch's fused CPU kernel needs equal q/k and v head dims; without it SDPA falls back to an unfused math kernel
+    that is slower than the eager `bmm` path. On CPU, multi-token passes therefore zero-pad queries and keys to the
+    value head dim (which leaves q.k unchanged), and single-token decoding steps, where padding the whole key cache
+    would cost more than it saves, use the eager path.
+    """
+
+    def forward(
+        self,
+        hidden_states: torch.Tensor,
+        key_value_states: Optional[torch.Tensor] = None,
+        past_key_value: Optional[Tuple[torch.Tensor]] = None,
+        attention_mask: Optional[torch.Tensor] = None,
+        layer_head_mask: Optional[torch.Tensor] = None,
+        output_attentions: bool = False,
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[Tuple[torch.Tensor]]]:
+        """Input shape: Batch x Time x Channel"""
+        if output_attentions or layer_head_mask is not None:
+            logger.warning_once(
+                "MBartSdpaAttention does not support `output_attentions=True` or `layer_head_mask`, falling back to "
+                "the eager attention implementation."
+            )
+        bsz, tgt_len, _ = hidden_states.size()
+        pad_qk = hidden_states.device.type == "cpu" and self.squeeze_head_dim != self.head_dim
+        if output_attentions or layer_head_mask is not None or (pad_qk and tgt_len == 1):
+            return super().forward(
+                hidden_states,
+                key_value_states=key_value_states,
+                past_key_value=past_key_value,
+                attention_mask=attention_mask,
+                layer_head_mask=layer_head_mask,
+                output_attentions=output_attentions,
+            )
+
+        query_states = self._shape_qk(self.q_proj(hidden_states), tgt_len, bsz)
+        key_states, value_states = self._get_key_value_states(hidden_states, key_value_states, past_key_value, bsz)
+        if self.is_decoder:
+            past_key_value = (key_states, value_states)
+
+        attn_query_states, attn_key_states = query_states, key_states
+        if pad_qk:
+            padding = (0, self.head_dim - self.squeeze_head_dim)
+            attn_query_states = F.pad(query_states, padding)
+            attn_key_states = F.pad(key_states, padding)
+
+        # The tgt_len > 1 is necessary to match with AttentionMaskConverter.to_causal_4d that does not create a
+        # causal mask in case tgt_len == 1.
+        is_causal = True if self.is_causal and attention_mask is None and tgt_len > 1 else False
+
+        attn_output = F.scaled_dot_product_attention(
+            attn_query_states,
+            attn_key_states,
+            value_states,
+            attn_mask=attention_mask,
+            dropout_p=self.dropout if self.training else 0.0,
+            is_causal=is_causal,
+            scale=self.scaling,
+        )
+
+        if attn_output.size() != (bsz, self.num_heads, tgt_len, self.head_dim):
+            raise ValueError(
+                f"`attn_output` should be of size {(bsz, self.num_heads, tgt_len, self.head_dim)}, but is"
+                f" {attn_output.size()}"
+            )
+
+        attn_output = attn_output.transpose(1, 2)
+        attn_output = attn_output.reshape(bsz, tgt_len, self.embed_dim)
+
+        attn_output = self.out_proj(attn_output)
+
+        return attn_output, None, past_key_value
+
+
 MBART_ATTENTION_CLASSES = {
     "eager": MBartSqueezeAttention,
+    "sdpa": MBartSdpaAttention,
     "flash_attention_2": MBartFlashAttention2,
 }
 
@@ -747,6 +875,7 @@ class MBartPreTrainedModel(PreTrainedModel):
     supports_gradient_checkpointing = True
     _no_split_modules = ["MBartDecoderLayer", "MBartSqueezeAttention"]
     _supports_flash_attn_2 = True
+    _supports_sdpa = True
 
     def _init_weights(self, module):
         std = self.config.init_std
@@ -1137,6 +1266,7 @@ class MBartDecoder(MBartPreTrainedModel):
         )
         self.layers = nn.ModuleList([MBartDecoderLayer(config) for _ in range(config.decoder_layers)])
         self._use_flash_attention_2 = config._attn_implementation == "flash_attention_2"
+        self._use_sdpa = config._attn_implementation == "sdpa"
         self.layernorm_embedding = nn.LayerNorm(config.d_model)
         self.layer_norm = nn.LayerNorm(config.d_model)
 
@@ -1150,6 +1280,21 @@ class MBartDecoder(MBartPreTrainedModel):
     def set_input_embeddings(self, value):
         self.embed_tokens = value
 
+    def setup_static_cache(self, max_length: int):
+        """Switch every self-attention layer to a preallocated cache of `max_length` positions."""
+        for layer in self.layers:
+            if isinstance(layer.self_attn, MBartSqueezeAttention):
+                layer.self_attn.setup_static_cache(max_length)
+
+    def reset_static_cache(self):
+        for layer in self.layers:
+            if isinstance(layer.self_attn, MBartSqueezeAttention):
+                layer.self_attn.reset_static_cache()
+
+    def compact_static_cache(self, keep: torch.Tensor, length: int):
+        """Keep only the batch rows `keep` in every static cache, returning the new self-attention past key/values."""
+        return [layer.self_attn.compact_static_cache(keep, length) for layer in self.layers]
+
     def forward(
         self,
         input_ids: torch.LongTensor = None,
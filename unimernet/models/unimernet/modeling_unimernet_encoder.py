@@ -394,6 +394,9 @@ class UnimerNetSelfAttention(nn.Module):
         relative_coords[:, :, 0] *= 2 * self.window_size[1] - 1
         relative_position_index = relative_coords.sum(-1)
         self.register_buffer("relative_position_index", relative_position_index)
+        # gathered and permuted bias table, reused while the table is unchanged and no gradient is needed
+        self._relative_position_bias = None
+        self._relative_position_bias_key = None
 
         self.query = nn.Linear(self.all_head_size, self.all_head_size, bias=config.qkv_bias)
         self.key = nn.Linear(self.all_head_size, self.all_head_size, bias=config.qkv_bias)
@@ -406,6 +409,32 @@ class UnimerNetSelfAttention(nn.Module):
         x = x.view(new_x_shape)
         return x.permute(0, 2, 1, 3)
 
+    def get_relative_position_bias(self):
+        """
+        Relative position bias of shape (num_heads, window_area, window_area).
+
+        When no gradient flows into the table (inference), the result is cached. The cache key contains the table's
+        storage pointer and version counter, so in-place updates (optimizer steps, `load_state_dict`) as well as
+        replacing or moving the parameter invalidate it.
+        """
+        table = self.relative_position_bias_table
+        cacheable = not (torch.is_grad_enabled() and table.requires_grad) and not torch.jit.is_tracing()
+        if cacheable:
+            key = (table.data_ptr(), table._version, table.dtype, table.device)
+            if key == self._relative_position_bias_key:
+                return self._relative_position_bias
+
+        relative_position_bias = table[self.relative_position_index.view(-1)]
+        relative_position_bias = relative_position_bias.view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1
+        )
+        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()
+
+        if cacheable:
+            self._relative_position_bias = relative_position_bias
+            self._relative_position_bias_key = key
+        return relative_position_bias
+
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -425,12 +454,7 @@ class UnimerNetSelfAttention(nn.Module):
 
         attention_scores = attention_scores / math.sqrt(self.attention_head_size)
 
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)]
-        relative_position_bias = relative_position_bias.view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1
-        )
-
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()
+        relative_position_bias = self.get_relative_position_bias()
         attention_scores = attention_scores + relative_position_bias.unsqueeze(0)
 
         if attention_mask is not None:
@@ -463,6 +487,119 @@ class UnimerNetSelfAttention(nn.Module):
         return outputs
 
 
+class UnimerNetSdpaSelfAttention(UnimerNetSelfAttention):
+    """
+    Window attention through `torch.nn.functional.scaled_dot_product_attention`.
+
+    The query, key and value projections run as one matmul against their concatenated weights, and the relative
+    position bias (plus the shifted-window mask, if any) is passed to SDPA as its additive `attn_mask`. The separate
+    `query`/`key`/`value` layers are kept so checkpoints load unchanged; at inference their parameters become views
+    into the concatenated weights (see `fuse_qkv_projection`), so the fused projection costs no extra memory. Falls
+    back to the eager implementation when attention probabilities or a head mask are requested, or when the
+    projections are no longer plain `nn.Linear` layers (e.g. after dynamic quantization).
+    """
+
+    def __init__(self, config, dim, num_heads, window_size):
+        super().__init__(config, dim, num_heads, window_size)
+        # concatenated (weight, bias) that the query/key/value parameters are views of, set by `fuse_qkv_projection`
+        self._qkv_projection = None
+
+    def fuse_qkv_projection(self):
+        """
+        Concatenate the query, key and value weights into one tensor and replace the three layers' parameters with views
+        of it. The weights are then stored once, in-place updates such as `load_state_dict` reach the fused tensor, and
+        the state dict keys are unchanged.
+        """
+        layers = (self.query, self.key, self.value)
+        with torch.no_grad():
+            weight = torch.cat([layer.weight for layer in layers])
+            bias = torch.cat([layer.bias for layer in layers]) if self.query.bias is not None else None
+        size = self.all_head_size
+        for index, layer in enumerate(layers):
+            rows = slice(index * size, (index + 1) * size)
+            layer.weight = nn.Parameter(weight[rows], requires_grad=layer.weight.requires_grad)
+            if bias is not None:
+                layer.bias = nn.Parameter(bias[rows], requires_grad=layer.bias.requires_grad)
+        self._qkv_projection = (weight, bias)
+
+    def _is_qkv_fused(self):
+        # moving or casting the module (`.to()`, `.half()`) gives every parameter its own new tensor
+        if self._qkv_projection is None:
+            return False
+        weight, bias = self._qkv_projection
+        for index, layer in enumerate((self.query, self.key, self.value)):
+            if layer.weight.data_ptr() != weight[index * self.all_head_size].data_ptr():
+                return False
+            if bias is not None and layer.bias.data_ptr() != bias[index * self.all_head_size].data_ptr():
+                return False
+        return True
+
+    def get_qkv_projection(self):
+        """
+        Concatenated `(weight, bias)` of the query, key and value projections. Without gradients the layers are fused
+        on first use (and again after the module is moved or cast); with gradients the live parameters are concatenated
+        on every call so they keep receiving gradients.
+        """
+        layers = (self.query, self.key, self.value)
+        params = [param for layer in layers for param in (layer.weight, layer.bias) if param is not None]
+        if (torch.is_grad_enabled() and any(param.requires_grad for param in params)) or torch.jit.is_tracing():
+            weight = torch.cat([layer.weight for layer in layers])
+            bias = torch.cat([layer.bias for layer in layers]) if self.query.bias is not None else None
+            return weight, bias
+
+        if not self._is_qkv_fused():
+            self.fuse_qkv_projection()
+        return self._qkv_projection
+
+    def forward(
+        self,
+        hidden_states: torch.Tensor,
+        attention_mask: Optional[torch.FloatTensor] = None,
+        head_mask: Optional[torch.FloatTensor] = None,
+        output_attentions: Optional[bool] = False,
+    ) -> Tuple[torch.Tensor]:
+        if (
+            output_attentions
+            or head_mask is not None
+            or not all(type(layer) is nn.Linear for layer in (self.query, self.key, self.value))
+        ):
+            return super().forward(hidden_states, attention_mask, head_mask, output_attentions)
+
+        batch_size, dim, num_channels = hidden_states.shape
+        weight, bias = self.get_qkv_projection()
+        mixed_qkv_layer = nn.functional.linear(hidden_states, weight, bias)
+        # (batch, tokens, 3 * all_head_size) -> 3 x (batch, heads, tokens, head_size), as strided views
+        query_layer, key_layer, value_layer = mixed_qkv_layer.view(
+            batch_size, dim, 3, self.num_attention_heads, self.attention_head_size
+        ).permute(2, 0, 3, 1, 4).unbind(0)
+
+        attn_mask = self.get_relative_position_bias()
+        if attention_mask is not None:
+            # (windows, heads, tokens, tokens), repeated for every image in the batch
+            attn_mask = (attention_mask.unsqueeze(1) + attn_mask).repeat(batch_size // attention_mask.shape[0], 1, 1, 1)
+        else:
+            # the CPU flash kernel only accepts 4D masks, a 3D one falls back to the slower math kernel
+            attn_mask = attn_mask.unsqueeze(0)
+
+        context_layer = nn.functional.scaled_dot_product_attention(
+            query_layer,
+            key_layer,
+            value_layer,
+            attn_mask=attn_mask.to(query_layer.dtype),
+            dropout_p=self.dropout.p if self.training else 0.0,
+        )
+        # SDPA already lays its output out as (batch, tokens, heads, head_size), so this is usually a view
+        context_layer = context_layer.transpose(1, 2).reshape(batch_size, dim, self.all_head_size)
+
+        return (context_layer,)
+
+
+UNIMERNET_SELF_ATTENTION_CLASSES = {
+    "eager": UnimerNetSelfAttention,
+    "sdpa": UnimerNetSdpaSelfAttention,
+}
+
+
 # Copied from transformers.models.swin.modeling_swin.SwinSelfOutput
 class UnimerNetSelfOutput(nn.Module):
     def __init__(self, config, dim):
@@ -481,7 +618,9 @@ class UnimerNetSelfOutput(nn.Module):
 class UnimerNetAttention(nn.Module):
     def __init__(self, config, dim, num_heads, window_size):
         super().__init__()
-        self.self = UnimerNetSelfAttention(config, dim, num_heads, window_size)
+        self.self = UNIMERNET_SELF_ATTENTION_CLASSES[config.window_attn_implementation](
+            config, dim, num_heads, window_size
+        )
         self.output = UnimerNetSelfOutput(config, dim)
         self.pruned_heads = set()
 
@@ -776,7 +915,7 @@ class UnimerNetEncoder(nn.Module):
         super().__init__()
         self.num_layers = len(config.depths)
         self.config = config
-        dpr = [x.item() for x in torch.linspace(0, config.drop_path_rate, sum(config.depths))]
+        dpr = [x.item() for x in torch.linspace(0, config.drop_path_rate, sum(config.depths), device="cpu")]
         self.layers = nn.ModuleList(
             [
                 UnimerNetStage(
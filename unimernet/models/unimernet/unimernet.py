@@ -1,6 +1,14 @@
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
 import torch
 import torch.nn.functional as F
+from transformers.modeling_outputs import BaseModelOutput
 from unimernet.common.registry import registry
+from unimernet.common.utils import is_url
 from unimernet.models.blip2_models.blip2 import Blip2Base
 from unimernet.models.unimernet.encoder_decoder import DonutEncoderDecoder, DonutTokenizer
 
@@ -32,15 +40,36 @@ class UniMERModel(Blip2Base):
         super().__init__()
 
         self.tokenizer = DonutTokenizer(tokenizer_config.path)
+        # decoder and encoder attention backends, part of the result cache key since the backends differ numerically
+        self.attn_implementation = model_config.get("attn_implementation", "eager")
+        self.encoder_attn_implementation = model_config.get("encoder_attn_implementation", "eager")
         self.model = DonutEncoderDecoder(
             model_config.model_name,
             num_tokens=len(self.tokenizer),
             bos_token_id=self.tokenizer.bos_token_id,
             pad_token_id=self.tokenizer.pad_token_id,
             eos_token_id=self.tokenizer.eos_token_id,
+            attn_implementation=self.attn_implementation,
+            encoder_attn_implementation=self.encoder_attn_implementation,
         )
         self.max_seq_len = model_config.max_seq_len
         self.tokenizer.max_seq_len = self.max_seq_len
+        # in-memory LRU of per-image encoder hidden states, keyed by image content hash
+        self.encoder_cache_size = model_config.get("encoder_cache_size", 16)
+        self.encoder_cache = OrderedDict()
+        # decode with a preallocated self-attention KV cache instead of growing it token by token
+        self.static_kv_cache = model_config.get("static_kv_cache", False)
+        # "int8_dynamic" quantizes the encoder and decoder linear layers at load time (CPU only)
+        self.quantization = model_config.get("quantization", None)
+        # greedy decoding drops finished sequences from the batch instead of padding them to the longest one
+        self.compact_decoding = model_config.get("compact_decoding", False)
+        # optional per-image cap on new tokens: length_cap_min + length_cap_ratio * content width in pixels
+        self.length_cap_ratio = model_config.get("length_cap_ratio", None)
+        self.length_cap_min = model_config.get("length_cap_min", 64)
+        # reduced precision on CPU/MPS: null, "auto", "bfloat16" or "float16" (CUDA always autocasts to float16)
+        self.autocast_dtype = model_config.get("autocast_dtype", None)
+        if self.autocast_dtype is not None:
+            self.keep_modules_fp32(model_config.get("autocast_fp32_modules", ["LayerNorm", "BatchNorm2d"]))
 
     def forward(self, samples):
         image, text = samples["image"], samples["text_input"]
@@ -71,25 +100,86 @@ class UniMERModel(Blip2Base):
             temperature: float = 0.2,
             do_sample: bool = False,
             top_p: float = 0.95,
+            static_cache: bool = None,
             **kwargs
     ):
 
         image = samples["image"]
         with self.maybe_autocast():
+            encoder_outputs = kwargs.pop("encoder_outputs", None)
+            if encoder_outputs is None:
+                encoder_outputs = self.encode(image)
             outputs = self.model.generate(
                 pixel_values=image,
+                encoder_outputs=encoder_outputs,
                 temperature=temperature,
                 max_new_tokens=self.max_seq_len,
                 decoder_start_token_id=self.tokenizer.tokenizer.bos_token_id,
                 # decoder_end_token_id=self.tokenizer.tokenizer.eos_token_id,
                 do_sample=do_sample,
                 top_p=top_p,
+                static_cache=self.static_kv_cache if static_cache is None else static_cache,
+                compact=self.compact_decoding,
+                max_lengths=self.predict_max_lengths(image),
                 **kwargs
             )
         pred_tokens = self.tokenizer.detokenize(outputs)
         pred_str = self.tokenizer.token2str(outputs)
         return {"pred_tokens": pred_tokens, "pred_str": pred_str, "pred_ids": outputs}
 
+    @staticmethod
+    def content_widths(image):
+        """
+        Width in pixels of the formula in each preprocessed image. The eval processor pads the resized crop with
+        black, which normalizes to the per-image minimum; every content column also contains lighter background.
+        """
+        padding = image.amin(dim=(1, 2, 3), keepdim=True)
+        columns = (image > padding + 1e-3).any(dim=2).any(dim=1)
+        return columns.sum(dim=-1)
+
+    def predict_max_lengths(self, image):
+        """
+        Per-image cap on the number of new tokens derived from the content width, or None when disabled.
+        Formulas are resized to a fixed height, so the token count of a single-line formula grows with its width.
+        """
+        if self.length_cap_ratio is None:
+            return None
+        widths = self.content_widths(image).float()
+        max_lengths = (self.length_cap_min + self.length_cap_ratio * widths).ceil().long()
+        return max_lengths.clamp(max=self.max_seq_len)
+
+    @staticmethod
+    def _image_key(image):
+        image = image.detach().cpu().contiguous()
+        digest = hashlib.sha256()
+        digest.update(f"{tuple(image.shape)}|{image.dtype}".encode())
+        digest.update(image.numpy().tobytes())
+        return digest.hexdigest()
+
+    @torch.no_grad()
+    def encode(self, image):
+        """
+        Run the vision encoder on a batch of images, reusing cached hidden states of images seen recently.
+        Only cache misses go through the encoder, so re-decoding an image with other generation settings is decoder-only.
+        """
+        if self.encoder_cache_size <= 0:
+            return self.model.encode(image)
+
+        keys = [self._image_key(x) for x in image]
+        missing = [i for i, key in enumerate(keys) if key not in self.encoder_cache]
+        if missing:
+            hidden_states = self.model.encode(image[missing]).last_hidden_state
+            for i, hidden_state in zip(missing, hidden_states):
+                self.encoder_cache[keys[i]] = hidden_state
+
+        hidden_states = []
+        for key in keys:
+            self.encoder_cache.move_to_end(key)
+            hidden_states.append(self.encoder_cache[key])
+        while len(self.encoder_cache) > self.encoder_cache_size:
+            self.encoder_cache.popitem(last=False)
+        return BaseModelOutput(last_hidden_state=torch.stack(hidden_states))
+
     @classmethod
     def from_config(cls, cfg):
 
@@ -98,13 +188,160 @@ class UniMERModel(Blip2Base):
         tokenizer_name = cfg.get("tokenizer_name")
         tokenizer_config = cfg.get("tokenizer_config")
 
-        model = cls(
+        kwargs = dict(
             model_name=model_name,
             model_config=model_config,
             tokenizer_name=tokenizer_name,
             tokenizer_config=tokenizer_config
         )
 
-        model.load_checkpoint_from_config(cfg)
+        start = time.perf_counter()
+        checkpoint = cls.meta_init_checkpoint(cfg)
+        if checkpoint is not None:
+            # build without allocating or initializing weights, the mapped checkpoint tensors become the parameters
+            with torch.device("meta"):
+                model = cls(**kwargs)
+            constructed = time.perf_counter()
+            model.load_mmap_checkpoint(checkpoint)
+        else:
+            model = cls(**kwargs)
+            constructed = time.perf_counter()
+            if model.quantization is None:
+                model.load_checkpoint_from_config(cfg)
+            elif model.quantization == "int8_dynamic":
+                model.load_quantized_checkpoint(cfg, save=model_config.get("save_quantized", False))
+            else:
+                raise ValueError(f"Unsupported quantization: {model.quantization}")
 
+        if model_config.get("grayscale_stem", False):
+            model.model.fold_grayscale_stem()
+
+        # seconds spent building modules and loading weights, reported in the startup log
+        model.load_timings = {"construct": constructed - start, "weights": time.perf_counter() - constructed}
         return model
+
+    @staticmethod
+    def meta_init_checkpoint(cfg):
+        """
+        The checkpoint to assign to a model built on the meta device, or None to build a randomly initialized model and
+        copy the checkpoint into it. A `.safetensors` file next to `pretrained` written by `tools/fp32tofp16.py` is
+        preferred while it is newer than the pickled checkpoint. Quantized models and finetuned checkpoints keep the old
+        path, and `skip_weight_init: False` in the model config forces it.
+        """
+        model_config = cfg.get("model_config")
+        pretrained = cfg.get("pretrained", None)
+        if (
+            not pretrained
+            or is_url(pretrained)
+            or not model_config.get("skip_weight_init", True)
+            or model_config.get("quantization", None) is not None
+            or not cfg.get("load_pretrained", True)
+            or cfg.get("load_finetuned", False)
+        ):
+            return None
+        converted = os.path.splitext(pretrained)[0] + ".safetensors"
+        if (
+            model_config.get("mmap_checkpoint", True)
+            and not pretrained.endswith(".safetensors")
+            and os.path.isfile(converted)
+            and (not os.path.isfile(pretrained) or os.path.getmtime(converted) >= os.path.getmtime(pretrained))
+        ):
+            return converted
+        return pretrained if os.path.isfile(pretrained) else None
+
+    def load_mmap_checkpoint(self, filename):
+        """
+        Assign a memory-mapped checkpoint to a model built on the meta device. Output embeddings are
+        re-tied to the input embeddings, and any parameter missing from the checkpoint is allocated on CPU and
+        initialized the way the randomly initialized model would have been. Buffers such as `relative_position_index`
+        are computed in `__init__` and cannot be rebuilt here, so a checkpoint missing one is rejected.
+        """
+        msg = self.load_checkpoint_mmap(filename)
+        vision_model = self.model.model
+        # the decoder ties its own output embeddings, the encoder-decoder wrapper only ties encoder to decoder
+        vision_model.decoder.tie_weights()
+
+        missing_buffers = [name for name, tensor in self.named_buffers() if tensor.is_meta]
+        if missing_buffers:
+            raise RuntimeError(
+                f"Buffers missing from '{filename}': {missing_buffers}. Set `skip_weight_init: False` in the model "
+                f"config to load it into a regularly constructed model."
+            )
+        missing = [name for name, tensor in self.named_parameters() if tensor.is_meta]
+        if missing:
+            logging.warning(f"Missing keys in '{filename}' are randomly initialized: {missing}")
+            for submodel in (vision_model.encoder, vision_model.decoder):
+                for module in submodel.modules():
+                    params = dict(module.named_parameters(recurse=False))
+                    if not any(param.is_meta for param in params.values()):
+                        continue
+                    # initialize on fresh CPU tensors, then put the loaded (mapped) parameters back so the
+                    # initializers never write into them
+                    for name, param in params.items():
+                        setattr(module, name, torch.nn.Parameter(
+                            torch.empty_like(param, device="cpu"), requires_grad=param.requires_grad
+                        ))
+                    if hasattr(module, "reset_parameters"):
+                        module.reset_parameters()
+                    submodel._init_weights(module)
+                    for name, param in params.items():
+                        if not param.is_meta:
+                            setattr(module, name, param)
+        return msg
+
+    def quantize_dynamic_int8(self):
+        """
+        Replace the nn.Linear layers of the vision encoder (attention, MLP, patch merging) and of the MBart decoder
+        with dynamically quantized int8 versions. Weights are stored in int8 and activations are quantized on the fly,
+        so this only runs on CPU. The decoder's `lm_head` stays in floating point so it keeps sharing its weight with
+        `embed_tokens`.
+        """
+        vision_model = self.model.model
+        qconfig = torch.ao.quantization.default_dynamic_qconfig
+        for name in ("encoder", "decoder"):
+            qconfig_spec = {torch.nn.Linear: qconfig}
+            if name == "decoder":
+                # a name entry overrides the type entry, None leaves the module unquantized
+                qconfig_spec["lm_head"] = None
+            module = torch.ao.quantization.quantize_dynamic(
+                getattr(vision_model, name), qconfig_spec, dtype=torch.qint8, inplace=True
+            )
+            setattr(vision_model, name, module)
+        return self
+
+    @staticmethod
+    def _checkpoint_signature(filename):
+        """Size and modification time of the checkpoint a quantized state dict was made from."""
+        stat = os.stat(filename)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def load_quantized_checkpoint(self, cfg, save=False):
+        """
+        Load pretrained weights and quantize them with `quantize_dynamic_int8`.
+
+        The quantized state dict is kept next to the pretrained checkpoint (`*.int8_dynamic.pth`) together with the
+        size and modification time of the checkpoint it was made from. When `save` is set, it is written after
+        quantizing and reused on later loads as long as it matches the pretrained checkpoint, which skips loading the
+        fp32 weights altogether. It is read with `weights_only=True`, so the file cannot run code when loaded.
+        """
+        pretrained = cfg.get("pretrained")
+        quantized = os.path.splitext(pretrained)[0] + ".int8_dynamic.pth"
+        signature = self._checkpoint_signature(pretrained)
+        if save and os.path.isfile(quantized):
+            try:
+                saved = torch.load(quantized, map_location="cpu", weights_only=True)
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable quantized model '{quantized}': {e}")
+                saved = None
+            if isinstance(saved, dict) and saved.get("source") == signature:
+                self.quantize_dynamic_int8()
+                self.load_state_dict(saved["model"])
+                logging.info(f"Loaded quantized model '{quantized}'.")
+                return
+            logging.info(f"Quantized model '{quantized}' does not match '{pretrained}', quantizing again.")
+
+        self.load_checkpoint_from_config(cfg)
+        self.quantize_dynamic_int8()
+        if save:
+            torch.save({"source": signature, "model": self.state_dict()}, quantized)
+            logging.info(f"Saved quantized model '{quantized}'.")
@@ -8,6 +8,11 @@ import cv2
 from PIL import Image, ImageOps
 from torchvision.transforms.functional import resize
 import random
+import torch
+
+# grayscale mean and std of the training images, in [0, 1]
+FORMULA_IMAGE_MEAN = 0.7931
+FORMULA_IMAGE_STD = 0.1738
 
 
 class FormulaImageBaseProcessor(BaseProcessor):
@@ -32,6 +37,69 @@ class FormulaImageBaseProcessor(BaseProcessor):
         a, b, w, h = cv2.boundingRect(coords)  # Find minimum spanning bounding box
         return img.crop((a, b, w + a, h + b))
 
+    @staticmethod
+    def margin_bbox(data: np.ndarray):
+        """
+        Bounding box `(left, top, right, bottom)` of the text in a uint8 grayscale array, or None for a flat image.
+
+        Same box as `crop_margin`, but the contrast stretch is reduced to a single threshold and the box is found with
+        row/column reductions instead of collecting the coordinates of every text pixel.
+        """
+        max_val = data.max()
+        min_val = data.min()
+        if max_val == min_val:
+            return None
+        # crop_margin keeps pixels whose stretched value is below 200; the stretch is monotonic, so evaluate it once
+        # per gray level (with the same float arithmetic) and take the first level that is no longer text
+        levels = np.arange(min_val, int(max_val) + 1, dtype=np.uint8)
+        threshold = int(min_val) + int(np.argmin((levels - min_val) / (max_val - min_val) * 255 < 200))
+        text = data < threshold
+        rows = np.flatnonzero(text.any(axis=1))
+        cols = np.flatnonzero(text.any(axis=0))
+        return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+    def prepare_gray(self, img: Image.Image, random_padding: bool = False):
+        """
+        Same steps as `prepare_input` followed by `ToGray`, returning the padded uint8 grayscale array of shape
+        `input_size`, or None.
+
+        The margin is found on the grayscale image with `margin_bbox`, and only the cropped and resized image is
+        converted to gray, so the output is bit-identical to the albumentations pipeline. Padding goes straight into
+        the output canvas instead of through `ImageOps.expand`.
+        """
+        if img is None:
+            return
+        try:
+            img = img if img.mode == "RGB" else img.convert("RGB")
+            bbox = self.margin_bbox(np.asarray(img.convert("L")))
+        except OSError:
+            # might throw an error for broken files
+            return
+        if bbox is not None:
+            img = img.crop(bbox)
+
+        if img.height == 0 or img.width == 0:
+            return
+
+        img = resize(img, min(self.input_size))
+        img.thumbnail((self.input_size[1], self.input_size[0]))
+        delta_width = self.input_size[1] - img.width
+        delta_height = self.input_size[0] - img.height
+        if random_padding:
+            pad_width = np.random.randint(low=0, high=delta_width + 1)
+            pad_height = np.random.randint(low=0, high=delta_height + 1)
+        else:
+            pad_width = delta_width // 2
+            pad_height = delta_height // 2
+        # ImageOps.expand pads with black
+        canvas = np.zeros(self.input_size, dtype=np.uint8)
+        cv2.cvtColor(
+            np.asarray(img),
+            cv2.COLOR_RGB2GRAY,
+            dst=canvas[pad_height:pad_height + img.height, pad_width:pad_width + img.width],
+        )
+        return canvas
+
     def prepare_input(self, img: Image.Image, random_padding: bool = False):
         """
         Convert PIL Image to tensor according to specified input_size after following steps below:
@@ -152,16 +220,35 @@ class FormulaImageEvalProcessor(FormulaImageBaseProcessor):
 
         self.transform = alb.Compose(
             [
-                alb.ToGray(always_apply=True),
-                alb.Normalize((0.7931, 0.7931, 0.7931), (0.1738, 0.1738, 0.1738)),
+                # albumentations 2.x ignores always_apply, so p=1.0 keeps eval preprocessing deterministic
+                alb.ToGray(p=1.0),
+                alb.Normalize((FORMULA_IMAGE_MEAN,) * 3, (FORMULA_IMAGE_STD,) * 3),
                 # alb.Sharpen()
                 ToTensorV2(),
             ]
         )
+        # the uint8 -> float normalization above as a 256-entry lookup table, taken from albumentations itself so the
+        # fast path below produces bit-identical values
+        ramp = np.repeat(np.arange(256, dtype=np.uint8).reshape(1, 256, 1), 3, axis=2)
+        normalize = alb.Normalize((FORMULA_IMAGE_MEAN,) * 3, (FORMULA_IMAGE_STD,) * 3)
+        self.normalize_lut = normalize(image=ramp)["image"][0, :, 0].astype(np.float32)
 
     def __call__(self, item):
-        image = self.prepare_input(item)
-        return self.transform(image=np.array(image))['image'][:1]
+        """
+        Preprocess one PIL image into a `(1, H, W)` tensor, or a list of images into a `(N, 1, H, W)` tensor.
+
+        Only one grayscale channel is produced (`prepare_gray`), and the normalized values are written straight into
+        the output tensor through a lookup table instead of normalizing three channels and keeping the first.
+        """
+        batched = isinstance(item, (list, tuple))
+        items = item if batched else [item]
+        output = torch.empty((len(items), 1, *self.input_size), dtype=torch.float32)
+        for index, image in enumerate(items):
+            canvas = self.prepare_gray(image)
+            if canvas is None:
+                raise ValueError("cannot preprocess an empty or unreadable image")
+            np.take(self.normalize_lut, canvas, out=output[index, 0].numpy())
+        return output if batched else output[0]
 
     @classmethod
     def from_config(cls, cfg=None):